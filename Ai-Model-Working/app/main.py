@@ -3,12 +3,18 @@ FastAPI Main Application
 AI Microservice for Eczema Detection
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
 import uvicorn
+import asyncio
+import contextlib
+import json
 import os
+import time
+from typing import Any, Dict, Optional, Tuple
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 from app.services.model_service import ModelService
@@ -16,8 +22,28 @@ from app.services.relevance_detector import RelevanceDetector
 from app.services.severity_estimator import SeverityEstimator
 from app.services.uncertainty_detector import UncertaintyDetector
 from app.services.llm_service import LLMService
-from app.schemas.response import AnalysisResponse, ErrorResponse
-from app.utils.image_processor import ImageProcessor
+from app.services.gemini_speculation import SpeculationPolicy
+from app.services.pipeline_executor import PipelineExecutor, PipelineAborted, build_analysis_stages
+from app.services.cv_executor import CVExecutor
+from app.services.ood_scorer import embedding_mode_requested, load_ood_scorer
+from app.services.job_queue import CallbackRejected, JobQueue, JobError, job_payload
+from app.services.near_duplicate_index import NearDuplicateIndex
+from app.services.embedding_store import embedding_store_requested, load_embedding_store
+from app.services.decision_policy import decide
+from app.services.decision_log import DecisionLog
+from app.services.request_profiler import RequestProfiler, speedscope_to_folded
+from app.services.traffic_capture import TrafficCapture
+from app.services.admission_controller import AdmissionController, AdmissionRejected
+from app.services.quality_governor import QualityGovernor
+from app.services.disconnect_guard import ClientDisconnected, DisconnectGuard, DisconnectWatch
+from app.services.uncertainty_detector import UncertaintyFactors
+from app.schemas.response import (
+    AnalysisResponse, ErrorResponse, JobSubmitResponse, JobStatusResponse, ProgressAnalysisResponse, ProgressMatch
+)
+from app.utils.image_processor import ImageProcessor, UploadRejected
+from app.utils.upload_limit import UploadSizeLimit
+from app.utils.buffer_pool import PlanePool
+from app.utils.perceptual_hash import perceptual_hashes
 
 # Load environment variables
 load_dotenv()
@@ -29,12 +55,26 @@ severity_estimator = None
 uncertainty_detector = None
 llm_service = None
 image_processor = None
+pipeline_executor = None
+speculation_policy = None
+plane_pool = None
+cv_executor = None
+job_queue = None
+ood_scorer = None
+near_duplicate_index = None
+embedding_store = None
+decision_log = None
+request_profiler = None
+traffic_capture = None
+admission_controller = None
+quality_governor = None
+disconnect_guard = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for startup and shutdown"""
-    global model_service, relevance_detector, severity_estimator, uncertainty_detector, llm_service, image_processor
+    global model_service, relevance_detector, severity_estimator, uncertainty_detector, llm_service, image_processor, pipeline_executor, speculation_policy, plane_pool, cv_executor, job_queue, ood_scorer, near_duplicate_index, embedding_store, decision_log, request_profiler, traffic_capture, admission_controller, quality_governor, disconnect_guard
     
     # Startup
     try:
@@ -42,7 +82,8 @@ async def lifespan(app: FastAPI):
         model_path = os.getenv("MODEL_PATH", "models/eczema_detector_efficientnet.h5")
         if os.path.exists(model_path):
             print(f"Loading model from {model_path}...")
-            model_service = ModelService(model_path)
+            # UNCERTAINTY_MODE=embedding and the embedding store need the penultimate-layer output as well
+            model_service = ModelService(model_path, return_embedding=embedding_mode_requested() or embedding_store_requested() or None)
             await model_service.load_model()
             print("✅ Model loaded successfully")
         else:
@@ -52,9 +93,18 @@ async def lifespan(app: FastAPI):
             model_service = None
         
         # Initialize other services (always available)
-        relevance_detector = RelevanceDetector()
-        severity_estimator = SeverityEstimator()
-        uncertainty_detector = UncertaintyDetector()  # NEW: Uncertainty detection service
+        # One pool of reusable CV planes shared by the three heuristic detectors
+        plane_pool = PlanePool()
+        # Thread / process offload for the CV stages (CV_EXECUTOR, CV_PROCESS_STAGES)
+        cv_executor = CVExecutor()
+        cv_executor.warm_up()
+        relevance_detector = RelevanceDetector(plane_pool=plane_pool, cv_executor=cv_executor)
+        severity_estimator = SeverityEstimator(plane_pool=plane_pool, cv_executor=cv_executor)
+        # Embedding OOD scorer replaces the CV uncertainty heuristics when UNCERTAINTY_MODE=embedding
+        ood_scorer = load_ood_scorer(model_service)
+        uncertainty_detector = UncertaintyDetector(plane_pool=plane_pool, cv_executor=cv_executor, ood_scorer=ood_scorer)  # NEW: Uncertainty detection service
+        # Per-subject embedding history for /analyze/progress (EMBEDDING_STORE_DIR)
+        embedding_store = load_embedding_store(model_service)
         
         # Official Google Gemini API key from AI Studio (https://aistudio.google.com/app)
         gemini_api_key = os.getenv("GEMINI_API_KEY")
@@ -62,11 +112,60 @@ async def lifespan(app: FastAPI):
         # IMPORTANT: Gemma models do NOT support vision! Use Gemini models for image analysis.
         gemini_model = os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
         llm_service = LLMService(gemini_api_key, gemini_model)
+        # Speculative mode: start Gemini vision in parallel with local inference
+        speculation_policy = SpeculationPolicy()
+        
+        # Resize to the size the loaded model actually expects (read from its input signature)
+        image_processor = ImageProcessor(target_size=model_service.input_size if model_service is not None else None)
+        
+        # Perceptual-hash index of recent analyses (re-photographed / re-encoded uploads)
+        near_duplicate_index = NearDuplicateIndex()
+        
+        # Inputs of every decision, for offline threshold replays (replay_decisions.py)
+        try:
+            decision_log = DecisionLog()
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Warning: Decision log disabled: {e}")
+            decision_log = None
+        
+        # On-demand request profiles (PROFILE_HEADER / PROFILE_SAMPLE_RATE)
+        request_profiler = RequestProfiler()
+        # Anonymized workload records for replay_traffic.py (TRAFFIC_CAPTURE_SAMPLE_RATE)
+        try:
+            traffic_capture = TrafficCapture()
+        except OSError as e:
+            print(f"⚠️  Warning: Traffic capture disabled: {e}")
+            traffic_capture = None
         
-        image_processor = ImageProcessor()
+        # Bounded in-flight analyses with interactive / bulk queues (ADMISSION_MAX_IN_FLIGHT)
+        admission_controller = AdmissionController()
+        # full / standard / fast pipeline profiles, stepped down under overload
+        quality_governor = QualityGovernor()
+        # Cancels the remaining work of requests whose client disconnected
+        disconnect_guard = DisconnectGuard()
+        
+        # Stage graph executor: "parallel" (default) or "sequential" (for benchmarking)
+        pipeline_executor = PipelineExecutor()
+        
+        # Durable job queue for /analyze/jobs (re-queues jobs interrupted by a restart)
+        job_queue = JobQueue(run_analysis_job)
+        await job_queue.start()
         
         print("✅ All services initialized successfully")
         print("✅ Uncertainty detection enabled")
+        print(f"✅ Pipeline mode: {pipeline_executor.mode} ({pipeline_executor.max_workers} workers)")
+        print(f"✅ Job queue: {job_queue.db_path} ({job_queue.workers} workers)")
+        if speculation_policy.enabled:
+            print("✅ Speculative Gemini prefetch enabled")
+        if admission_controller.enabled:
+            print(f"✅ Admission control: {admission_controller.max_in_flight} in flight, "
+                  f"queues {admission_controller.max_queue['interactive']} interactive / {admission_controller.max_queue['bulk']} bulk")
+        if near_duplicate_index.enabled:
+            print(f"✅ Near-duplicate reuse: {near_duplicate_index.reuse} (max distance {near_duplicate_index.max_distance})")
+        if request_profiler.sample_rate > 0:
+            print(f"✅ Request profiling: 1 in {request_profiler.sample_rate} requests → {request_profiler.directory}")
+        if traffic_capture is not None and traffic_capture.enabled:
+            print(f"✅ Traffic capture: 1 in {traffic_capture.sample_rate} requests → {traffic_capture.path}")
     except Exception as e:
         print(f"❌ Error initializing services: {e}")
         # Don't raise - allow service to start even if some services fail
@@ -76,6 +175,18 @@ async def lifespan(app: FastAPI):
     
     # Shutdown (if needed)
     print("Shutting down services...")
+    if job_queue is not None:
+        await job_queue.stop()
+    if pipeline_executor is not None:
+        pipeline_executor.shutdown()
+    if cv_executor is not None:
+        cv_executor.shutdown()
+    if embedding_store is not None:
+        embedding_store.close()
+    if decision_log is not None:
+        decision_log.close()
+    if traffic_capture is not None:
+        traffic_capture.close()
 
 
 # Initialize FastAPI app with lifespan
@@ -96,6 +207,42 @@ app.add_middleware(
 )
 
 
+# Multipart framing allowance on top of the image byte limit
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+def upload_body_limit() -> Optional[Tuple[int, str]]:
+    """
+    Body limit of POST requests: rejected while being received (declared Content-Length
+    before anything is read, chunked bodies once they pass it), before multipart spooling
+    """
+    if image_processor is None:
+        return None
+    return (
+        image_processor.max_file_size + MULTIPART_OVERHEAD_BYTES,
+        f"Image file is too large. Maximum size is {image_processor.max_file_size // (1024 * 1024)}MB."
+    )
+
+
+# Keep middlewares pure ASGI: an @app.middleware("http") function wraps receive and
+# hides client disconnects from DisconnectGuard (checked by test_disconnect.py)
+app.add_middleware(UploadSizeLimit, limit=upload_body_limit)
+
+
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    """Nobody reads this response; 499 (client closed request) keeps access logs honest"""
+    return JSONResponse(status_code=499, content={"detail": str(exc)})
+
+
+def skipped_work() -> Dict[str, int]:
+    """Work dropped by cancelled requests (client disconnects, cancelled speculative calls)"""
+    return {
+        "pipeline_stages": pipeline_executor.stats["stages_cancelled"] if pipeline_executor is not None else 0,
+        "gemini_calls": llm_service.stats["cancelled_calls"] if llm_service is not None else 0,
+    }
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -108,17 +255,32 @@ async def health_check():
         "service": "eczema-detection-ai",
         "model_loaded": model_status,
         "model_path": os.getenv("MODEL_PATH", "models/eczema_detector_efficientnet.h5"),
-        "model_exists": os.path.exists(os.getenv("MODEL_PATH", "models/eczema_detector_efficientnet.h5"))
+        "model_exists": os.path.exists(os.getenv("MODEL_PATH", "models/eczema_detector_efficientnet.h5")),
+        "pipeline_mode": pipeline_executor.mode if pipeline_executor is not None else None,
+        "gemini_speculation": speculation_policy.stats if speculation_policy is not None and speculation_policy.enabled else None,
+        "buffer_pool": plane_pool.snapshot() if plane_pool is not None else None,
+        "cv_executor": cv_executor.describe() if cv_executor is not None else None,
+        "uncertainty_mode": "embedding" if ood_scorer is not None else "heuristic",
+        "ood_reference": ood_scorer.describe() if ood_scorer is not None else None,
+        "near_duplicates": near_duplicate_index.snapshot() if near_duplicate_index is not None else None,
+        "embedding_store": embedding_store.describe() if embedding_store is not None else None,
+        "profiler": request_profiler.describe() if request_profiler is not None else None,
+        "traffic_capture": traffic_capture.describe() if traffic_capture is not None and traffic_capture.enabled else None,
+        "decode_budget": image_processor.pixel_budget.describe() if image_processor is not None and image_processor.pixel_budget.enabled else None,
+        "admission": admission_controller.describe() if admission_controller is not None and admission_controller.enabled else None,
+        "quality": quality_governor.describe() if quality_governor is not None else None,
+        "disconnects": {**disconnect_guard.describe(), "skipped": skipped_work()} if disconnect_guard is not None and disconnect_guard.enabled else None,
+        "jobs": await job_queue.stats() if job_queue is not None and job_queue.store is not None else None
     }
 
 
 @app.post("/analyze", response_model=AnalysisResponse)
-async def analyze_image(file: UploadFile = File(...)):
+async def analyze_image(request: Request, response: Response, file: UploadFile = File(...)):
     """
     Analyze uploaded image for eczema detection
     
-    RESTRUCTURED INFERENCE PIPELINE (STRICT ORDER):
-    1. Image validation (format, size)
+    RESTRUCTURED INFERENCE PIPELINE:
+    1. Image validation (format, byte size, header dimensions - before decoding)
     2. Human skin / face relevance check (FIXED: accepts faces)
     3. Model inference (binary)
     4. Confidence band evaluation
@@ -126,38 +288,224 @@ async def analyze_image(file: UploadFile = File(...)):
     6. Final decision mapping (Eczema | Normal | Uncertain)
     7. Explanation generation (LLM-assisted with uncertainty handling)
     
+    Steps 2-3 and the image-only parts of steps 5 and severity depend only on the
+    processed image; they run as a stage graph (concurrently in parallel mode) and
+    are joined at step 4. A relevance rejection cancels the remaining stages.
+    
+    In speculative mode (GEMINI_SPECULATIVE=true) a model-agnostic Gemini vision
+    request starts as soon as relevance passes and runs alongside inference; its
+    verdict feeds the override logic unless the speculation policy cancels it.
+    
+    Requests with the profiling header (PROFILE_HEADER, e.g. X-Profile: 1) or
+    picked by PROFILE_SAMPLE_RATE are profiled across all threads; the profile ID
+    is returned in the X-Profile-Id header (see GET /profiles). Requests sampled by
+    TRAFFIC_CAPTURE_SAMPLE_RATE are recorded for replay_traffic.py.
+    
+    At most ADMISSION_MAX_IN_FLIGHT analyses run at once; others wait in the lane
+    named by the lane header (X-Priority: interactive | bulk) and get 429 with
+    Retry-After when that lane's queue is full.
+    
+    The pipeline profile (full | standard | fast) comes from the quality header
+    (X-Quality-Profile) or QUALITY_DEFAULT_PROFILE, lowered automatically while the
+    admission queue or the p95 latency is over its threshold; the response reports it.
+    
+    If the client disconnects meanwhile (DISCONNECT_POLL_SECONDS), the request is cancelled:
+    its slot or queue place is given up, stages not yet started and Gemini requests are dropped.
+    
     Returns:
         AnalysisResponse with prediction: "Eczema" | "Normal" | "Uncertain"
     """
+    async with contextlib.AsyncExitStack() as stack:
+        watch = await watch_disconnect(stack, request)
+        trigger = request_profiler.trigger(request.headers) if request_profiler is not None else None
+        if trigger is not None:
+            response.headers["X-Profile-Id"] = await stack.enter_async_context(
+                request_profiler.capture("analyze", trigger)
+            )
+        captured = None
+        if traffic_capture is not None:
+            captured = await stack.enter_async_context(traffic_capture.capture(request.headers))
+        start = time.perf_counter()
+        await enter_analysis_slot(stack, request)
+        watch.phase = "analysis"
+        profile = choose_quality_profile(request)
+        
+        image_bytes = await read_image_upload(file)
+        if captured is not None:
+            captured.image_bytes = image_bytes
+        analysis = await run_analysis(
+            image_bytes,
+            details=captured.details if captured is not None else None,
+            profile=profile
+        )
+        if captured is not None:
+            captured.analysis = analysis
+        if quality_governor is not None:
+            quality_governor.observe((time.perf_counter() - start) * 1000.0)
+        return analysis
+
+
+async def watch_disconnect(stack: contextlib.AsyncExitStack, request: Request) -> DisconnectWatch:
+    """
+    Cancel the rest of the stack's block when the client disconnects; enter it first,
+    so every later context (slot, capture, profile) unwinds before ClientDisconnected
+    """
+    if disconnect_guard is None:
+        return DisconnectWatch()
+    return await stack.enter_async_context(disconnect_guard.watch(request))
+
+
+async def enter_analysis_slot(stack: contextlib.AsyncExitStack, request: Request):
+    """
+    Wait for an analysis slot in the request's lane, held until the stack exits
+    
+    Raises:
+        HTTPException: 429 with Retry-After when the lane's queue is full or the wait times out
+    """
+    if admission_controller is None:
+        return
+    lane = admission_controller.lane_of(request.headers)
+    try:
+        await stack.enter_async_context(admission_controller.slot(lane))
+    except AdmissionRejected as rejected:
+        raise HTTPException(
+            status_code=429,
+            detail=rejected.message,
+            headers={"Retry-After": str(rejected.retry_after)}
+        )
+
+
+def choose_quality_profile(request: Request) -> str:
+    """Pipeline profile of a request: the one it asks for, capped by the overload step-down"""
+    if quality_governor is None:
+        return "full"
+    queue_depth = admission_controller.queue_depth if admission_controller is not None else 0
+    profile, _ = quality_governor.choose(quality_governor.requested(request.headers), queue_depth)
+    return profile
+
+
+async def read_image_upload(file: UploadFile) -> bytes:
+    """
+    STEP 1 (upload part): content type check and streamed read
+    
+    Shared by /analyze and /analyze/jobs, so both reject bad uploads before
+    anything is decoded or queued.
+    """
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file type. Please upload an image file."
+        )
+    
+    # Read image in chunks: byte limit enforced while reading, header
+    # (format, dimensions, pixel count) checked before any full decode
+    try:
+        return await image_processor.read_upload(file)
+    except UploadRejected as rejected:
+        raise HTTPException(status_code=rejected.status_code, detail=rejected.message)
+
+
+async def run_analysis(
+    image_bytes: bytes,
+    details: Optional[Dict[str, Any]] = None,
+    profile: str = "full"
+) -> AnalysisResponse:
+    """
+    Run the analysis pipeline on upload bytes (steps 1-7 of /analyze)
+    
+    Called directly by /analyze, by /analyze/progress and by the job workers behind /analyze/jobs.
+    
+    Args:
+        image_bytes: Upload bytes
+        details: Optional dict filled with what the response does not carry:
+            "sha256" of the upload, the model "embedding" (when returned), the upload
+            "image" format and dimensions, "timings_ms" (decode, stage completion offsets
+            within the stage graph, gemini) and the "gemini" outcome
+        profile: Quality profile: "full" (everything), "standard" (no Gemini vision,
+            text-only explanation) or "fast" (relevance, model and confidence band only,
+            rule-based explanation)
+    
+    Raises:
+        HTTPException: 400 for invalid images, 503 without a model, 500 on errors
+    """
+    speculative_call = None
+    near_duplicate = None
+    upload = None
+    timings = {}
+    if details is not None:
+        details["timings_ms"] = timings
+    
+    def on_stage_complete(stage_name, result):
+        nonlocal speculative_call
+        timings[stage_name] = round((time.perf_counter() - graph_start) * 1000.0, 1)
+        # A near-duplicate's stored verdict replaces the vision call
+        if stage_name == "relevance" and result[0] and near_duplicate is None and profile == "full":
+            speculative_call = speculation_policy.start(llm_service, upload)
+    
     try:
         # ============================================
-        # STEP 1: Image Validation (format, size)
+        # STEP 1: Image Validation (decode)
         # ============================================
-        if not file.content_type or not file.content_type.startswith("image/"):
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid file type. Please upload an image file."
-            )
-        
-        # Read image
-        image_bytes = await file.read()
+        try:
+            # Decode once: format, MIME type, dimensions, hash and canonical uint8 pixels
+            # are shared by every later stage (no further decodes of image_bytes)
+            decode_start = time.perf_counter()
+            upload = await image_processor.decode_upload(image_bytes)
+            timings["decode"] = round((time.perf_counter() - decode_start) * 1000.0, 1)
+        except UploadRejected as rejected:
+            raise HTTPException(status_code=rejected.status_code, detail=rejected.message)
         
-        # Process image
-        processed_image = await image_processor.process_image(image_bytes)
-        
-        if processed_image is None:
+        if upload is None:
             raise HTTPException(
                 status_code=400,
                 detail="Failed to process image. Please ensure it's a valid image file."
             )
         
+        # Canonical uint8 image shared by every stage (ModelService normalizes at the model boundary)
+        processed_image = upload.pixels
+        if profile != "full" or not llm_service.reads_decoded_image:
+            # No Gemini re-encode will read the full-resolution decode: return its pixels now
+            upload.release_image()
+        if details is not None:
+            details["sha256"] = upload.sha256
+            details["image"] = {"format": upload.format, "width": upload.width, "height": upload.height}
+        
+        # Near-duplicate of a recent analysis (same lesion re-photographed, re-encoded copy)?
+        hashes = None
+        if near_duplicate_index is not None and near_duplicate_index.enabled:
+            hashes = perceptual_hashes(processed_image)
+            near_duplicate = near_duplicate_index.lookup(hashes, upload.sha256)
+            if near_duplicate is not None:
+                print(f"\n♻️ Near-duplicate of a recent analysis (reuse: {near_duplicate_index.reuse})")
+                # Its stored verdict replaces the vision request
+                upload.release_image()
+                if near_duplicate_index.reuse == "response":
+                    if details is not None and near_duplicate.embedding is not None:
+                        details["embedding"] = near_duplicate.embedding
+                    return near_duplicate.response.model_copy()
+        
         # ============================================
-        # STEP 2: Human Skin / Face Relevance Check
-        # FIXED: Now accepts face images and all human skin areas
+        # STEPS 2-3 (+ image-only heuristics): Stage Graph
+        # Relevance, inference and image-only features depend only on the
+        # processed image, so they are independent nodes of the graph
         # ============================================
-        is_relevant, relevance_reason = await relevance_detector.check_relevance(processed_image)
+        model_available = model_service is not None and model_service.is_loaded()
         
-        if not is_relevant:
+        stages = build_analysis_stages(
+            processed_image,
+            relevance_detector,
+            model_service if model_available else None,
+            uncertainty_detector,
+            severity_estimator,
+            cv_executor=cv_executor,
+            heuristics=profile != "fast"
+        )
+        
+        graph_start = time.perf_counter()
+        try:
+            stage_results = await pipeline_executor.run(stages, on_stage_complete=on_stage_complete)
+        except PipelineAborted as aborted:
+            _, relevance_reason = aborted.result
             return AnalysisResponse(
                 relevant=False,
                 prediction="Normal",  # Not relevant = Normal (not eczema)
@@ -165,20 +513,22 @@ async def analyze_image(file: UploadFile = File(...)):
                 confidence=0.0,
                 message=relevance_reason,
                 reasoning="Image does not appear to contain human skin.",
-                disclaimer="This is an AI-based assessment and not a medical diagnosis."
+                disclaimer="This is an AI-based assessment and not a medical diagnosis.",
+                quality_profile=profile
             )
         
-        # ============================================
-        # STEP 3: Model Inference (Binary)
-        # ============================================
-        if model_service is None or not model_service.is_loaded():
+        if not model_available:
             raise HTTPException(
                 status_code=503,
                 detail="Model service is not available. Please ensure the model file is placed in the models/ directory."
             )
         
-        prediction_result = await model_service.predict(processed_image)
+        prediction_result = stage_results["inference"]
+        uncertainty_features = stage_results.get("uncertainty_features")  # Absent in embedding mode
+        severity_features = stage_results.get("severity_features")  # Absent in the fast profile
         eczema_probability = float(prediction_result["eczema_probability"])
+        if details is not None and "embedding" in prediction_result:
+            details["embedding"] = prediction_result["embedding"]
         
         # ============================================
         # MODEL OUTPUT LOGGING
@@ -187,7 +537,9 @@ async def analyze_image(file: UploadFile = File(...)):
         print("🤖 MODEL OUTPUT")
         print("="*60)
         print(f"📊 Eczema Probability: {eczema_probability:.4f} ({eczema_probability*100:.2f}%)")
-        print(f"📋 Raw Prediction Result: {prediction_result}")
+        # The embedding (when returned) is too long to log
+        logged_result = {key: value for key, value in prediction_result.items() if key != "embedding"}
+        print(f"📋 Raw Prediction Result: {logged_result}")
         print("="*60 + "\n")
         
         # ============================================
@@ -198,58 +550,99 @@ async def analyze_image(file: UploadFile = File(...)):
         # ============================================
         # STEP 5: OOD / Uncertainty Detection
         # ============================================
-        is_uncertain, uncertainty_reason, adjusted_confidence = await uncertainty_detector.evaluate_uncertainty(
-            processed_image,
-            eczema_probability,
-            prediction_result
-        )
+        if profile == "fast":
+            # Confidence band only: no image factors
+            uncertainty_factors = UncertaintyFactors()
+        else:
+            uncertainty_factors = await uncertainty_detector.evaluate_factors(
+                processed_image,
+                eczema_probability,
+                prediction_result,
+                features=uncertainty_features
+            )
+        # Reason text (and log) for factor-driven uncertainty
+        _, uncertainty_reason, _ = uncertainty_detector.route(uncertainty_factors, eczema_probability)
         
         # ============================================
         # STEP 6: Final Decision Mapping
         # Three-state prediction: Eczema | Normal | Uncertain
+        # (decision_policy.decide; the same function replays logged decisions offline)
         # ============================================
-        if is_uncertain:
-            # Route to "Uncertain / Other Skin Condition" state
-            prediction_state = "Uncertain"
-            final_confidence = adjusted_confidence
-            final_eczema_detected = False  # Uncertain is not eczema
-            severity = None  # No severity for uncertain cases
-        else:
-            # High confidence cases: route to Eczema or Normal
-            if eczema_probability >= uncertainty_detector.high_confidence_threshold:
-                prediction_state = "Eczema"
-                final_confidence = eczema_probability
-                final_eczema_detected = True
-                # Estimate severity for eczema cases
-                severity = await severity_estimator.estimate_severity(
-                    processed_image,
-                    eczema_probability,
-                    prediction_result
-                )
-            elif eczema_probability <= uncertainty_detector.low_confidence_threshold:
-                prediction_state = "Normal"
-                final_confidence = 1.0 - eczema_probability  # Confidence for "Normal"
-                final_eczema_detected = False
-                severity = None
-            else:
-                # Medium confidence: route to Uncertain (safety fallback)
-                prediction_state = "Uncertain"
-                final_confidence = 0.5
-                final_eczema_detected = False
-                severity = None
-                uncertainty_reason = "Confidence falls in ambiguous range between high and low thresholds."
+        decision_inputs = {
+            "eczema_probability": eczema_probability,
+            "visual_weight": uncertainty_factors.weight,
+            "analysis_unavailable": uncertainty_factors.unavailable is not None,
+            "thresholds": uncertainty_detector.thresholds,
+        }
+        model_decision = decide(**decision_inputs, gemini_skipped=True)
+        prediction_state = model_decision.state
+        final_confidence = model_decision.confidence
+        final_eczema_detected = model_decision.eczema_detected
+        severity = None
+        if model_decision.reason == "ambiguous_range":
+            # Medium confidence: route to Uncertain (safety fallback)
+            uncertainty_reason = "Confidence falls in ambiguous range between high and low thresholds."
+        if model_decision.severity_probability is not None and profile != "fast":
+            # Estimate severity for eczema cases
+            severity = await severity_estimator.estimate_severity(
+                processed_image,
+                eczema_probability,
+                prediction_result,
+                features=severity_features
+            )
         
         # ============================================
         # STEP 7: Explanation Generation (LLM-Assisted)
         # Handles uncertainty explanations
         # ============================================
+        vision_result = None
+        # Only the full profile sends the image to Gemini
+        vision_upload = upload if profile == "full" else None
+        gemini_skipped = False
+        # Stored Gemini verdict of the near-duplicate: no new vision request
+        reused_verdict = near_duplicate.verdict if near_duplicate is not None and profile != "fast" else None
+        gemini_start = time.perf_counter()
+        if reused_verdict is not None:
+            # The explanation is still written for this request's own model output (text-only)
+            vision_upload = None
+        elif speculative_call is not None:
+            cancel, cancel_reason = speculation_policy.should_cancel(decision_inputs)
+            if cancel and not speculative_call.done():
+                # Verdict not needed: drop the speculative call, explain from text only
+                print(f"\n⏭️ Speculative Gemini call cancelled: {cancel_reason}")
+                speculative_call.cancel()
+                speculation_policy.stats["cancelled"] += 1
+                upload.release_image()
+                vision_upload = None
+                gemini_skipped = True
+            else:
+                vision_result = await speculative_call.result()
+                speculation_policy.stats["used"] += 1
+        if profile != "full" and vision_result is None and reused_verdict is None:
+            # No verdict by design (not a Gemini failure): no conservative fallback
+            gemini_skipped = True
+        
         explanation, gemini_assessment, gemini_confidence = await llm_service.generate_explanation(
             eczema_probability=eczema_probability,
             prediction_state=prediction_state,
             severity=severity,
-            image_bytes=image_bytes,
-            uncertainty_reason=uncertainty_reason if prediction_state == "Uncertain" else None
+            upload=vision_upload,
+            uncertainty_reason=uncertainty_reason if prediction_state == "Uncertain" else None,
+            vision_result=vision_result,
+            local=profile == "fast"
         )
+        if reused_verdict is not None:
+            gemini_assessment, gemini_confidence = reused_verdict
+        timings["gemini"] = round((time.perf_counter() - gemini_start) * 1000.0, 1)
+        if details is not None:
+            if not llm_service.api_key:
+                details["gemini"] = "disabled"
+            elif reused_verdict is not None:
+                details["gemini"] = "reused"
+            elif gemini_skipped:
+                details["gemini"] = "skipped"
+            else:
+                details["gemini"] = "verdict" if gemini_assessment is not None else "no_verdict"
         
         # ============================================
         # GEMINI OUTPUT LOGGING
@@ -266,107 +659,67 @@ async def analyze_image(file: UploadFile = File(...)):
         # GEMINI OVERRIDE LOGIC
         # Trust Gemini for distinguishing eczema from OTHER skin conditions
         # The model was trained on eczema vs healthy skin, so it may misclassify
-        # other skin diseases as eczema. Gemini helps correct this.
+        # other skin diseases as eczema. Gemini helps correct this:
+        # - Model Eczema: only overridden when Gemini is VERY confident it's not eczema
+        # - Model Normal: Gemini eczema verdicts are trusted more (catch more eczema)
+        # - Model Uncertain: Gemini resolves the uncertainty either way
+        # FALLBACK: When Gemini fails, borderline Normal (GEMINI_FALLBACK_LOWER-UPPER) becomes Uncertain
         # ============================================
-        
         if gemini_assessment is not None:
-            # ============================================
-            # SMART OVERRIDE LOGIC
-            # Combines model probability with Gemini's visual analysis
-            # ============================================
-            
             print(f"\n📊 DECISION INPUTS:")
             print(f"   Model probability: {eczema_probability:.2%}")
             print(f"   Model state: {prediction_state}")
             print(f"   Gemini assessment: {'Eczema' if gemini_assessment else 'Not Eczema'}")
             print(f"   Gemini confidence: {gemini_confidence:.2f}" if gemini_confidence else "   Gemini confidence: N/A")
-            
-            # CASE 1: Model says Eczema (>=60% probability)
-            if prediction_state == "Eczema":
-                # Trust the model - it was trained specifically for this
-                # Only override if Gemini is VERY confident it's not eczema (rare)
-                if gemini_assessment == False and gemini_confidence and gemini_confidence >= 0.9:
-                    print("\n⚠️ GEMINI OVERRIDE: Model detected eczema but Gemini very confident it's not")
-                    prediction_state = "Normal"
-                    final_confidence = gemini_confidence
-                    final_eczema_detected = False
-                    severity = None
-                # Otherwise, keep the model's Eczema prediction
-                    
-            # CASE 2: Model says Normal (<20% probability)
-            elif prediction_state == "Normal":
-                # Model thinks it's normal, but check if Gemini sees eczema
-                if gemini_assessment == True:
-                    # Gemini detected eczema - trust Gemini more for eczema detection
-                    # Lower threshold to catch more eczema cases
-                    if gemini_confidence and gemini_confidence >= 0.70 and eczema_probability >= 0.15:
-                        print("\n✅ GEMINI DETECTED ECZEMA (model gave low probability)")
-                        print(f"   Model: {eczema_probability:.2%}, Gemini: {gemini_confidence:.2%}")
-                        prediction_state = "Eczema"
-                        final_confidence = gemini_confidence
-                        final_eczema_detected = True
-                        severity = await severity_estimator.estimate_severity(
-                            processed_image,
-                            gemini_confidence,
-                            {"eczema_probability": gemini_confidence}
-                        )
-                    elif gemini_confidence and gemini_confidence >= 0.80:
-                        # High Gemini confidence, even if model was very low
-                        print("\n✅ GEMINI DETECTED ECZEMA (high confidence override)")
-                        prediction_state = "Eczema"
-                        final_confidence = gemini_confidence
-                        final_eczema_detected = True
-                        severity = await severity_estimator.estimate_severity(
-                            processed_image,
-                            gemini_confidence,
-                            {"eczema_probability": gemini_confidence}
-                        )
-                # If Gemini also says normal (False), keep Normal
-                    
-            # CASE 3: Model is Uncertain (20-35% probability)
-            elif prediction_state == "Uncertain":
-                # For uncertain cases, trust Gemini more - lower threshold
-                if gemini_assessment == True and gemini_confidence and gemini_confidence >= 0.65:
-                    print("\n✅ GEMINI RESOLVED UNCERTAINTY: Detected eczema")
-                    print(f"   Model: {eczema_probability:.2%}, Gemini: {gemini_confidence:.2%}")
-                    prediction_state = "Eczema"
-                    final_confidence = gemini_confidence
-                    final_eczema_detected = True
-                    severity = await severity_estimator.estimate_severity(
-                        processed_image,
-                        gemini_confidence,
-                        {"eczema_probability": gemini_confidence}
-                    )
-                elif gemini_assessment == False and gemini_confidence and gemini_confidence >= 0.70:
-                    print("\n✅ GEMINI RESOLVED UNCERTAINTY: Not eczema")
-                    prediction_state = "Normal"
-                    final_confidence = gemini_confidence
-                    final_eczema_detected = False
-                    severity = None
         
-        # ============================================
-        # FALLBACK: When Gemini fails, be more conservative for borderline cases
-        # ============================================
-        if gemini_assessment is None and prediction_state == "Normal" and 0.20 <= eczema_probability < 0.40:
-            # Gemini failed but model gave borderline probability (20-40%)
+        decision = decide(
+            **decision_inputs,
+            gemini_assessment=gemini_assessment,
+            gemini_confidence=gemini_confidence,
+            gemini_skipped=gemini_skipped
+        )
+        if decision.reason == "gemini_override":
+            print(f"\n✅ GEMINI OVERRIDE: {model_decision.state} → {decision.state}")
+            print(f"   Model: {eczema_probability:.2%}, Gemini: {gemini_confidence:.2%}")
+        elif decision.reason == "gemini_unavailable":
+            # Gemini failed but model gave borderline probability
             # Be conservative: mark as Uncertain rather than Normal (might be eczema)
             print(f"\n⚠️ GEMINI FAILED - Conservative fallback: Borderline probability ({eczema_probability:.2%}) marked as Uncertain")
-            prediction_state = "Uncertain"
-            final_confidence = 0.5
-            final_eczema_detected = False
+            thresholds = decision_inputs["thresholds"]
+            uncertainty_reason = (
+                "Gemini analysis unavailable. Model probability is in borderline range "
+                f"({thresholds.fallback_lower:.0%}-{thresholds.fallback_upper:.0%})"
+            )
+        
+        if decision.state != prediction_state:
+            prediction_state = decision.state
+            final_confidence = decision.confidence
+            final_eczema_detected = decision.eczema_detected
             severity = None
-            uncertainty_reason = "Gemini analysis unavailable. Model probability is in borderline range (20-40%)."
+            if decision.severity_probability is not None and profile != "fast":
+                severity = await severity_estimator.estimate_severity(
+                    processed_image,
+                    decision.severity_probability,
+                    {"eczema_probability": decision.severity_probability},
+                    features=severity_features
+                )
+        
+        if decision_log is not None:
+            decision_log.record(
+                eczema_probability,
+                uncertainty_factors.weight,
+                uncertainty_factors.unavailable is not None,
+                gemini_assessment,
+                gemini_confidence,
+                gemini_skipped,
+                prediction_state
+            )
         
         # Build reasoning string
         reasoning_parts = []
         
-        # Check if Gemini overrode the model
-        gemini_overrode = gemini_assessment is not None and (
-            (gemini_assessment == False and eczema_probability >= 0.6) or  # Model said eczema, Gemini said no
-            (gemini_assessment == True and eczema_probability <= 0.4)      # Model said normal, Gemini said yes
-        )
-        
-        if gemini_overrode:
+        # Gemini overrode the model (decision_policy, with the configured override thresholds)
+        if decision.reason == "gemini_override":
             if prediction_state == "Normal" and gemini_assessment == False:
                 reasoning_parts.append("Vision analysis indicates this is NOT eczema.")
                 reasoning_parts.append("The image may show a different skin condition or healthy skin.")
@@ -399,7 +752,7 @@ async def analyze_image(file: UploadFile = File(...)):
         # ============================================
         # Build Final Response
         # ============================================
-        return AnalysisResponse(
+        response = AnalysisResponse(
             relevant=True,
             prediction=prediction_state,
             eczema_detected=final_eczema_detected,
@@ -408,8 +761,16 @@ async def analyze_image(file: UploadFile = File(...)):
             explanation=explanation,
             reasoning=reasoning,
             message=None if prediction_state != "Uncertain" else "The image shows patterns that cannot be confidently classified as eczema or normal skin.",
-            disclaimer="This is an AI-based assessment and not a medical diagnosis. Please consult a healthcare professional for proper medical advice."
+            disclaimer="This is an AI-based assessment and not a medical diagnosis. Please consult a healthcare professional for proper medical advice.",
+            quality_profile=profile
         )
+        
+        # Remember fresh full-profile analyses (not reused ones, so reuse never chains
+        # across near-duplicates, nor degraded ones, so they are never served as full)
+        if hashes is not None and near_duplicate is None and profile == "full":
+            verdict = (gemini_assessment, gemini_confidence) if gemini_assessment is not None else None
+            near_duplicate_index.add(hashes, upload.sha256, response, verdict, prediction_result.get("embedding"))
+        return response
     
     except HTTPException:
         raise
@@ -419,6 +780,165 @@ async def analyze_image(file: UploadFile = File(...)):
             status_code=500,
             detail=f"Internal server error: {str(e)}"
         )
+    finally:
+        # Never leave a speculative Gemini call running after the response
+        if speculative_call is not None:
+            speculative_call.cancel()
+        # Return the full-resolution decode's pixels to the decode budget (if still held)
+        if upload is not None:
+            upload.release_image()
+
+
+async def run_analysis_job(image_bytes: bytes) -> dict:
+    """Job queue handler: run the pipeline, mapping HTTP errors to job errors"""
+    # Jobs use the bulk lane and wait however long it takes (the job queue bounds them)
+    slot = admission_controller.slot("bulk", bounded=False) if admission_controller is not None else contextlib.nullcontext()
+    try:
+        async with slot:
+            response = await run_analysis(image_bytes)
+    except HTTPException as e:
+        # 5xx (model unavailable, internal errors) are retried; 4xx (invalid image) are final
+        raise JobError(str(e.detail), status_code=e.status_code, retryable=e.status_code >= 500)
+    return response.model_dump()
+
+
+@app.post("/analyze/jobs", response_model=JobSubmitResponse, status_code=202)
+async def submit_analysis_job(
+    request: Request,
+    file: UploadFile = File(...),
+    callback_url: Optional[str] = Form(None)
+):
+    """
+    Queue an image for analysis and return a job ID immediately
+    
+    The upload is validated (type, size, header dimensions) and stored durably;
+    poll GET /analyze/jobs/{job_id}, or pass callback_url to have the finished
+    job POSTed back (same body as the GET response). callback_url must resolve to a
+    public address, or name a host in JOB_CALLBACK_ALLOWED_HOSTS.
+    """
+    if job_queue is None or job_queue.store is None:
+        raise HTTPException(status_code=503, detail="Job queue is not available.")
+    
+    if callback_url:
+        try:
+            await asyncio.to_thread(job_queue.check_callback_url, callback_url)
+        except CallbackRejected as rejected:
+            raise HTTPException(status_code=400, detail=str(rejected))
+    
+    image_bytes = await read_image_upload(file)
+    job = await job_queue.submit(image_bytes, callback_url=callback_url or None)
+    
+    return JobSubmitResponse(
+        job_id=job["id"],
+        status=job["status"],
+        status_url=str(request.url_for("get_analysis_job", job_id=job["id"]))
+    )
+
+
+@app.get("/analyze/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_analysis_job(job_id: str):
+    """Status of a queued job; includes the AnalysisResponse once it has succeeded"""
+    if job_queue is None or job_queue.store is None:
+        raise HTTPException(status_code=503, detail="Job queue is not available.")
+    
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found (unknown ID or past retention).")
+    return JobStatusResponse(**job_payload(job))
+
+
+@app.post("/analyze/progress", response_model=ProgressAnalysisResponse)
+async def analyze_progress(
+    request: Request,
+    file: UploadFile = File(...),
+    subject_id: str = Form(..., min_length=1, max_length=256)
+):
+    """
+    Analyze an image and compare it with the subject's earlier images
+    
+    subject_id is an opaque ID chosen by the caller (e.g. a patient or lesion ID);
+    only a hash of it is stored. The analysis is the same as /analyze; previous
+    lists the subject's most recent earlier images with the cosine similarity of
+    their model embeddings to this one. Relevant images are then added to the
+    subject's history (an identical re-upload is not added twice).
+    """
+    if embedding_store is None:
+        raise HTTPException(status_code=503, detail="Embedding store is not available (set EMBEDDING_STORE_DIR).")
+    
+    details = {}
+    async with contextlib.AsyncExitStack() as stack:
+        watch = await watch_disconnect(stack, request)
+        await enter_analysis_slot(stack, request)
+        watch.phase = "analysis"
+        image_bytes = await read_image_upload(file)
+        analysis = await run_analysis(image_bytes, details=details, profile=choose_quality_profile(request))
+    
+    embedding = details.get("embedding")
+    if not analysis.relevant or embedding is None:
+        return ProgressAnalysisResponse(subject_id=subject_id, analysis=analysis, stored=False, previous_count=0)
+    
+    previous_count, matches = await asyncio.to_thread(embedding_store.compare, subject_id, embedding)
+    stored = not any(match["sha256"] == details["sha256"] for match in matches)
+    if stored:
+        await asyncio.to_thread(embedding_store.append, subject_id, embedding, details["sha256"])
+    
+    previous = [
+        ProgressMatch(
+            sha256=match["sha256"],
+            captured_at=datetime.fromtimestamp(match["added_at"], tz=timezone.utc).isoformat(),
+            similarity=round(match["similarity"], 4)
+        )
+        for match in matches
+    ]
+    return ProgressAnalysisResponse(
+        subject_id=subject_id,
+        analysis=analysis,
+        stored=stored,
+        previous_count=previous_count,
+        previous=previous,
+        most_similar=max(previous, key=lambda match: match.similarity) if previous else None
+    )
+
+
+@app.get("/profiles")
+async def list_profiles():
+    """Captured request profiles (newest first)"""
+    if request_profiler is None or not request_profiler.enabled:
+        raise HTTPException(status_code=503, detail="Request profiling is not available.")
+    profiles = await asyncio.to_thread(request_profiler.list_profiles)
+    return {"profiles": profiles, "count": len(profiles)}
+
+
+@app.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = Query("speedscope", pattern="^(speedscope|folded)$")):
+    """
+    One captured profile: speedscope JSON (open at https://www.speedscope.app) or
+    collapsed stacks for flamegraph.pl (format=folded)
+    """
+    path = request_profiler.path_of(profile_id) if request_profiler is not None and request_profiler.enabled else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    if format == "speedscope":
+        return FileResponse(path, media_type="application/json", filename=os.path.basename(path))
+    
+    def load_folded():
+        with open(path) as f:
+            return speedscope_to_folded(json.load(f))
+    return PlainTextResponse(await asyncio.to_thread(load_folded))
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Admission gauges and counters (queue depth, estimated wait) and disconnect
+    cancellation counters in the Prometheus text format
+    """
+    if admission_controller is None:
+        raise HTTPException(status_code=503, detail="Admission control is not available.")
+    text = admission_controller.metrics_text()
+    if disconnect_guard is not None and disconnect_guard.enabled:
+        text += disconnect_guard.metrics_text(skipped_work())
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
 
 
 @app.get("/")
@@ -429,7 +949,11 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
-            "analyze": "/analyze (POST)"
+            "analyze": "/analyze (POST)",
+            "analyze_jobs": "/analyze/jobs (POST), /analyze/jobs/{job_id} (GET)",
+            "analyze_progress": "/analyze/progress (POST)",
+            "profiles": "/profiles (GET), /profiles/{profile_id} (GET)",
+            "metrics": "/metrics (GET)"
         }
     }
 
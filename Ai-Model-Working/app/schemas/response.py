@@ -4,7 +4,7 @@ Updated to support three-state prediction: Eczema | Normal | Uncertain
 """
 
 from pydantic import BaseModel, Field
-from typing import Optional, Literal
+from typing import List, Optional, Literal
 
 
 class AnalysisResponse(BaseModel):
@@ -43,6 +43,11 @@ class AnalysisResponse(BaseModel):
         default="This is an AI-based assessment and not a medical diagnosis.",
         description="Safety disclaimer"
     )
+    quality_profile: Optional[Literal["full", "standard", "fast"]] = Field(
+        None,
+        description="Pipeline profile that served the request: full (Gemini vision), "
+                    "standard (text-only explanation) or fast (model and confidence band only)"
+    )
     
     class Config:
         json_schema_extra = {
@@ -54,11 +59,63 @@ class AnalysisResponse(BaseModel):
                 "severity": "Moderate",
                 "explanation": "The image shows skin patterns that moderately resemble eczema based on redness and texture.",
                 "reasoning": "High confidence detection with consistent visual features.",
-                "disclaimer": "This is an AI-based assessment and not a medical diagnosis."
+                "disclaimer": "This is an AI-based assessment and not a medical diagnosis.",
+                "quality_profile": "full"
             }
         }
 
 
+class JobSubmitResponse(BaseModel):
+    """Returned by POST /analyze/jobs (202 Accepted)"""
+    job_id: str = Field(..., description="Job identifier")
+    status: Literal["queued", "running", "succeeded", "failed"] = Field(..., description="Job status")
+    status_url: str = Field(..., description="URL to poll for the result")
+
+
+class JobStatusResponse(BaseModel):
+    """
+    Returned by GET /analyze/jobs/{job_id} (and POSTed to the callback URL)
+    
+    result holds the AnalysisResponse once status is "succeeded"; error and
+    status_code describe the last failure (final once status is "failed").
+    """
+    job_id: str = Field(..., description="Job identifier")
+    status: Literal["queued", "running", "succeeded", "failed"] = Field(..., description="Job status")
+    attempts: int = Field(..., description="Processing attempts so far")
+    max_attempts: int = Field(..., description="Attempts allowed for retryable errors")
+    result: Optional[AnalysisResponse] = Field(None, description="Analysis result (when succeeded)")
+    error: Optional[str] = Field(None, description="Last error message")
+    status_code: Optional[int] = Field(None, description="HTTP status equivalent of the outcome")
+    callback_url: Optional[str] = Field(None, description="Callback URL given at submission")
+    callback_status: Optional[str] = Field(None, description="Outcome of the callback delivery")
+    created_at: str = Field(..., description="Submission time (ISO 8601, UTC)")
+    updated_at: str = Field(..., description="Last status change (ISO 8601, UTC)")
+    finished_at: Optional[str] = Field(None, description="Completion time (ISO 8601, UTC)")
+
+
+class ProgressMatch(BaseModel):
+    """Similarity of the new image to one earlier image of the same subject"""
+    sha256: str = Field(..., description="SHA-256 of the earlier upload")
+    captured_at: str = Field(..., description="When the earlier image was analyzed (ISO 8601, UTC)")
+    similarity: float = Field(..., ge=-1.0, le=1.0, description="Cosine similarity of the model embeddings")
+
+
+class ProgressAnalysisResponse(BaseModel):
+    """
+    Returned by POST /analyze/progress
+    
+    previous lists the subject's most recent earlier images (most recent first) with
+    their embedding similarity to this one; it is empty for the first image and when
+    the image was not relevant (nothing is stored then).
+    """
+    subject_id: str = Field(..., description="Subject ID given with the upload")
+    analysis: AnalysisResponse = Field(..., description="Analysis of the new image")
+    stored: bool = Field(..., description="Whether the new image was added to the subject's history")
+    previous_count: int = Field(..., description="Earlier images stored for the subject")
+    previous: List[ProgressMatch] = Field(default_factory=list, description="Most recent earlier images")
+    most_similar: Optional[ProgressMatch] = Field(None, description="Most similar of the listed earlier images")
+
+
 class ErrorResponse(BaseModel):
     """Error response schema"""
     error: str = Field(..., description="Error message")
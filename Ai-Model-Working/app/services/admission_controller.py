@@ -0,0 +1,210 @@
+"""
+Admission Controller - Bounded concurrency and queueing for analysis requests
+At most ADMISSION_MAX_IN_FLIGHT analyses run at once; the rest wait in bounded
+per-lane queues (interactive uploads are admitted before bulk / re-scoring work)
+and are turned away with 429 + Retry-After once their lane's queue is full
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+
+# Priority order: a free slot goes to the first lane with a waiting request
+LANES = ("interactive", "bulk")
+
+# Weight of the newest observation in the service time average
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """Request turned away before any work was done for it"""
+    
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Admits requests into a fixed number of analysis slots
+    
+    Configuration (environment):
+    - ADMISSION_MAX_IN_FLIGHT: Analyses running at once (default: 8; 0 disables admission control)
+    - ADMISSION_MAX_QUEUE: Interactive requests allowed to wait for a slot (default: 32)
+    - ADMISSION_BULK_MAX_QUEUE: Bulk requests allowed to wait for a slot (default: 16)
+    - ADMISSION_MAX_WAIT_SECONDS: Longest wait for a slot before a 429 (default: 30)
+    - ADMISSION_LANE_HEADER: Request header choosing the lane, "interactive" or "bulk"
+      (default: X-Priority; requests without it are interactive)
+    
+    All methods run on the event loop thread, so no locking is needed.
+    """
+    
+    def __init__(self):
+        self.max_in_flight = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "8"))
+        self.max_queue = {
+            "interactive": int(os.getenv("ADMISSION_MAX_QUEUE", "32")),
+            "bulk": int(os.getenv("ADMISSION_BULK_MAX_QUEUE", "16")),
+        }
+        self.max_wait = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "30"))
+        self.lane_header = os.getenv("ADMISSION_LANE_HEADER", "X-Priority")
+        
+        self.in_flight = 0
+        self._waiters = {lane: deque() for lane in LANES}
+        # Average seconds an admitted request holds its slot (None until the first one finishes)
+        self.service_time: Optional[float] = None
+        self.stats = {
+            lane: {"admitted": 0, "queued": 0, "rejected_full": 0, "rejected_timeout": 0}
+            for lane in LANES
+        }
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_in_flight > 0
+    
+    def lane_of(self, headers) -> str:
+        """Lane requested by the lane header (interactive unless it names another lane)"""
+        lane = headers.get(self.lane_header, "").strip().lower()
+        return lane if lane in LANES else "interactive"
+    
+    @asynccontextmanager
+    async def slot(self, lane: str, bounded: bool = True):
+        """
+        Hold an analysis slot for the duration of the block
+        
+        Args:
+            lane: "interactive" or "bulk"
+            bounded: False waits for a slot however long the queue is (job workers,
+                which already are a bounded queue of their own)
+        
+        Raises:
+            AdmissionRejected: The lane's queue is full or the wait exceeded max_wait
+        """
+        if not self.enabled:
+            yield
+            return
+        
+        await self._acquire(lane, bounded)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._observe(time.perf_counter() - start)
+            self._release()
+    
+    async def _acquire(self, lane: str, bounded: bool):
+        stats = self.stats[lane]
+        if self.in_flight < self.max_in_flight and not self.queue_depth:
+            self.in_flight += 1
+            stats["admitted"] += 1
+            return
+        
+        if bounded and len(self._waiters[lane]) >= self.max_queue[lane]:
+            stats["rejected_full"] += 1
+            raise AdmissionRejected(
+                "Service is at capacity. Please retry later.",
+                self.retry_after(lane)
+            )
+        
+        # Wait for _release to hand over a slot (in_flight is not decremented in between)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(waiter)
+        stats["queued"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait if bounded else None)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot arrived together with the timeout / cancellation: pass it on
+                self._release()
+            else:
+                waiter.cancel()
+                self._waiters[lane].remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            stats["rejected_timeout"] += 1
+            raise AdmissionRejected(
+                f"No analysis slot became free within {self.max_wait:g}s. Please retry later.",
+                self.retry_after(lane)
+            )
+        stats["admitted"] += 1
+    
+    def _release(self):
+        """Hand the slot to the next waiter in lane priority order, or free it"""
+        for lane in LANES:
+            waiters = self._waiters[lane]
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self.in_flight -= 1
+    
+    def _observe(self, seconds: float):
+        if self.service_time is None:
+            self.service_time = seconds
+        else:
+            self.service_time += SERVICE_TIME_SMOOTHING * (seconds - self.service_time)
+    
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+    
+    def estimated_wait(self, lane: str) -> float:
+        """
+        Seconds a request joining this lane now would wait for a slot: the requests
+        it queues behind, drained max_in_flight at a time at the average service time
+        """
+        if not self.enabled or (self.in_flight < self.max_in_flight and not self.queue_depth):
+            return 0.0
+        lane_index = LANES.index(lane)
+        ahead = sum(len(self._waiters[other]) for other in LANES[:lane_index + 1])
+        return (ahead + 1) / self.max_in_flight * (self.service_time or 1.0)
+    
+    def retry_after(self, lane: str) -> int:
+        """Retry-After seconds for a rejected request of this lane"""
+        return max(1, math.ceil(self.estimated_wait(lane)))
+    
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "queued": {lane: len(self._waiters[lane]) for lane in LANES},
+            "max_queue": dict(self.max_queue),
+            "estimated_wait_seconds": {lane: round(self.estimated_wait(lane), 3) for lane in LANES},
+            "service_time_ms": round(self.service_time * 1000.0, 1) if self.service_time is not None else None,
+            "lane_header": self.lane_header,
+            "stats": {lane: dict(counts) for lane, counts in self.stats.items()},
+        }
+    
+    def metrics_text(self) -> str:
+        """Gauges and counters in the Prometheus text format (GET /metrics, for autoscalers)"""
+        lines = [
+            "# HELP admission_in_flight Analyses currently running",
+            "# TYPE admission_in_flight gauge",
+            f"admission_in_flight {self.in_flight}",
+            "# HELP admission_max_in_flight Configured analysis slots",
+            "# TYPE admission_max_in_flight gauge",
+            f"admission_max_in_flight {self.max_in_flight}",
+            "# HELP admission_queue_depth Requests waiting for a slot",
+            "# TYPE admission_queue_depth gauge",
+        ]
+        lines += [f'admission_queue_depth{{lane="{lane}"}} {len(self._waiters[lane])}' for lane in LANES]
+        lines += [
+            "# HELP admission_estimated_wait_seconds Expected wait of a request joining the lane now",
+            "# TYPE admission_estimated_wait_seconds gauge",
+        ]
+        lines += [f'admission_estimated_wait_seconds{{lane="{lane}"}} {self.estimated_wait(lane):.3f}' for lane in LANES]
+        for name, help_text in (
+            ("admitted", "Requests given a slot"),
+            ("rejected_full", "Requests rejected because the lane queue was full"),
+            ("rejected_timeout", "Requests rejected after waiting max_wait"),
+        ):
+            lines += [f"# HELP admission_{name}_total {help_text}", f"# TYPE admission_{name}_total counter"]
+            lines += [f'admission_{name}_total{{lane="{lane}"}} {self.stats[lane][name]}' for lane in LANES]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,220 @@
+"""
+CV Executor - Runs the heuristic detector stages on threads or worker processes
+OpenCV calls release the GIL and scale on threads; Python-heavy code (the per-pixel
+LBP loop) holds it, so those stages can be sent to a process pool instead. Images
+reach worker processes through reusable shared-memory blocks rather than pickling
+"""
+
+import asyncio
+import functools
+import importlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+
+CV_BACKENDS = ("inline", "thread", "process")
+
+# Stage name -> (module, class, method) used to run the stage inside a worker process
+CV_STAGES = {
+    "relevance": ("app.services.relevance_detector", "RelevanceDetector", "check_relevance_sync"),
+    "uncertainty_features": ("app.services.uncertainty_detector", "UncertaintyDetector", "extract_image_features"),
+    "severity_features": ("app.services.severity_estimator", "SeverityEstimator", "extract_image_features"),
+}
+
+
+# Worker-process state: one detector per stage and the shared-memory blocks already attached
+_worker_services: Dict[str, Any] = {}
+_worker_blocks: Dict[str, SharedMemory] = {}
+
+
+def _worker_service(stage: str):
+    service = _worker_services.get(stage)
+    if service is None:
+        module_name, class_name, _ = CV_STAGES[stage]
+        service = getattr(importlib.import_module(module_name), class_name)()
+        _worker_services[stage] = service
+    return service
+
+
+def _warm_up_worker(stages: List[str]):
+    """Import the detector modules and build the services ahead of the first request"""
+    for stage in stages:
+        _worker_service(stage)
+
+
+def _run_in_worker(stage: str, block_name: str, shape: tuple, dtype: str, args: tuple) -> Any:
+    """Process-pool entry point: view the image in shared memory and run the stage on it"""
+    block = _worker_blocks.get(block_name)
+    if block is None:
+        block = SharedMemory(name=block_name)
+        _worker_blocks[block_name] = block
+    
+    image = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    try:
+        service = _worker_service(stage)
+        return getattr(service, CV_STAGES[stage][2])(image, *args)
+    finally:
+        # Drop the view before returning so the block can be reused by the parent
+        del image
+
+
+class CVExecutor:
+    """
+    Executor layer shared by RelevanceDetector, UncertaintyDetector and SeverityEstimator
+    
+    Configuration (environment):
+    - CV_EXECUTOR: Default backend for CV stages: "thread" (default), "inline" or "process"
+    - CV_PROCESS_STAGES: Comma-separated stages sent to the process pool regardless of
+      CV_EXECUTOR (e.g. "uncertainty_features", the LBP-heavy stage)
+    - CV_THREAD_WORKERS: Thread pool size (default 4)
+    - CV_PROCESS_WORKERS: Process pool size (default 2)
+    - CV_PROCESS_START_METHOD: multiprocessing start method (default "spawn"; the parent
+      holds TensorFlow threads, which are not fork-safe)
+    
+    run() is awaited from the event loop; call() is used from code that is already on a
+    worker thread (pipeline stages), where the thread backend simply runs inline.
+    """
+    
+    def __init__(
+        self,
+        backend: Optional[str] = None,
+        process_stages: Optional[List[str]] = None,
+        thread_workers: Optional[int] = None,
+        process_workers: Optional[int] = None
+    ):
+        self.backend = self._validate_backend(backend or os.getenv("CV_EXECUTOR", "thread"))
+        if process_stages is None:
+            process_stages = [s.strip() for s in os.getenv("CV_PROCESS_STAGES", "").split(",") if s.strip()]
+        unknown = [stage for stage in process_stages if stage not in CV_STAGES]
+        if unknown:
+            raise ValueError(f"Unknown CV stage(s): {', '.join(unknown)}. Expected: {', '.join(CV_STAGES)}")
+        self.backends = {
+            stage: "process" if stage in process_stages else self.backend
+            for stage in CV_STAGES
+        }
+        
+        self.thread_workers = thread_workers or int(os.getenv("CV_THREAD_WORKERS", "4"))
+        self.process_workers = process_workers or int(os.getenv("CV_PROCESS_WORKERS", "2"))
+        self.start_method = os.getenv("CV_PROCESS_START_METHOD", "spawn")
+        
+        self._thread_pool = ThreadPoolExecutor(max_workers=self.thread_workers, thread_name_prefix="cv")
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        
+        # Reusable shared-memory blocks, keyed by size in bytes
+        self._free_blocks: Dict[int, List[SharedMemory]] = {}
+        self._all_blocks: List[SharedMemory] = []
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _validate_backend(backend: str) -> str:
+        backend = backend.lower()
+        if backend not in CV_BACKENDS:
+            raise ValueError(f"Invalid CV executor backend '{backend}'. Expected one of: {', '.join(CV_BACKENDS)}")
+        return backend
+    
+    @property
+    def uses_processes(self) -> bool:
+        return "process" in self.backends.values()
+    
+    def warm_up(self):
+        """Start the worker processes now instead of on the first request (no-op without process stages)"""
+        if not self.uses_processes:
+            return
+        stages = [stage for stage, backend in self.backends.items() if backend == "process"]
+        pool = self._get_process_pool()
+        for future in [pool.submit(_warm_up_worker, stages) for _ in range(self.process_workers)]:
+            future.result()
+        print(f"✅ CV worker processes ready ({self.process_workers} for {', '.join(stages)})")
+    
+    async def run(self, stage: str, func: Callable[..., Any], image: np.ndarray, *args) -> Any:
+        """
+        Run a CV stage off the event loop
+        
+        Args:
+            stage: Stage name (key of CV_STAGES), selects the backend
+            func: Bound detector method used for the inline and thread backends
+            image: Image the stage operates on (uint8 RGB)
+            args: Extra picklable arguments passed after the image
+        
+        Returns:
+            The stage result
+        """
+        backend = self.backends[stage]
+        if backend == "inline":
+            return func(image, *args)
+        if backend == "thread":
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._thread_pool, functools.partial(func, image, *args))
+        return await asyncio.wrap_future(self._submit_to_process(stage, image, args))
+    
+    def call(self, stage: str, func: Callable[..., Any], image: np.ndarray, *args) -> Any:
+        """
+        Synchronous variant of run() for callers already on a worker thread
+        
+        Inline and thread backends run func on the calling thread; the process
+        backend blocks the calling thread (not the GIL) until the worker returns.
+        """
+        if self.backends[stage] == "process":
+            return self._submit_to_process(stage, image, args).result()
+        return func(image, *args)
+    
+    def describe(self) -> Dict[str, str]:
+        """Backend per stage (for /health)"""
+        return dict(self.backends)
+    
+    def shutdown(self):
+        """Stop the pools and free the shared-memory blocks"""
+        self._thread_pool.shutdown(wait=False, cancel_futures=True)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=True, cancel_futures=True)
+            self._process_pool = None
+        with self._lock:
+            for block in self._all_blocks:
+                block.close()
+                block.unlink()
+            self._all_blocks.clear()
+            self._free_blocks.clear()
+    
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.process_workers,
+                    mp_context=multiprocessing.get_context(self.start_method)
+                )
+            return self._process_pool
+    
+    def _submit_to_process(self, stage: str, image: np.ndarray, args: tuple) -> Future:
+        image = np.ascontiguousarray(image)
+        block = self._acquire_block(image.nbytes)
+        try:
+            np.ndarray(image.shape, dtype=image.dtype, buffer=block.buf)[...] = image
+            future = self._get_process_pool().submit(
+                _run_in_worker, stage, block.name, image.shape, image.dtype.str, args
+            )
+        except Exception:
+            self._release_block(block, image.nbytes)
+            raise
+        # The block goes back to the pool only once the worker is done reading it
+        future.add_done_callback(lambda _: self._release_block(block, image.nbytes))
+        return future
+    
+    def _acquire_block(self, nbytes: int) -> SharedMemory:
+        with self._lock:
+            free = self._free_blocks.get(nbytes)
+            if free:
+                return free.pop()
+        block = SharedMemory(create=True, size=max(nbytes, 1))
+        with self._lock:
+            self._all_blocks.append(block)
+        return block
+    
+    def _release_block(self, block: SharedMemory, nbytes: int):
+        with self._lock:
+            self._free_blocks.setdefault(nbytes, []).append(block)
@@ -0,0 +1,112 @@
+"""
+Decision Log - Compact append-only record of every decision's inputs
+Fixed-width binary records (30 bytes each), so a replay can map millions of them
+straight into numpy arrays and re-run decide_batch under other thresholds
+"""
+
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from app.services.decision_policy import PREDICTION_STATES, encode_gemini
+
+
+DECISION_LOG_MAGIC = b"ECZDEC01"
+
+# Probabilities and confidences are kept as float64: a float32 copy of e.g. 0.70
+# would fall just below a >= 0.70 threshold and replay differently
+DECISION_RECORD_DTYPE = np.dtype([
+    ("time", "<f8"),
+    ("probability", "<f8"),
+    ("gemini_confidence", "<f8"),      # NaN when Gemini gave none
+    ("visual_weight", "<u2"),
+    ("analysis_unavailable", "?"),
+    ("gemini_assessment", "i1"),       # GEMINI_NONE / GEMINI_NOT_ECZEMA / GEMINI_ECZEMA
+    ("gemini_skipped", "?"),
+    ("state", "i1"),                   # Decision made at the time (index into PREDICTION_STATES)
+])
+
+
+class DecisionLog:
+    """
+    Appends one record per relevant /analyze decision
+    
+    Configuration (environment):
+    - DECISION_LOG_PATH: Log file (default: logs/decisions.bin; empty disables logging)
+    
+    Records are written with a single write each; a record torn by a crash is
+    truncated away when the log is reopened.
+    """
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = path if path is not None else os.getenv("DECISION_LOG_PATH", "logs/decisions.bin")
+        self._lock = threading.Lock()
+        self._file = None
+        self.records = 0
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            self.records = _record_count(self.path)
+            os.truncate(self.path, len(DECISION_LOG_MAGIC) + self.records * DECISION_RECORD_DTYPE.itemsize)
+        self._file = open(self.path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(DECISION_LOG_MAGIC)
+            self._file.flush()
+    
+    @property
+    def enabled(self) -> bool:
+        return self._file is not None
+    
+    def record(
+        self,
+        eczema_probability: float,
+        visual_weight: int,
+        analysis_unavailable: bool,
+        gemini_assessment: Optional[bool],
+        gemini_confidence: Optional[float],
+        gemini_skipped: bool,
+        state: str
+    ):
+        """Append the inputs and outcome of one decision"""
+        if self._file is None:
+            return
+        record = np.zeros(1, dtype=DECISION_RECORD_DTYPE)
+        record["time"] = time.time()
+        record["probability"] = eczema_probability
+        record["gemini_confidence"] = np.nan if gemini_confidence is None else gemini_confidence
+        record["visual_weight"] = visual_weight
+        record["analysis_unavailable"] = analysis_unavailable
+        record["gemini_assessment"] = encode_gemini(gemini_assessment)
+        record["gemini_skipped"] = gemini_skipped
+        record["state"] = PREDICTION_STATES.index(state)
+        with self._lock:
+            self._file.write(record.tobytes())
+            self._file.flush()
+            self.records += 1
+    
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _record_count(path: str) -> int:
+    """Complete records in a decision log (raises ValueError for other files)"""
+    with open(path, "rb") as f:
+        if f.read(len(DECISION_LOG_MAGIC)) != DECISION_LOG_MAGIC:
+            raise ValueError(f"{path} is not a decision log (or has an older record format)")
+    return (os.path.getsize(path) - len(DECISION_LOG_MAGIC)) // DECISION_RECORD_DTYPE.itemsize
+
+
+def read_decision_log(path: str) -> np.ndarray:
+    """Memory-mapped records of a decision log (complete records only)"""
+    count = _record_count(path)
+    if count == 0:
+        return np.zeros(0, dtype=DECISION_RECORD_DTYPE)
+    return np.memmap(path, dtype=DECISION_RECORD_DTYPE, mode="r", offset=len(DECISION_LOG_MAGIC), shape=(count,))
@@ -0,0 +1,268 @@
+"""
+Decision Policy - Final Eczema / Normal / Uncertain decision as a pure function
+Maps the model probability, the uncertainty factor weight and Gemini's verdict to the
+prediction state and confidence. One vectorized implementation serves single requests
+(decide) and offline replays over millions of logged decisions (decide_batch)
+"""
+
+import dataclasses
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+
+PREDICTION_STATES = ("Normal", "Eczema", "Uncertain")
+NORMAL, ECZEMA, UNCERTAIN = range(len(PREDICTION_STATES))
+
+DECISION_REASONS = (
+    "model",                 # Model probability outside the uncertainty rules
+    "uncertainty_factors",   # Ambiguous band plus enough image uncertainty factors
+    "analysis_unavailable",  # Uncertainty features could not be computed
+    "ambiguous_range",       # Between the low and high thresholds
+    "gemini_override",       # Gemini's verdict changed the model's state
+    "gemini_unavailable",    # Borderline Normal kept Uncertain because Gemini failed
+)
+
+# Gemini verdict codes in arrays
+GEMINI_NONE, GEMINI_NOT_ECZEMA, GEMINI_ECZEMA = -1, 0, 1
+
+# Weight of the ambiguous-band factor (each image factor weighs 1)
+AMBIGUOUS_BAND_WEIGHT = 2
+
+
+@dataclass(frozen=True)
+class DecisionThresholds:
+    """
+    Every constant of the decision (see THRESHOLD_ENV for the environment names)
+    """
+    high_confidence: float = 0.35                 # >= : Eczema
+    low_confidence: float = 0.20                  # <= : Normal
+    band_lower: float = 0.20                      # Ambiguous band of the uncertainty factors
+    band_upper: float = 0.35
+    min_uncertainty_factors: float = 3            # Factor weight that makes an in-band image Uncertain
+    gemini_veto: float = 0.90                     # Eczema -> Normal when Gemini is this sure it is not eczema
+    gemini_rescue: float = 0.70                   # Normal -> Eczema when Gemini sees eczema this surely...
+    gemini_rescue_min_probability: float = 0.15   # ...and the model gave at least this
+    gemini_rescue_any: float = 0.80               # Normal -> Eczema at any model probability
+    gemini_resolve_eczema: float = 0.65           # Uncertain -> Eczema
+    gemini_resolve_normal: float = 0.70           # Uncertain -> Normal
+    fallback_lower: float = 0.20                  # Normal in [lower, upper) -> Uncertain when Gemini failed
+    fallback_upper: float = 0.40
+    
+    @classmethod
+    def from_env(cls) -> "DecisionThresholds":
+        values = {}
+        for name, env_name in THRESHOLD_ENV.items():
+            value = os.getenv(env_name)
+            if value is not None:
+                values[name] = float(value)
+        return cls(**values)
+    
+    def replace(self, **changes) -> "DecisionThresholds":
+        return dataclasses.replace(self, **changes)
+    
+    def as_dict(self) -> Dict[str, float]:
+        return dataclasses.asdict(self)
+
+
+THRESHOLD_ENV = {
+    "high_confidence": "HIGH_CONFIDENCE_THRESHOLD",
+    "low_confidence": "LOW_CONFIDENCE_THRESHOLD",
+    "band_lower": "UNCERTAINTY_BAND_LOWER",
+    "band_upper": "UNCERTAINTY_BAND_UPPER",
+    "min_uncertainty_factors": "MIN_UNCERTAINTY_FACTORS",
+    "gemini_veto": "GEMINI_VETO_CONFIDENCE",
+    "gemini_rescue": "GEMINI_RESCUE_CONFIDENCE",
+    "gemini_rescue_min_probability": "GEMINI_RESCUE_MIN_PROBABILITY",
+    "gemini_rescue_any": "GEMINI_RESCUE_ANY_CONFIDENCE",
+    "gemini_resolve_eczema": "GEMINI_RESOLVE_ECZEMA_CONFIDENCE",
+    "gemini_resolve_normal": "GEMINI_RESOLVE_NORMAL_CONFIDENCE",
+    "fallback_lower": "GEMINI_FALLBACK_LOWER",
+    "fallback_upper": "GEMINI_FALLBACK_UPPER",
+}
+
+
+@dataclass
+class Decision:
+    """
+    One decision
+    
+    model_state is the state before Gemini (what the explanation is written for);
+    severity_probability is the probability severity is graded with, None unless
+    the state is Eczema.
+    """
+    model_state: str
+    state: str
+    confidence: float
+    severity_probability: Optional[float]
+    reason: str
+    
+    @property
+    def eczema_detected(self) -> bool:
+        return self.state == "Eczema"
+
+
+def encode_gemini(assessment: Optional[bool]) -> int:
+    if assessment is None:
+        return GEMINI_NONE
+    return GEMINI_ECZEMA if assessment else GEMINI_NOT_ECZEMA
+
+
+def decide_batch(
+    probabilities: np.ndarray,
+    visual_weights: np.ndarray,
+    gemini_assessments: Optional[np.ndarray] = None,
+    gemini_confidences: Optional[np.ndarray] = None,
+    gemini_skipped: Optional[np.ndarray] = None,
+    analysis_unavailable: Optional[np.ndarray] = None,
+    thresholds: Optional[DecisionThresholds] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Vectorized decision (STEPS 5-6 of /analyze, the Gemini override and the fallback)
+    
+    Args:
+        probabilities: Model eczema probabilities
+        visual_weights: Total weight of the image uncertainty factors
+        gemini_assessments: GEMINI_NONE / GEMINI_NOT_ECZEMA / GEMINI_ECZEMA codes (default: none)
+        gemini_confidences: Gemini confidences, NaN when missing
+        gemini_skipped: Gemini was deliberately not asked (no fallback then)
+        analysis_unavailable: Uncertainty features failed (always Uncertain at 0.5)
+        thresholds: Decision constants (default: from the environment)
+    
+    Returns:
+        Arrays "model_state", "state" and "reason" (codes into PREDICTION_STATES and
+        DECISION_REASONS), "confidence" and "severity_probability" (NaN: no severity)
+    """
+    t = thresholds or DecisionThresholds.from_env()
+    p = np.asarray(probabilities, dtype=np.float64)
+    n = p.shape[0]
+    weights = np.asarray(visual_weights, dtype=np.float64)
+    assessments = np.full(n, GEMINI_NONE, dtype=np.int8) if gemini_assessments is None else np.asarray(gemini_assessments)
+    gemini_confidence = np.full(n, np.nan) if gemini_confidences is None else np.asarray(gemini_confidences, dtype=np.float64)
+    skipped = np.zeros(n, dtype=bool) if gemini_skipped is None else np.asarray(gemini_skipped, dtype=bool)
+    unavailable = np.zeros(n, dtype=bool) if analysis_unavailable is None else np.asarray(analysis_unavailable, dtype=bool)
+    
+    # STEP 5: uncertainty routing (only between the thresholds, in the band, with enough factor weight)
+    in_band = (t.band_lower <= p) & (p <= t.band_upper)
+    total_weight = weights + np.where(in_band, AMBIGUOUS_BAND_WEIGHT, 0)
+    is_eczema = p >= t.high_confidence
+    is_normal = ~is_eczema & (p <= t.low_confidence)
+    factor_uncertain = ~is_eczema & ~is_normal & in_band & (total_weight >= t.min_uncertainty_factors)
+    routed_uncertain = unavailable | factor_uncertain
+    
+    # STEP 6: model state
+    model_state = np.select([routed_uncertain, is_eczema, is_normal], [UNCERTAIN, ECZEMA, NORMAL], UNCERTAIN).astype(np.int8)
+    confidence = np.select([routed_uncertain, is_eczema, is_normal], [0.5, p, 1.0 - p], 0.5)
+    reason = np.select(
+        [unavailable, factor_uncertain, model_state == UNCERTAIN],
+        [DECISION_REASONS.index("analysis_unavailable"), DECISION_REASONS.index("uncertainty_factors"),
+         DECISION_REASONS.index("ambiguous_range")],
+        DECISION_REASONS.index("model")
+    ).astype(np.int8)
+    severity_probability = np.where(model_state == ECZEMA, p, np.nan)
+    
+    # Gemini override (comparisons with a NaN confidence are False, like a missing one)
+    says_eczema = assessments == GEMINI_ECZEMA
+    says_not = assessments == GEMINI_NOT_ECZEMA
+    to_normal = (
+        ((model_state == ECZEMA) & says_not & (gemini_confidence >= t.gemini_veto)) |
+        ((model_state == UNCERTAIN) & says_not & (gemini_confidence >= t.gemini_resolve_normal))
+    )
+    to_eczema = (
+        ((model_state == NORMAL) & says_eczema & (
+            ((gemini_confidence >= t.gemini_rescue) & (p >= t.gemini_rescue_min_probability)) |
+            (gemini_confidence >= t.gemini_rescue_any)
+        )) |
+        ((model_state == UNCERTAIN) & says_eczema & (gemini_confidence >= t.gemini_resolve_eczema))
+    )
+    state = model_state.copy()
+    state[to_normal] = NORMAL
+    state[to_eczema] = ECZEMA
+    overridden = to_normal | to_eczema
+    confidence = np.where(overridden, gemini_confidence, confidence)
+    severity_probability = np.where(to_eczema, gemini_confidence, np.where(to_normal, np.nan, severity_probability))
+    reason = np.where(overridden, DECISION_REASONS.index("gemini_override"), reason).astype(np.int8)
+    
+    # Fallback: Gemini failed on a borderline Normal
+    fallback = (
+        (assessments == GEMINI_NONE) & ~skipped & (state == NORMAL) &
+        (t.fallback_lower <= p) & (p < t.fallback_upper)
+    )
+    state[fallback] = UNCERTAIN
+    confidence = np.where(fallback, 0.5, confidence)
+    reason = np.where(fallback, DECISION_REASONS.index("gemini_unavailable"), reason).astype(np.int8)
+    
+    return {
+        "model_state": model_state,
+        "state": state,
+        "confidence": confidence,
+        "severity_probability": severity_probability,
+        "reason": reason,
+    }
+
+
+def decide(
+    eczema_probability: float,
+    visual_weight: float = 0,
+    gemini_assessment: Optional[bool] = None,
+    gemini_confidence: Optional[float] = None,
+    gemini_skipped: bool = False,
+    analysis_unavailable: bool = False,
+    thresholds: Optional[DecisionThresholds] = None
+) -> Decision:
+    """
+    Decision for one request (same code path as decide_batch)
+    
+    Without a Gemini verdict and with gemini_skipped=True this is the model-only
+    decision the explanation is generated for.
+    """
+    result = decide_batch(
+        np.array([eczema_probability]),
+        np.array([visual_weight]),
+        np.array([encode_gemini(gemini_assessment)], dtype=np.int8),
+        np.array([np.nan if gemini_confidence is None else gemini_confidence]),
+        np.array([gemini_skipped]),
+        np.array([analysis_unavailable]),
+        thresholds
+    )
+    severity_probability = float(result["severity_probability"][0])
+    return Decision(
+        model_state=PREDICTION_STATES[result["model_state"][0]],
+        state=PREDICTION_STATES[result["state"][0]],
+        confidence=float(result["confidence"][0]),
+        severity_probability=None if np.isnan(severity_probability) else severity_probability,
+        reason=DECISION_REASONS[result["reason"][0]],
+    )
+
+
+def gemini_can_change(
+    eczema_probability: float,
+    visual_weight: float = 0,
+    analysis_unavailable: bool = False,
+    thresholds: Optional[DecisionThresholds] = None
+) -> bool:
+    """
+    Whether any Gemini outcome could change the model-only decision: a verdict either
+    way at full confidence (overrides only get easier as the confidence rises) or a
+    failure (the borderline-Normal fallback). False means the verdict is not needed.
+    """
+    # Rows: eczema verdict, not-eczema verdict, failure, deliberately skipped (model only)
+    result = decide_batch(
+        np.full(4, eczema_probability),
+        np.full(4, visual_weight),
+        np.array([GEMINI_ECZEMA, GEMINI_NOT_ECZEMA, GEMINI_NONE, GEMINI_NONE], dtype=np.int8),
+        np.array([1.0, 1.0, np.nan, np.nan]),
+        np.array([False, False, False, True]),
+        np.full(4, analysis_unavailable),
+        thresholds
+    )
+    states, reasons = result["state"], result["reason"]
+    return bool(((states[:3] != states[3]) | (reasons[:3] != reasons[3])).any())
+
+
+def decision_summary(states: np.ndarray) -> Dict[str, Any]:
+    """Count of each prediction state"""
+    counts = np.bincount(np.asarray(states, dtype=np.int64), minlength=len(PREDICTION_STATES))
+    return {name: int(count) for name, count in zip(PREDICTION_STATES, counts)}
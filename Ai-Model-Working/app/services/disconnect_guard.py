@@ -0,0 +1,151 @@
+"""
+Disconnect Guard - Stops work for clients that have gone away
+While a handler runs, a poller checks the ASGI connection; once the client has
+disconnected (backend timeout, user navigated away) the handler's task is cancelled,
+so waits for analysis slots and decode budget, pipeline stages not yet started and
+Gemini requests / retries are dropped instead of producing a response nobody reads
+"""
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+
+# Where a request was when its client went away
+PHASES = ("queued", "analysis")
+
+# Weight of the newest observation in the request time average
+REQUEST_TIME_SMOOTHING = 0.2
+
+
+class ClientDisconnected(Exception):
+    """The client closed the connection before the response was ready"""
+    
+    def __init__(self, phase: str):
+        super().__init__(f"Client disconnected while {phase}")
+        self.phase = phase
+
+
+class DisconnectWatch:
+    """State of one watched request; the handler advances phase as it goes"""
+    
+    def __init__(self):
+        self.phase = "queued"
+        self.disconnected = False
+        self.active = True
+
+
+class DisconnectGuard:
+    """
+    Cancels handlers whose client disconnected
+    
+    Configuration (environment):
+    - DISCONNECT_POLL_SECONDS: How often the connection is checked (default: 0.5; 0 disables)
+    
+    Work already running on a thread (a decode, a stage in progress, an HTTP attempt
+    to Gemini) cannot be interrupted: it finishes in the background and is discarded.
+    
+    Relies on request.is_disconnected(), which never turns true behind Starlette's
+    BaseHTTPMiddleware (@app.middleware("http")); the app's middlewares must be pure ASGI.
+    """
+    
+    def __init__(self):
+        self.poll_seconds = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))
+        # Average seconds of a watched request that completed (None until the first one)
+        self.request_time: Optional[float] = None
+        self.stats = {
+            "completed": 0,
+            "cancelled": {phase: 0 for phase in PHASES},
+            # Remaining time of the cancelled requests, from the average request time
+            "seconds_avoided": 0.0,
+        }
+    
+    @property
+    def enabled(self) -> bool:
+        return self.poll_seconds > 0
+    
+    @asynccontextmanager
+    async def watch(self, request):
+        """
+        Cancel the block when the request's client disconnects
+        
+        Yields:
+            DisconnectWatch (set .phase = "analysis" once an analysis slot is held)
+        
+        Raises:
+            ClientDisconnected: The block was cancelled because the client went away
+        """
+        watch = DisconnectWatch()
+        if not self.enabled:
+            yield watch
+            return
+        
+        task = asyncio.current_task()
+        poller = asyncio.create_task(self._poll(request, task, watch))
+        start = time.perf_counter()
+        try:
+            yield watch
+        except asyncio.CancelledError:
+            if not watch.disconnected:
+                raise  # Cancelled for another reason (e.g. shutdown)
+            task.uncancel()
+            self._record_cancelled(watch.phase, time.perf_counter() - start)
+            raise ClientDisconnected(watch.phase) from None
+        else:
+            self._observe(time.perf_counter() - start)
+        finally:
+            watch.active = False
+            poller.cancel()
+    
+    async def _poll(self, request, task: asyncio.Task, watch: DisconnectWatch):
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            if await request.is_disconnected() and watch.active:
+                print(f"⚠️ Client disconnected while {watch.phase}: cancelling the request")
+                watch.disconnected = True
+                task.cancel()
+                return
+    
+    def _observe(self, seconds: float):
+        self.stats["completed"] += 1
+        if self.request_time is None:
+            self.request_time = seconds
+        else:
+            self.request_time += REQUEST_TIME_SMOOTHING * (seconds - self.request_time)
+    
+    def _record_cancelled(self, phase: str, elapsed: float):
+        self.stats["cancelled"][phase] += 1
+        if self.request_time is not None:
+            self.stats["seconds_avoided"] += max(self.request_time - elapsed, 0.0)
+    
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "poll_seconds": self.poll_seconds,
+            "completed": self.stats["completed"],
+            "cancelled": dict(self.stats["cancelled"]),
+            "seconds_avoided": round(self.stats["seconds_avoided"], 1),
+        }
+    
+    def metrics_text(self, skipped: Dict[str, int]) -> str:
+        """
+        Counters in the Prometheus text format
+        
+        Args:
+            skipped: Work units the cancellations dropped, by kind (e.g. pipeline stages)
+        """
+        lines = [
+            "# HELP disconnect_cancelled_total Requests cancelled because the client disconnected",
+            "# TYPE disconnect_cancelled_total counter",
+        ]
+        lines += [f'disconnect_cancelled_total{{phase="{phase}"}} {self.stats["cancelled"][phase]}' for phase in PHASES]
+        lines += [
+            "# HELP disconnect_seconds_avoided_total Estimated handler time saved by cancelling",
+            "# TYPE disconnect_seconds_avoided_total counter",
+            f"disconnect_seconds_avoided_total {self.stats['seconds_avoided']:.3f}",
+            "# HELP disconnect_skipped_total Work dropped by cancellation, by kind",
+            "# TYPE disconnect_skipped_total counter",
+        ]
+        lines += [f'disconnect_skipped_total{{kind="{kind}"}} {count}' for kind, count in skipped.items()]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,256 @@
+"""
+Embedding Store - Append-only, memory-mapped store of image embeddings per subject
+Lets a new photo be compared with the same subject's earlier ones (lesion progress)
+without keeping the vectors in RAM: they live in float16 files that are mapped and
+scanned in bounded chunks
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+STORE_VERSION = 1
+
+# Per-row metadata; subject keys are kept in their own file so the subject scan
+# only reads 8 bytes per row
+RECORD_DTYPE = np.dtype([("added_at", "<f8"), ("sha256", "S32")])
+
+# Rows converted to float32 at a time during a search (bounds the working memory)
+SCAN_CHUNK_BYTES = 32 * 1024 * 1024
+
+
+def subject_key(subject_id: str) -> np.uint64:
+    """64-bit key of an opaque subject ID (the ID itself is never written to disk)"""
+    return np.frombuffer(hashlib.blake2b(subject_id.encode("utf-8"), digest_size=8).digest(), dtype="<u8")[0]
+
+
+class EmbeddingStore:
+    """
+    Append-only embedding store with cosine search over one subject's images
+    
+    Configuration (environment):
+    - EMBEDDING_STORE_DIR: Directory of the store; unset disables it (and /analyze/progress)
+    - EMBEDDING_STORE_MAX_MATCHES: Most recent previous images compared per request (default 20)
+    
+    Layout of the directory:
+    - store.json: embedding size and the model that produced the vectors
+    - vectors.f16: N x D unit-length float16 embeddings (2 bytes per dimension)
+    - subjects.u64: N subject keys
+    - records.bin: N (added_at, sha256) records
+    
+    Rows are only ever appended; a row is visible once all three files hold it, so a
+    write interrupted by a crash is truncated away on the next start. A subject
+    lookup scans the key file (8 bytes per row, streamed from the page cache) and
+    then reads only that subject's vectors.
+    """
+    
+    def __init__(self, directory: Optional[str] = None, dim: Optional[int] = None, model_name: Optional[str] = None):
+        self.directory = directory or os.getenv("EMBEDDING_STORE_DIR", "embeddings")
+        self.max_matches = int(os.getenv("EMBEDDING_STORE_MAX_MATCHES", "20"))
+        os.makedirs(self.directory, exist_ok=True)
+        
+        self.dim = dim
+        self.model_name = model_name
+        self._read_or_write_header()
+        
+        self._vectors_path = os.path.join(self.directory, "vectors.f16")
+        self._subjects_path = os.path.join(self.directory, "subjects.u64")
+        self._records_path = os.path.join(self.directory, "records.bin")
+        self._row_bytes = self.dim * np.dtype(np.float16).itemsize
+        
+        self._lock = threading.Lock()
+        self._count = self._recover()
+        self._files = [open(path, "ab") for path in (self._vectors_path, self._subjects_path, self._records_path)]
+        # Read-only maps of the first _mapped_count rows, re-created after appends
+        self._maps = None
+        self._mapped_count = 0
+    
+    def _read_or_write_header(self):
+        header_path = os.path.join(self.directory, "store.json")
+        if os.path.exists(header_path):
+            with open(header_path) as f:
+                header = json.load(f)
+            if self.dim is not None and header["dim"] != self.dim:
+                raise ValueError(
+                    f"store holds {header['dim']}-dim embeddings (model {header.get('model')}) "
+                    f"but the model produces {self.dim}"
+                )
+            if self.model_name is not None and header.get("model") not in (None, self.model_name):
+                raise ValueError(f"store was built with model {header['model']}, not {self.model_name}")
+            self.dim = header["dim"]
+            self.model_name = header.get("model")
+            return
+        if self.dim is None:
+            raise ValueError(f"{header_path} not found and no embedding size given")
+        with open(header_path, "w") as f:
+            json.dump({"version": STORE_VERSION, "dim": self.dim, "model": self.model_name}, f)
+    
+    def _recover(self) -> int:
+        """Number of complete rows; truncates files left ahead by an interrupted append"""
+        sizes = [
+            (self._vectors_path, self._row_bytes),
+            (self._subjects_path, 8),
+            (self._records_path, RECORD_DTYPE.itemsize),
+        ]
+        count = min(
+            os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+            for path, row_bytes in sizes
+        )
+        for path, row_bytes in sizes:
+            if os.path.exists(path) and os.path.getsize(path) != count * row_bytes:
+                os.truncate(path, count * row_bytes)
+        return count
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    def append(self, subject_id: str, embedding: np.ndarray, sha256: str, added_at: Optional[float] = None) -> int:
+        """
+        Store one embedding (normalized to unit length) for subject_id
+        
+        Returns:
+            Row index of the new embedding
+        """
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"expected a {self.dim}-dim embedding, got {vector.shape[0]}")
+        norm = float(np.linalg.norm(vector))
+        if norm > 0:
+            vector = vector / norm
+        
+        record = np.zeros(1, dtype=RECORD_DTYPE)
+        record["added_at"] = time.time() if added_at is None else added_at
+        record["sha256"] = bytes.fromhex(sha256)
+        rows = (
+            vector.astype("<f2").tobytes(),
+            np.array([subject_key(subject_id)], dtype="<u8").tobytes(),
+            record.tobytes(),
+        )
+        
+        with self._lock:
+            for f, data in zip(self._files, rows):
+                f.write(data)
+            for f in self._files:
+                f.flush()
+            self._count += 1
+            return self._count - 1
+    
+    def _mapped(self, count: int):
+        """(vectors, subjects, records) maps covering at least count rows"""
+        with self._lock:
+            if self._maps is None or self._mapped_count < count:
+                self._maps = (
+                    np.memmap(self._vectors_path, dtype="<f2", mode="r", shape=(count, self.dim)),
+                    np.memmap(self._subjects_path, dtype="<u8", mode="r", shape=(count,)),
+                    np.memmap(self._records_path, dtype=RECORD_DTYPE, mode="r", shape=(count,)),
+                )
+                self._mapped_count = count
+            return self._maps
+    
+    def subject_rows(self, subject_id: str) -> np.ndarray:
+        """Row indices of subject_id's embeddings, oldest first"""
+        count = self._count
+        if count == 0:
+            return np.empty(0, dtype=np.int64)
+        _, subjects, _ = self._mapped(count)
+        key = subject_key(subject_id)
+        chunk = SCAN_CHUNK_BYTES // 8
+        return np.concatenate([
+            start + np.flatnonzero(subjects[start:min(start + chunk, count)] == key)
+            for start in range(0, count, chunk)
+        ])
+    
+    def compare(
+        self,
+        subject_id: str,
+        embedding: np.ndarray,
+        limit: Optional[int] = None
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Cosine similarity of embedding to subject_id's most recent stored images
+        
+        Args:
+            subject_id: Opaque subject ID
+            embedding: Embedding of the new image
+            limit: Previous images compared (default: EMBEDDING_STORE_MAX_MATCHES)
+        
+        Returns:
+            Tuple of (images stored for the subject, matches); one match per compared
+            image, most recent first: sha256, added_at (epoch seconds) and similarity
+        """
+        subject_rows = self.subject_rows(subject_id)
+        rows = subject_rows[-(limit or self.max_matches):][::-1]
+        if len(rows) == 0:
+            return 0, []
+        vectors, _, records = self._mapped(int(rows.max()) + 1)
+        
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(query))
+        if norm > 0:
+            query = query / norm
+        
+        # Fancy indexing reads only these rows from the map
+        chunk = max(1, SCAN_CHUNK_BYTES // (self.dim * 4))
+        similarities = np.concatenate([
+            vectors[rows[start:start + chunk]].astype(np.float32) @ query
+            for start in range(0, len(rows), chunk)
+        ])
+        selected = records[rows]
+        return len(subject_rows), [
+            {
+                "sha256": record["sha256"].hex(),
+                "added_at": float(record["added_at"]),
+                "similarity": float(np.clip(similarity, -1.0, 1.0)),
+            }
+            for record, similarity in zip(selected, similarities)
+        ]
+    
+    def describe(self) -> Dict[str, Any]:
+        """Store summary (for /health)"""
+        return {
+            "directory": self.directory,
+            "embedding_dim": self.dim,
+            "model": self.model_name,
+            "vectors": self._count,
+            "size_mb": round(self._count * (self._row_bytes + 8 + RECORD_DTYPE.itemsize) / (1024 * 1024), 2),
+        }
+    
+    def close(self):
+        with self._lock:
+            for f in self._files:
+                f.close()
+            self._maps = None
+
+
+def embedding_store_requested() -> bool:
+    """EMBEDDING_STORE_DIR is set (the model must then also return its embedding)"""
+    return bool(os.getenv("EMBEDDING_STORE_DIR"))
+
+
+def load_embedding_store(model_service) -> Optional[EmbeddingStore]:
+    """
+    Embedding store for /analyze/progress, or None when it is not configured
+    
+    Disabled, with a warning, when the model has no embedding output or the
+    store on disk was written by a model with a different embedding size.
+    """
+    if not embedding_store_requested():
+        return None
+    if model_service is None or not model_service.return_embedding:
+        print("⚠️  EMBEDDING_STORE_DIR needs the model's embedding output; progress comparison disabled")
+        return None
+    
+    try:
+        store = EmbeddingStore(dim=model_service.embedding_dim, model_name=os.path.basename(model_service.model_path))
+    except (OSError, KeyError, ValueError) as e:
+        print(f"⚠️  Warning: Could not open embedding store: {e}; progress comparison disabled")
+        return None
+    
+    print(f"✅ Embedding store: {store.directory} ({len(store)} vectors, {store.dim} dims)")
+    return store
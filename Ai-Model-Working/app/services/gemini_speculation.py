@@ -0,0 +1,66 @@
+"""
+Gemini Speculation - Starts the Gemini vision request in parallel with local inference
+The speculative request uses a model-agnostic prompt, so it can begin as soon as the
+image passes the relevance check instead of waiting for the model probability
+"""
+
+import asyncio
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from app.services.decision_policy import gemini_can_change
+from app.utils.decoded_upload import DecodedUpload
+
+
+class SpeculationPolicy:
+    """
+    Decides whether a speculative Gemini call is still needed once the model has decided
+    
+    The call is cancelled (saving the remote round trip and quota) only when the
+    decision thresholds leave Gemini no way to change the outcome: no veto, rescue or
+    resolve override reachable at any confidence, and no failure fallback. Speculative
+    mode therefore always decides like the non-speculative path.
+    """
+    
+    def __init__(self):
+        self.enabled = os.getenv("GEMINI_SPECULATIVE", "false").lower() == "true"
+        
+        self.stats = {"started": 0, "used": 0, "cancelled": 0}
+    
+    def start(self, llm_service, upload: DecodedUpload) -> Optional["SpeculativeGeminiCall"]:
+        """Start a speculative call (must be called from the event loop)"""
+        if not self.enabled or not llm_service.api_key:
+            return None
+        self.stats["started"] += 1
+        return SpeculativeGeminiCall(llm_service, upload)
+    
+    def should_cancel(self, decision_inputs: Dict[str, Any]) -> Tuple[bool, str]:
+        """
+        Args:
+            decision_inputs: decide() arguments of the request (eczema_probability,
+                visual_weight, analysis_unavailable, thresholds)
+        
+        Returns:
+            Tuple of (cancel, reason)
+        """
+        if gemini_can_change(**decision_inputs):
+            return False, ""
+        return True, f"no Gemini verdict can change the decision at probability {decision_inputs['eczema_probability']:.2%}"
+
+
+class SpeculativeGeminiCall:
+    """Handle for an in-flight model-agnostic Gemini vision request"""
+    
+    def __init__(self, llm_service, upload: DecodedUpload):
+        self._task = asyncio.create_task(llm_service.assess_image(upload))
+    
+    def done(self) -> bool:
+        return self._task.done()
+    
+    async def result(self) -> tuple:
+        """Wait for (explanation, gemini_assessment, gemini_confidence)"""
+        return await self._task
+    
+    def cancel(self):
+        """Cancel the request (no-op if already finished)"""
+        self._task.cancel()
@@ -0,0 +1,435 @@
+"""
+Job Queue - Durable local queue for asynchronous analysis jobs
+Uploads are stored in SQLite and processed by in-process workers, so a client can
+submit an image, get a job ID back immediately, and poll (or receive a callback)
+instead of holding an HTTP connection open for inference and Gemini
+"""
+
+import asyncio
+import ipaddress
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import requests
+
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+
+JOB_COLUMNS = (
+    "id", "status", "callback_url", "attempts", "max_attempts", "result", "error",
+    "status_code", "callback_status", "created_at", "updated_at", "finished_at"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    image BLOB,
+    callback_url TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    result TEXT,
+    error TEXT,
+    status_code INTEGER,
+    callback_status TEXT,
+    available_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_available ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at);
+"""
+
+
+def job_payload(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Public representation of a stored job (GET /analyze/jobs/{id} and callbacks)
+    
+    Renames id to job_id and converts epoch timestamps to ISO 8601 (UTC).
+    """
+    payload = {key: value for key, value in job.items() if key not in ("id", "image")}
+    payload["job_id"] = job["id"]
+    for key in ("created_at", "updated_at", "finished_at"):
+        if payload.get(key) is not None:
+            payload[key] = datetime.fromtimestamp(payload[key], tz=timezone.utc).isoformat()
+    return payload
+
+
+def is_public_address(address: str) -> bool:
+    """Whether an IP address is globally routable (not private, loopback, link-local, reserved or multicast)"""
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+class CallbackRejected(Exception):
+    """A callback URL the service will not POST to (the message says why)"""
+
+
+class JobError(Exception):
+    """
+    Raised by a job handler to fail a job with a status code
+    
+    Retryable errors (e.g. 5xx, Gemini/model outages) are re-queued with backoff
+    until max_attempts is reached; non-retryable ones (invalid image) fail at once.
+    """
+    
+    def __init__(self, message: str, status_code: int = 500, retryable: bool = True):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.retryable = retryable
+
+
+class JobStore:
+    """
+    SQLite persistence for jobs (one connection, serialized by a lock)
+    
+    Methods are blocking; JobQueue calls them through asyncio.to_thread.
+    """
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+    
+    def insert(self, job_id: str, image: bytes, callback_url: Optional[str], max_attempts: int) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, image, callback_url, max_attempts, available_at, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, image, callback_url, max_attempts, now, now, now)
+            )
+        return self.get(job_id)
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._to_dict(row) if row is not None else None
+    
+    def claim_next(self) -> Optional[Dict[str, Any]]:
+        """Atomically move the oldest due job to running; returns it with its image"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? "
+                "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' AND available_at <= ? "
+                "ORDER BY available_at, created_at LIMIT 1) "
+                f"RETURNING {', '.join(JOB_COLUMNS)}, image",
+                (now, now)
+            ).fetchone()
+        if row is None:
+            return None
+        job = self._to_dict(row)
+        job["image"] = row["image"]
+        return job
+    
+    def next_available_at(self) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(available_at) FROM jobs WHERE status = 'queued'"
+            ).fetchone()
+        return row[0]
+    
+    def complete(self, job_id: str, result: Dict[str, Any]):
+        """Store the result and drop the upload bytes"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'succeeded', result = ?, error = NULL, status_code = 200, "
+                "image = NULL, updated_at = ?, finished_at = ? WHERE id = ?",
+                (json.dumps(result), now, now, job_id)
+            )
+    
+    def fail(self, job_id: str, error: str, status_code: int):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, status_code = ?, image = NULL, "
+                "updated_at = ?, finished_at = ? WHERE id = ?",
+                (error, status_code, now, now, job_id)
+            )
+    
+    def retry(self, job_id: str, error: str, status_code: int, delay: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', error = ?, status_code = ?, available_at = ?, "
+                "updated_at = ? WHERE id = ?",
+                (error, status_code, now + delay, now, job_id)
+            )
+    
+    def set_callback_status(self, job_id: str, callback_status: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET callback_status = ? WHERE id = ?", (callback_status, job_id)
+            )
+    
+    def requeue_running(self) -> int:
+        """
+        Restart recovery: jobs left running by a previous process go back to the queue
+        
+        Jobs that already used all attempts are failed instead, so an upload that
+        crashes the process cannot crash it again on every restart.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Interrupted by a service restart', "
+                "status_code = 500, image = NULL, updated_at = ?, finished_at = ? "
+                "WHERE status = 'running' AND attempts >= max_attempts",
+                (now, now)
+            )
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', available_at = ?, updated_at = ? WHERE status = 'running'",
+                (now, now)
+            )
+        return cursor.rowcount
+    
+    def purge_finished(self, older_than: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?",
+                (older_than,)
+            )
+        return cursor.rowcount
+    
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in JOB_STATUSES}
+        counts.update({row[0]: row[1] for row in rows})
+        return counts
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+    
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = {column: row[column] for column in JOB_COLUMNS}
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+
+class JobQueue:
+    """
+    Durable queue + in-process worker pool for /analyze/jobs
+    
+    Configuration (environment):
+    - JOB_QUEUE_DB: SQLite file (default jobs/jobs.sqlite3)
+    - JOB_WORKERS: Jobs processed concurrently (default 2)
+    - JOB_MAX_ATTEMPTS: Attempts per job for retryable errors (default 3)
+    - JOB_RETRY_DELAY_SECONDS: Base retry delay, doubled per attempt (default 2)
+    - JOB_RETENTION_SECONDS: How long finished jobs and results are kept (default 86400)
+    - JOB_CALLBACK_TIMEOUT: Callback POST timeout in seconds (default 10)
+    - JOB_CALLBACK_ALLOWED_HOSTS: Comma-separated hostnames callbacks may go to, even on
+      private addresses (default: empty, any host resolving only to public addresses)
+    
+    Callback URLs are checked when a job is submitted and again before each delivery
+    (DNS may have changed), and redirects are not followed, so callbacks cannot be
+    aimed at the service's own network.
+    
+    Jobs still marked running when the service stops are re-queued on the next start.
+    """
+    
+    def __init__(
+        self,
+        handler: Callable[[bytes], Awaitable[Dict[str, Any]]],
+        db_path: Optional[str] = None,
+        workers: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        retry_delay: Optional[float] = None,
+        retention: Optional[float] = None
+    ):
+        self.handler = handler
+        self.db_path = db_path or os.getenv("JOB_QUEUE_DB", "jobs/jobs.sqlite3")
+        self.workers = workers or int(os.getenv("JOB_WORKERS", "2"))
+        self.max_attempts = max_attempts or int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+        self.retry_delay = retry_delay if retry_delay is not None else float(os.getenv("JOB_RETRY_DELAY_SECONDS", "2"))
+        self.retention = retention if retention is not None else float(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+        self.callback_timeout = float(os.getenv("JOB_CALLBACK_TIMEOUT", "10"))
+        self.callback_attempts = 3
+        self.callback_allowed_hosts = {
+            host.strip().lower() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+        }
+        
+        self.store: Optional[JobStore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+    
+    async def start(self):
+        """Open the store, recover interrupted jobs and start the workers"""
+        self.store = await asyncio.to_thread(JobStore, self.db_path)
+        recovered = await asyncio.to_thread(self.store.requeue_running)
+        if recovered:
+            print(f"♻️  Re-queued {recovered} interrupted job(s)")
+        
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge_loop()))
+    
+    async def stop(self):
+        """Stop the workers; jobs they were running stay 'running' and are recovered on restart"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+    
+    async def submit(self, image_bytes: bytes, callback_url: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Persist a job and wake a worker
+        
+        Returns:
+            The stored job (status "queued")
+        """
+        job_id = uuid.uuid4().hex
+        job = await asyncio.to_thread(self.store.insert, job_id, image_bytes, callback_url, self.max_attempts)
+        self._wakeup.set()
+        return job
+    
+    def check_callback_url(self, callback_url: str):
+        """
+        Reject callback URLs that are not http(s), not allowlisted, or resolve to a
+        non-public address (blocking DNS lookup: call off the event loop)
+        
+        Raises:
+            CallbackRejected: The URL may not receive callbacks
+        """
+        parsed = urlparse(callback_url)
+        try:
+            port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        except ValueError:
+            port = None
+        if parsed.scheme not in ("http", "https") or not parsed.hostname or port is None:
+            raise CallbackRejected("callback_url must be an absolute http(s) URL.")
+        host = parsed.hostname.lower()
+        if self.callback_allowed_hosts:
+            if host not in self.callback_allowed_hosts:
+                raise CallbackRejected(f"callback_url host '{host}' is not an allowed callback host.")
+            return
+        
+        try:
+            addresses = {info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)}
+        except (OSError, ValueError, UnicodeError):
+            raise CallbackRejected(f"callback_url host '{host}' cannot be resolved.")
+        if not all(is_public_address(address) for address in addresses):
+            raise CallbackRejected(f"callback_url host '{host}' resolves to a non-public address.")
+    
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.store.get, job_id)
+    
+    async def stats(self) -> Dict[str, Any]:
+        counts = await asyncio.to_thread(self.store.counts)
+        return {"workers": self.workers, **counts}
+    
+    async def _worker(self, index: int):
+        while True:
+            try:
+                # Clear before claiming so a submit that lands in between is not missed
+                self._wakeup.clear()
+                job = await asyncio.to_thread(self.store.claim_next)
+                if job is None:
+                    await self._wait_for_work()
+                    continue
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep the worker alive (e.g. transient SQLite errors); the job is recovered on restart
+                print(f"❌ Job worker {index} error: {e}")
+                await asyncio.sleep(1.0)
+    
+    async def _wait_for_work(self):
+        # Sleep until a submit wakes us or the earliest delayed retry becomes due
+        next_at = await asyncio.to_thread(self.store.next_available_at)
+        timeout = 5.0 if next_at is None else min(5.0, max(0.05, next_at - time.time()))
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+    
+    async def _process(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        print(f"🧾 Job {job_id} started (attempt {job['attempts']}/{job['max_attempts']})")
+        try:
+            result = await self.handler(job["image"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if isinstance(e, JobError):
+                message, status_code, retryable = e.message, e.status_code, e.retryable
+            else:
+                message, status_code, retryable = f"Internal server error: {str(e)}", 500, True
+            
+            if retryable and job["attempts"] < job["max_attempts"]:
+                delay = self.retry_delay * (2 ** (job["attempts"] - 1))
+                print(f"⚠️  Job {job_id} failed ({message}); retrying in {delay:.1f}s")
+                await asyncio.to_thread(self.store.retry, job_id, message, status_code, delay)
+                return
+            
+            print(f"❌ Job {job_id} failed: {message}")
+            await asyncio.to_thread(self.store.fail, job_id, message, status_code)
+        else:
+            await asyncio.to_thread(self.store.complete, job_id, result)
+            print(f"✅ Job {job_id} succeeded")
+        
+        if job["callback_url"]:
+            await self._send_callback(job_id, job["callback_url"])
+    
+    async def _send_callback(self, job_id: str, callback_url: str):
+        """POST the finished job to its callback URL (failures are recorded, not retried forever)"""
+        job = job_payload(await self.get(job_id))
+        callback_status = None
+        for attempt in range(self.callback_attempts):
+            try:
+                await asyncio.to_thread(self.check_callback_url, callback_url)
+            except CallbackRejected as rejected:
+                callback_status = f"rejected ({rejected})"
+                break
+            try:
+                response = await asyncio.to_thread(
+                    requests.post, callback_url, json=job, timeout=self.callback_timeout, allow_redirects=False
+                )
+                if response.status_code < 400:
+                    callback_status = f"delivered ({response.status_code})"
+                    break
+                callback_status = f"failed (HTTP {response.status_code})"
+            except requests.exceptions.RequestException as e:
+                callback_status = f"failed ({type(e).__name__})"
+            if attempt < self.callback_attempts - 1:
+                await asyncio.sleep(self.retry_delay * (2 ** attempt))
+        
+        print(f"📨 Job {job_id} callback {callback_status}")
+        await asyncio.to_thread(self.store.set_callback_status, job_id, callback_status)
+    
+    async def _purge_loop(self):
+        interval = max(1.0, min(self.retention, 300.0))
+        while True:
+            purged = await asyncio.to_thread(self.store.purge_finished, time.time() - self.retention)
+            if purged:
+                print(f"🧹 Purged {purged} finished job(s) past retention")
+            await asyncio.sleep(interval)
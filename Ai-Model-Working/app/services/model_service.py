@@ -6,17 +6,29 @@ import numpy as np
 import tensorflow as tf
 from PIL import Image
 import os
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, List, Optional
 
 
 class ModelService:
     """Service for loading and running eczema detection model"""
     
-    def __init__(self, model_path: str):
+    def __init__(self, model_path: str, return_embedding: Optional[bool] = None):
         self.model_path = model_path
         self.model = None
         self.input_size = int(os.getenv("MODEL_INPUT_SIZE", 224))
+        # Wrap the model with an in-graph 1/255 Rescaling layer so uint8 pixels are fed directly
+        self.in_graph_preprocessing = os.getenv("MODEL_IN_GRAPH_PREPROCESSING", "false").lower() == "true"
+        # Also output the penultimate-layer embedding from the same forward pass (for OOD scoring)
+        if return_embedding is None:
+            return_embedding = os.getenv("MODEL_RETURN_EMBEDDING", "false").lower() == "true"
+        self.return_embedding = return_embedding
+        # Layer whose output is the embedding (default: the input of the final layer)
+        self.embedding_layer = os.getenv("MODEL_EMBEDDING_LAYER") or None
+        self.embedding_dim = None
         self._loaded = False
+        # Per-thread preallocated float32 input batch (pipeline stages run on worker threads)
+        self._local = threading.local()
     
     async def load_model(self):
         """Load the TensorFlow/Keras model"""
@@ -29,12 +41,65 @@ class ModelService:
             
             print(f"Loading model from {self.model_path}...")
             self.model = tf.keras.models.load_model(self.model_path)
+            self._read_input_signature()
+            if self.return_embedding:
+                self.model = self._with_embedding_output(self.model)
+                print(f"✅ Embedding output enabled ({self.embedding_dim} dims)")
+            if self.in_graph_preprocessing:
+                self.model = self._wrap_with_preprocessing(self.model)
+                print("✅ In-graph preprocessing enabled (model takes uint8 input)")
             self._loaded = True
-            print("✅ Model loaded successfully")
+            print(f"✅ Model loaded successfully (input size: {self.input_size})")
         except Exception as e:
             print(f"❌ Error loading model: {e}")
             raise
     
+    def _read_input_signature(self):
+        """
+        Take the input size from the model itself instead of trusting MODEL_INPUT_SIZE
+        (a mismatch would otherwise only show up as a shape error at predict time)
+        """
+        input_shape = self.model.input_shape
+        if isinstance(input_shape, list):
+            input_shape = input_shape[0]
+        
+        if len(input_shape) == 4 and input_shape[1] and input_shape[2]:
+            height, width = int(input_shape[1]), int(input_shape[2])
+            if height != width:
+                print(f"⚠️  Warning: Non-square model input {height}x{width}; using {height}")
+            if height != self.input_size:
+                print(f"⚠️  Warning: MODEL_INPUT_SIZE={self.input_size} disagrees with the model "
+                      f"input shape {input_shape}; using {height}")
+            self.input_size = height
+    
+    def _wrap_with_preprocessing(self, model):
+        """
+        Build uint8 input -> Rescaling(1/255) -> model
+        
+        The rescale (as per training: rescale 1/255) then runs inside the TensorFlow
+        runtime, batched, instead of as a float32 copy per request in Python.
+        """
+        inputs = tf.keras.Input(shape=(self.input_size, self.input_size, 3), dtype="uint8", name="pixels")
+        scaled = tf.keras.layers.Rescaling(1.0 / 255.0, name="rescale")(inputs)
+        outputs = model(scaled)
+        return tf.keras.Model(inputs, outputs, name=f"{model.name}_with_preprocessing")
+    
+    def _with_embedding_output(self, model):
+        """
+        Build a two-output model: [prediction, embedding]
+        
+        The embedding is the penultimate activation of the same forward pass, so it
+        costs no extra inference. Spatial feature maps are average-pooled to a vector.
+        """
+        if self.embedding_layer:
+            embedding = model.get_layer(self.embedding_layer).output
+        else:
+            embedding = model.layers[-1].input
+        if len(embedding.shape) == 4:
+            embedding = tf.keras.layers.GlobalAveragePooling2D(name="embedding_pool")(embedding)
+        self.embedding_dim = int(embedding.shape[-1])
+        return tf.keras.Model(model.inputs, [model.outputs[0], embedding], name=f"{model.name}_with_embedding")
+    
     def is_loaded(self) -> bool:
         """Check if model is loaded"""
         return self._loaded
@@ -44,38 +109,105 @@ class ModelService:
         Run prediction on preprocessed image
         
         Args:
-            processed_image: Preprocessed numpy array (224x224x3, normalized)
+            processed_image: Preprocessed numpy array (224x224x3 uint8, or float normalized 0-1)
         
         Returns:
-            Dictionary with prediction results
+            Dictionary with prediction results (plus "embedding" when return_embedding is enabled)
+        """
+        return self.predict_sync(processed_image)
+    
+    def predict_sync(self, processed_image: np.ndarray) -> Dict[str, Any]:
+        """
+        Synchronous prediction (used by the pipeline executor on worker threads)
         """
         if not self._loaded:
             raise RuntimeError("Model not loaded. Call load_model() first.")
         
         try:
-            # Ensure image is in correct shape for model
-            if len(processed_image.shape) == 3:
-                processed_image = np.expand_dims(processed_image, axis=0)
+            # Normalize into the reusable input batch (as per training: rescale 1/255)
+            model_input = self._prepare_input(processed_image)
             
             # Run prediction
-            predictions = self.model.predict(processed_image, verbose=0)
+            outputs = self.model.predict(model_input, verbose=0)
             
-            # Extract probability (assuming binary classification)
-            # If model outputs single value (sigmoid), use it directly
-            # If model outputs two values (softmax), use the second one (eczema class)
-            if predictions.shape[1] == 1:
-                eczema_probability = float(predictions[0][0])
-            else:
-                eczema_probability = float(predictions[0][1])  # Assuming [normal, eczema]
-            
-            return {
-                "eczema_probability": eczema_probability,
-                "normal_probability": 1 - eczema_probability,
-                "raw_predictions": predictions.tolist()
-            }
+            if self.return_embedding:
+                predictions, embeddings = outputs
+                return self._to_result(predictions[0], embeddings[0])
+            return self._to_result(outputs[0])
         except Exception as e:
             print(f"Error during prediction: {e}")
             raise RuntimeError(f"Prediction failed: {str(e)}")
+    
+    def predict_batch_sync(self, images: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        Batched prediction (one model call for N images, used by offline scoring)
+        
+        Args:
+            images: N x H x W x 3 batch (uint8, or float normalized 0-1)
+        
+        Returns:
+            One prediction dictionary per image (same fields as predict_sync)
+        """
+        if not self._loaded:
+            raise RuntimeError("Model not loaded. Call load_model() first.")
+        
+        try:
+            model_input = self._prepare_input(images)
+            outputs = self.model.predict(model_input, batch_size=len(model_input), verbose=0)
+            if self.return_embedding:
+                predictions, embeddings = outputs
+                return [self._to_result(row, embedding) for row, embedding in zip(predictions, embeddings)]
+            return [self._to_result(row) for row in outputs]
+        except Exception as e:
+            print(f"Error during batch prediction: {e}")
+            raise RuntimeError(f"Prediction failed: {str(e)}")
+    
+    def _to_result(self, prediction: np.ndarray, embedding: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        # Extract probability (assuming binary classification)
+        # If model outputs single value (sigmoid), use it directly
+        # If model outputs two values (softmax), use the second one (eczema class)
+        if prediction.shape[0] == 1:
+            eczema_probability = float(prediction[0])
+        else:
+            eczema_probability = float(prediction[1])  # Assuming [normal, eczema]
+        
+        result = {
+            "eczema_probability": eczema_probability,
+            "normal_probability": 1 - eczema_probability,
+            "raw_predictions": [prediction.tolist()]
+        }
+        if embedding is not None:
+            result["embedding"] = np.asarray(embedding, dtype=np.float32)
+        return result
+    
+    def _prepare_input(self, image: np.ndarray) -> np.ndarray:
+        """
+        Build the float32 model batch from uint8 pixels
+        
+        The normalized tensor only exists here, written into a per-thread buffer
+        that is reused across requests instead of allocating a new array each time.
+        """
+        # Ensure image is in correct shape for model
+        images = image[np.newaxis] if image.ndim == 3 else image
+        
+        if self.in_graph_preprocessing:
+            # Rescaling is part of the graph: feed uint8 directly (no float copy)
+            if images.dtype != np.uint8:
+                images = np.clip(np.rint(images * 255.0), 0, 255).astype(np.uint8)
+            return images
+        
+        if images.dtype != np.uint8:
+            # Already normalized float input (legacy callers)
+            return images
+        
+        buffer = getattr(self._local, "input_batch", None)
+        if buffer is None or buffer.shape[0] < images.shape[0] or buffer.shape[1:] != images.shape[1:]:
+            buffer = np.empty(images.shape, dtype=np.float32)
+            self._local.input_batch = buffer
+        
+        model_input = buffer[:images.shape[0]]
+        np.divide(images, 255.0, out=model_input, dtype=np.float32)
+        return model_input
 
 
 
@@ -0,0 +1,162 @@
+"""
+Near-Duplicate Index - Reuses recent analyses for re-photographed / re-encoded uploads
+Keeps the perceptual hashes of recent analyses in a bounded ring buffer; lookups are
+one vectorized XOR + popcount over the whole buffer
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+
+NEAR_DUP_REUSE_MODES = ("off", "gemini", "response")
+
+# Bits set per byte value (numpy 1.26 has no bitwise_count)
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def hamming_distances(hashes: np.ndarray, query: int) -> np.ndarray:
+    """Bit distance between every 64-bit hash in hashes and query"""
+    differing = np.bitwise_xor(hashes, np.uint64(query))
+    return _POPCOUNT[differing.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+@dataclass
+class NearDuplicateEntry:
+    """
+    One stored analysis
+    
+    verdict is the Gemini (eczema_detected, confidence) pair, or None when Gemini
+    gave no assessment (the explanation is not kept: its text quotes the model output
+    of the request that produced it); response is the AnalysisResponse returned and
+    embedding the model embedding, when the model returns one.
+    """
+    sha256: str
+    response: Any
+    verdict: Optional[Tuple[Optional[bool], Optional[float]]]
+    added_at: float
+    embedding: Optional[np.ndarray] = None
+
+
+class NearDuplicateIndex:
+    """
+    Perceptual-hash index over recent analyses
+    
+    Configuration (environment):
+    - NEAR_DUP_REUSE: "gemini" (default: reuse the stored Gemini verdict, the local
+      model still runs), "response" (return the stored analysis as is) or "off"
+    - NEAR_DUP_MAX_DISTANCE: Max differing bits (of 64) for both pHash and dHash (default 8)
+    - NEAR_DUP_CAPACITY: Analyses kept; the oldest is overwritten when full (default 10000)
+    - NEAR_DUP_TTL_SECONDS: Entries older than this never match (default 3600)
+    """
+    
+    def __init__(
+        self,
+        reuse: Optional[str] = None,
+        max_distance: Optional[int] = None,
+        capacity: Optional[int] = None,
+        ttl: Optional[float] = None
+    ):
+        self.reuse = (reuse or os.getenv("NEAR_DUP_REUSE", "gemini")).lower()
+        if self.reuse not in NEAR_DUP_REUSE_MODES:
+            raise ValueError(
+                f"Invalid NEAR_DUP_REUSE '{self.reuse}'. Expected one of: {', '.join(NEAR_DUP_REUSE_MODES)}"
+            )
+        self.max_distance = max_distance if max_distance is not None else int(os.getenv("NEAR_DUP_MAX_DISTANCE", "8"))
+        self.capacity = capacity or int(os.getenv("NEAR_DUP_CAPACITY", "10000"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("NEAR_DUP_TTL_SECONDS", "3600"))
+        
+        # Ring buffer: slot i holds _phash[i], _dhash[i], _added[i] and _entries[i]
+        self._phash = np.zeros(self.capacity, dtype=np.uint64)
+        self._dhash = np.zeros(self.capacity, dtype=np.uint64)
+        self._added = np.zeros(self.capacity, dtype=np.float64)
+        self._has_verdict = np.zeros(self.capacity, dtype=bool)
+        self._entries = [None] * self.capacity
+        self._next = 0
+        self._size = 0
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "identical_hits": 0, "stored": 0, "evicted": 0}
+    
+    @property
+    def enabled(self) -> bool:
+        return self.reuse != "off"
+    
+    def lookup(self, hashes: Tuple[int, int], sha256: Optional[str] = None) -> Optional[NearDuplicateEntry]:
+        """
+        Closest recent analysis within max_distance on both hashes
+        
+        In "gemini" mode only entries that carry a Gemini verdict can match.
+        
+        Args:
+            hashes: (phash, dhash) of the upload
+            sha256: Upload digest, only used to count byte-identical hits
+        
+        Returns:
+            The matching entry, or None
+        """
+        now = time.time()
+        with self._lock:
+            self.stats["lookups"] += 1
+            if self._size == 0:
+                return None
+            
+            phash_distances = hamming_distances(self._phash[:self._size], hashes[0])
+            dhash_distances = hamming_distances(self._dhash[:self._size], hashes[1])
+            candidates = (
+                (phash_distances <= self.max_distance) &
+                (dhash_distances <= self.max_distance) &
+                (self._added[:self._size] >= now - self.ttl)
+            )
+            if self.reuse == "gemini":
+                candidates &= self._has_verdict[:self._size]
+            if not candidates.any():
+                return None
+            
+            # Closest match; the most recent one among equals
+            total = np.where(candidates, phash_distances.astype(np.int64) + dhash_distances, np.iinfo(np.int64).max)
+            best = np.flatnonzero(total == total.min())
+            slot = int(best[np.argmax(self._added[best])])
+            entry = self._entries[slot]
+            
+            self.stats["hits"] += 1
+            if sha256 is not None and entry.sha256 == sha256:
+                self.stats["identical_hits"] += 1
+            return entry
+    
+    def add(
+        self,
+        hashes: Tuple[int, int],
+        sha256: str,
+        response: Any,
+        verdict: Optional[Tuple[Optional[bool], Optional[float]]] = None,
+        embedding: Optional[np.ndarray] = None
+    ):
+        """Store a finished analysis, overwriting the oldest one when the buffer is full"""
+        with self._lock:
+            slot = self._next
+            if self._entries[slot] is not None:
+                self.stats["evicted"] += 1
+            self._phash[slot] = np.uint64(hashes[0])
+            self._dhash[slot] = np.uint64(hashes[1])
+            self._added[slot] = time.time()
+            self._has_verdict[slot] = verdict is not None
+            self._entries[slot] = NearDuplicateEntry(sha256, response, verdict, self._added[slot], embedding)
+            self._next = (slot + 1) % self.capacity
+            self._size = max(self._size, slot + 1)
+            self.stats["stored"] += 1
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and hit rate (for /health)"""
+        with self._lock:
+            lookups = self.stats["lookups"]
+            return {
+                **self.stats,
+                "reuse": self.reuse,
+                "size": self._size,
+                "capacity": self.capacity,
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,155 @@
+"""
+OOD Scorer - Out-of-distribution score from the model's penultimate-layer embedding
+Mahalanobis distance to the nearest class centroid (shared, shrunk covariance),
+against a compact reference file built offline by build_ood_reference.py
+"""
+
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+def build_reference(
+    embeddings: np.ndarray,
+    labels: np.ndarray,
+    class_names: List[str],
+    percentile: float = 95.0,
+    shrinkage: float = 0.1
+) -> Dict[str, np.ndarray]:
+    """
+    Fit class centroids and a whitening transform on in-distribution embeddings
+    
+    Args:
+        embeddings: N x D reference embeddings
+        labels: N class indices into class_names
+        class_names: Name of each class (e.g. folder names)
+        percentile: Percentile of the reference distances used as the OOD threshold
+        shrinkage: Covariance shrinkage towards a scaled identity (0-1); keeps the
+            inverse stable when the reference set is small compared to D
+    
+    Returns:
+        Arrays to store with np.savez (see EmbeddingOODScorer)
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float64)
+    labels = np.asarray(labels)
+    centroids = np.stack([embeddings[labels == k].mean(axis=0) for k in range(len(class_names))])
+    
+    # Shared (tied) covariance of the class-centred embeddings
+    centred = embeddings - centroids[labels]
+    covariance = centred.T @ centred / max(len(embeddings) - 1, 1)
+    dim = covariance.shape[0]
+    covariance = (1.0 - shrinkage) * covariance + shrinkage * (np.trace(covariance) / dim) * np.eye(dim)
+    
+    # W with ||(x - c) W||^2 = (x - c)^T covariance^-1 (x - c)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    whitening = eigenvectors / np.sqrt(np.maximum(eigenvalues, 1e-12))
+    
+    reference = {
+        "classes": np.array(class_names),
+        "centroids": centroids.astype(np.float32),
+        "whitening": whitening.astype(np.float32),
+        "percentile": np.float32(percentile),
+        "reference_size": np.int64(len(embeddings)),
+    }
+    distances = EmbeddingOODScorer.from_arrays(reference).score_batch(embeddings)
+    reference["threshold"] = np.float32(np.percentile(distances, percentile))
+    return reference
+
+
+class EmbeddingOODScorer:
+    """
+    Scores how far an embedding lies from the reference (training-like) distribution
+    
+    Configuration (environment):
+    - OOD_REFERENCE_PATH: .npz written by build_ood_reference.py
+      (default: models/ood_reference.npz)
+    - OOD_THRESHOLD: Override of the distance threshold stored in the reference file
+    
+    The score is the Mahalanobis distance to the nearest class centroid: one D x D
+    matrix-vector product per request on top of the forward pass already made.
+    """
+    
+    def __init__(self, reference_path: Optional[str] = None):
+        self.reference_path = reference_path or os.getenv("OOD_REFERENCE_PATH", "models/ood_reference.npz")
+        with np.load(self.reference_path) as data:
+            self._load({name: data[name] for name in data.files})
+    
+    @classmethod
+    def from_arrays(cls, reference: Dict[str, np.ndarray]) -> "EmbeddingOODScorer":
+        scorer = cls.__new__(cls)
+        scorer.reference_path = None
+        scorer._load(reference)
+        return scorer
+    
+    def _load(self, reference: Dict[str, np.ndarray]):
+        self.classes = [str(name) for name in reference["classes"]]
+        self.whitening = reference["whitening"].astype(np.float32)
+        # Centroids are projected once here, so a request only projects its own embedding
+        self.whitened_centroids = reference["centroids"].astype(np.float32) @ self.whitening
+        self.dim = self.whitening.shape[0]
+        self.reference_size = int(reference["reference_size"])
+        threshold = os.getenv("OOD_THRESHOLD")
+        if threshold is not None:
+            self.threshold = float(threshold)
+        elif "threshold" in reference:
+            self.threshold = float(reference["threshold"])
+        else:
+            self.threshold = float("inf")
+    
+    def score(self, embedding: np.ndarray) -> float:
+        """
+        Distance from one embedding to the nearest class centroid (larger = more OOD)
+        """
+        return float(self.score_batch(np.asarray(embedding)[np.newaxis])[0])
+    
+    def score_batch(self, embeddings: np.ndarray) -> np.ndarray:
+        """Distances for an N x D batch of embeddings"""
+        projected = np.asarray(embeddings, dtype=np.float32) @ self.whitening
+        distances = ((projected[:, np.newaxis, :] - self.whitened_centroids[np.newaxis]) ** 2).sum(axis=2)
+        return np.sqrt(distances.min(axis=1))
+    
+    def is_out_of_distribution(self, score: float) -> bool:
+        return score > self.threshold
+    
+    def describe(self) -> Dict[str, object]:
+        """Reference summary (for /health)"""
+        return {
+            "classes": self.classes,
+            "embedding_dim": self.dim,
+            "reference_size": self.reference_size,
+            "threshold": round(self.threshold, 4),
+        }
+
+
+def embedding_mode_requested() -> bool:
+    """UNCERTAINTY_MODE=embedding (the model must then also return its embedding)"""
+    return os.getenv("UNCERTAINTY_MODE", "heuristic").lower() == "embedding"
+
+
+def load_ood_scorer(model_service) -> Optional[EmbeddingOODScorer]:
+    """
+    Embedding scorer for UNCERTAINTY_MODE=embedding, or None (heuristic mode)
+    
+    Falls back to the CV heuristics, with a warning, when the reference file is
+    missing or does not match the model's embedding size.
+    """
+    if not embedding_mode_requested():
+        return None
+    if model_service is None or not model_service.return_embedding:
+        print("⚠️  UNCERTAINTY_MODE=embedding needs the model's embedding output; using heuristics")
+        return None
+    
+    try:
+        scorer = EmbeddingOODScorer()
+    except (OSError, KeyError, ValueError) as e:
+        print(f"⚠️  Warning: Could not load OOD reference: {e}; using heuristics")
+        return None
+    
+    if scorer.dim != model_service.embedding_dim:
+        print(f"⚠️  Warning: OOD reference has {scorer.dim}-dim embeddings but the model produces "
+              f"{model_service.embedding_dim}; rebuild it with build_ood_reference.py. Using heuristics")
+        return None
+    
+    print(f"✅ Embedding OOD scorer loaded ({scorer.reference_size} reference images, threshold {scorer.threshold:.2f})")
+    return scorer
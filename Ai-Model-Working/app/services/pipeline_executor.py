@@ -0,0 +1,224 @@
+"""
+Pipeline Executor - Runs analysis stages as a small dependency graph
+Independent stages (relevance, inference, image-only heuristics) run concurrently
+on worker threads in parallel mode, or one after another in sequential mode
+"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+PIPELINE_MODES = ("parallel", "sequential")
+
+
+@dataclass
+class Stage:
+    """
+    One node of the analysis graph
+    
+    func is a synchronous callable receiving the results of depends_on (in order)
+    as positional arguments. If abort_if returns True for the stage result, the
+    run stops and every stage still pending or running is cancelled.
+    """
+    name: str
+    func: Callable[..., Any]
+    depends_on: Tuple[str, ...] = ()
+    abort_if: Optional[Callable[[Any], bool]] = None
+
+
+class PipelineAborted(Exception):
+    """Raised when a stage's abort_if predicate rejects its result"""
+    
+    def __init__(self, stage: str, result: Any, results: Dict[str, Any]):
+        super().__init__(f"Pipeline aborted at stage '{stage}'")
+        self.stage = stage
+        self.result = result
+        self.results = results
+
+
+class PipelineExecutor:
+    """
+    Dependency-graph executor for the analysis pipeline
+    
+    Modes (PIPELINE_MODE environment variable, overridable per run):
+    - "parallel": every stage whose dependencies are satisfied is submitted to a
+      thread pool; results are joined as they complete
+    - "sequential": stages run inline on the event loop in declaration order
+      (the original strictly ordered pipeline, kept for benchmarking)
+    
+    Note: stages already running on a worker thread cannot be interrupted; cancellation
+    prevents queued stages from starting and discards the results of running ones.
+    stats["stages_cancelled"] counts stages a cancelled run (e.g. a client disconnect)
+    never started.
+    """
+    
+    def __init__(self, mode: Optional[str] = None, max_workers: Optional[int] = None):
+        self.mode = self._validate_mode(mode or os.getenv("PIPELINE_MODE", "parallel"))
+        self.max_workers = max_workers or int(os.getenv("PIPELINE_WORKERS", "4"))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pipeline")
+        self.stats = {"stages_cancelled": 0}
+    
+    @staticmethod
+    def _validate_mode(mode: str) -> str:
+        mode = mode.lower()
+        if mode not in PIPELINE_MODES:
+            raise ValueError(f"Invalid pipeline mode '{mode}'. Expected one of: {', '.join(PIPELINE_MODES)}")
+        return mode
+    
+    async def run(
+        self,
+        stages: List[Stage],
+        mode: Optional[str] = None,
+        on_stage_complete: Optional[Callable[[str, Any], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Run a stage graph
+        
+        Args:
+            stages: Stages in a valid topological order (dependencies declared first)
+            mode: Optional override of the executor mode for this run
+            on_stage_complete: Called on the event loop with (stage name, result) as each
+                stage finishes without aborting, e.g. to start speculative work early
+        
+        Returns:
+            Dictionary mapping stage name to result
+        
+        Raises:
+            PipelineAborted: If a stage's abort_if predicate matched
+        """
+        self._validate_graph(stages)
+        run_mode = self._validate_mode(mode) if mode else self.mode
+        
+        if run_mode == "sequential":
+            return self._run_sequential(stages, on_stage_complete)
+        return await self._run_parallel(stages, on_stage_complete)
+    
+    def shutdown(self):
+        """Release worker threads"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+    
+    def _validate_graph(self, stages: List[Stage]):
+        seen = set()
+        for stage in stages:
+            if stage.name in seen:
+                raise ValueError(f"Duplicate stage name '{stage.name}'")
+            missing = [dep for dep in stage.depends_on if dep not in seen]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' depends on undeclared stage(s): {', '.join(missing)}")
+            seen.add(stage.name)
+    
+    def _run_sequential(self, stages: List[Stage], on_stage_complete=None) -> Dict[str, Any]:
+        results: Dict[str, Any] = {}
+        for stage in stages:
+            result = stage.func(*[results[dep] for dep in stage.depends_on])
+            results[stage.name] = result
+            if stage.abort_if is not None and stage.abort_if(result):
+                raise PipelineAborted(stage.name, result, results)
+            if on_stage_complete is not None:
+                on_stage_complete(stage.name, result)
+        return results
+    
+    async def _run_parallel(self, stages: List[Stage], on_stage_complete=None) -> Dict[str, Any]:
+        results: Dict[str, Any] = {}
+        pending = list(stages)
+        running: Dict[asyncio.Future, Stage] = {}
+        # Pool futures of the running stages: cancel() tells whether the stage had started
+        submitted: Dict[asyncio.Future, Future] = {}
+        
+        try:
+            while pending or running:
+                # Submit every stage whose dependencies are satisfied
+                for stage in [s for s in pending if all(dep in results for dep in s.depends_on)]:
+                    call = functools.partial(stage.func, *[results[dep] for dep in stage.depends_on])
+                    pool_future = self._pool.submit(call)
+                    future = asyncio.wrap_future(pool_future)
+                    running[future] = stage
+                    submitted[future] = pool_future
+                    pending.remove(stage)
+                
+                done, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    result = future.result()  # Re-raises stage errors; finally cancels the rest
+                    results[stage.name] = result
+                    if stage.abort_if is not None and stage.abort_if(result):
+                        raise PipelineAborted(stage.name, result, results)
+                    if on_stage_complete is not None:
+                        on_stage_complete(stage.name, result)
+            
+            return results
+        except asyncio.CancelledError:
+            # Caller cancelled: stages never submitted or still queued in the pool are skipped
+            queued = sum(1 for future in running if submitted[future].cancel())
+            self.stats["stages_cancelled"] += len(pending) + queued
+            raise
+        finally:
+            for future in running:
+                future.cancel()
+
+
+def build_analysis_stages(
+    processed_image: Any,
+    relevance_detector: Any,
+    model_service: Optional[Any],
+    uncertainty_detector: Any,
+    severity_estimator: Any,
+    cv_executor: Optional[Any] = None,
+    heuristics: bool = True
+) -> List[Stage]:
+    """
+    Stage graph of /analyze: everything here depends only on the processed image
+    
+    relevance ─┐
+    inference ─┼─> joined at the decision step
+    uncertainty_features ─> severity_features (reuses redness / LBP variance)
+    
+    The inference stage is omitted when model_service is None, and uncertainty_features
+    when the detector scores the model embedding instead. heuristics=False (the "fast"
+    quality profile) leaves only relevance and inference. With a CVExecutor the
+    heuristic stages go through it (e.g. LBP-heavy stages to a worker process).
+    """
+    def offload(stage_name: str, func: Callable[..., Any], *args) -> Any:
+        if cv_executor is None:
+            return func(processed_image, *args)
+        return cv_executor.call(stage_name, func, processed_image, *args)
+    
+    stages = [
+        # Human Skin / Face Relevance Check - rejection cancels everything else
+        Stage(
+            "relevance",
+            lambda: offload("relevance", relevance_detector.check_relevance_sync),
+            abort_if=lambda result: not result[0]
+        ),
+    ]
+    if model_service is not None:
+        # Model Inference (Binary)
+        stages.append(Stage("inference", lambda: model_service.predict_sync(processed_image)))
+    if not heuristics:
+        return stages
+    if model_service is not None and uncertainty_detector.uses_embedding:
+        # Uncertainty comes from the embedding OOD score: no CV feature stage to run
+        stages.append(Stage(
+            "severity_features",
+            lambda: offload("severity_features", severity_estimator.extract_image_features)
+        ))
+        return stages
+    
+    stages.extend([
+        Stage(
+            "uncertainty_features",
+            lambda: offload("uncertainty_features", uncertainty_detector.extract_image_features)
+        ),
+        Stage(
+            "severity_features",
+            lambda uncertainty_features: offload(
+                "severity_features", severity_estimator.extract_image_features, uncertainty_features
+            ),
+            depends_on=("uncertainty_features",)
+        ),
+    ])
+    return stages
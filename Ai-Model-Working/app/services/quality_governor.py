@@ -0,0 +1,138 @@
+"""
+Quality Governor - Pipeline profiles and automatic step-down under overload
+Requests run as "full" (Gemini vision and every heuristic), "standard" (no Gemini
+vision: text-only explanation) or "fast" (relevance, model and confidence band only,
+local explanation). Callers may ask for a lower profile; when the admission queue or
+the recent p95 latency crosses a threshold, every request is stepped down
+"""
+
+import os
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+
+# In order of decreasing cost: a higher index is a step down
+QUALITY_PROFILES = ("full", "standard", "fast")
+
+# Latencies needed before the p95 trigger is trusted
+MIN_LATENCY_SAMPLES = 20
+
+
+class QualityGovernor:
+    """
+    Picks the pipeline profile of each request
+    
+    Configuration (environment):
+    - QUALITY_DEFAULT_PROFILE: Profile of requests that do not ask for one (default: full)
+    - QUALITY_HEADER: Request header naming a profile (default: X-Quality-Profile)
+    - QUALITY_STANDARD_QUEUE_DEPTH / QUALITY_FAST_QUEUE_DEPTH: Admission queue depth at
+      which every request is stepped down to standard / fast (defaults: 8 / 24; 0 disables)
+    - QUALITY_STANDARD_P95_MS / QUALITY_FAST_P95_MS: Same for the p95 latency of the last
+      QUALITY_LATENCY_WINDOW requests (defaults: 10000 / 20000 ms, window 100; 0 disables)
+    - QUALITY_HOLD_SECONDS: Time at a stepped-down level before stepping back up one
+      level, so the lower latency of the cheaper profile does not flip it straight back (default: 30)
+    
+    A stricter caller request always wins; the automatic level only caps quality.
+    """
+    
+    def __init__(self):
+        self.default_profile = os.getenv("QUALITY_DEFAULT_PROFILE", "full").strip().lower()
+        if self.default_profile not in QUALITY_PROFILES:
+            raise ValueError(
+                f"Invalid QUALITY_DEFAULT_PROFILE '{self.default_profile}'. Expected one of: {', '.join(QUALITY_PROFILES)}"
+            )
+        self.header = os.getenv("QUALITY_HEADER", "X-Quality-Profile")
+        self.queue_thresholds = (
+            int(os.getenv("QUALITY_STANDARD_QUEUE_DEPTH", "8")),
+            int(os.getenv("QUALITY_FAST_QUEUE_DEPTH", "24")),
+        )
+        self.latency_thresholds = (
+            float(os.getenv("QUALITY_STANDARD_P95_MS", "10000")),
+            float(os.getenv("QUALITY_FAST_P95_MS", "20000")),
+        )
+        self.hold_seconds = float(os.getenv("QUALITY_HOLD_SECONDS", "30"))
+        
+        self._latencies = deque(maxlen=max(int(os.getenv("QUALITY_LATENCY_WINDOW", "100")), 1))
+        # Automatic step-down level (index into QUALITY_PROFILES)
+        self.level = 0
+        self._changed_at = 0.0
+        self.stats = {
+            "served": {profile: 0 for profile in QUALITY_PROFILES},
+            "stepped_down": 0,
+            "level_changes": 0,
+        }
+    
+    def requested(self, headers) -> Optional[str]:
+        """Profile named by the request header (None when absent or unknown)"""
+        profile = headers.get(self.header, "").strip().lower()
+        return profile if profile in QUALITY_PROFILES else None
+    
+    def choose(self, requested: Optional[str], queue_depth: int) -> Tuple[str, bool]:
+        """
+        Profile to serve a request with
+        
+        Args:
+            requested: Caller's profile (None: QUALITY_DEFAULT_PROFILE)
+            queue_depth: Requests currently waiting for an analysis slot
+        
+        Returns:
+            Tuple of (profile, stepped_down): stepped_down is True when overload
+            lowered the profile below the one asked for
+        """
+        wanted = QUALITY_PROFILES.index(requested or self.default_profile)
+        level = self._automatic_level(queue_depth)
+        profile = QUALITY_PROFILES[max(wanted, level)]
+        stepped_down = level > wanted
+        self.stats["served"][profile] += 1
+        self.stats["stepped_down"] += int(stepped_down)
+        return profile, stepped_down
+    
+    def observe(self, latency_ms: float):
+        """Record the end-to-end latency of a served request"""
+        self._latencies.append(latency_ms)
+    
+    def p95_ms(self) -> Optional[float]:
+        if len(self._latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        return float(np.percentile(self._latencies, 95))
+    
+    def _target_level(self, queue_depth: int) -> int:
+        p95 = self.p95_ms()
+        for level in (2, 1):
+            queue_threshold = self.queue_thresholds[level - 1]
+            latency_threshold = self.latency_thresholds[level - 1]
+            if queue_threshold > 0 and queue_depth >= queue_threshold:
+                return level
+            if latency_threshold > 0 and p95 is not None and p95 >= latency_threshold:
+                return level
+        return 0
+    
+    def _automatic_level(self, queue_depth: int) -> int:
+        """Step down at once; step back up one level per hold period"""
+        now = time.monotonic()
+        target = self._target_level(queue_depth)
+        if target > self.level or (target < self.level and now - self._changed_at >= self.hold_seconds):
+            new_level = target if target > self.level else self.level - 1
+            print(f"⚠️  Quality profile: {QUALITY_PROFILES[self.level]} → {QUALITY_PROFILES[new_level]} "
+                  f"(queue depth {queue_depth}, p95 {self.p95_ms() or 0:.0f}ms)")
+            self.level = new_level
+            self._changed_at = now
+            self.stats["level_changes"] += 1
+        return self.level
+    
+    def describe(self) -> Dict[str, Any]:
+        p95 = self.p95_ms()
+        return {
+            "default_profile": self.default_profile,
+            "automatic_profile": QUALITY_PROFILES[self.level],
+            "header": self.header,
+            "p95_ms": round(p95, 1) if p95 is not None else None,
+            "queue_thresholds": dict(zip(QUALITY_PROFILES[1:], self.queue_thresholds)),
+            "p95_thresholds_ms": dict(zip(QUALITY_PROFILES[1:], self.latency_thresholds)),
+            "served": dict(self.stats["served"]),
+            "stepped_down": self.stats["stepped_down"],
+            "level_changes": self.stats["level_changes"],
+        }
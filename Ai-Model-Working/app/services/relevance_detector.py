@@ -5,7 +5,10 @@ FIXED: Now accepts face images and all human skin areas (face, arms, legs, neck,
 
 import cv2
 import numpy as np
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
+
+from app.utils.batch_features import as_uint8_batch, count_nonzero_batch, stacked, variance_batch
+from app.utils.buffer_pool import PlanePool
 
 
 class RelevanceDetector:
@@ -19,7 +22,12 @@ class RelevanceDetector:
     Uses heuristic-based approach with computer vision
     """
     
-    def __init__(self):
+    def __init__(self, plane_pool: Optional[PlanePool] = None, cv_executor=None):
+        # Reusable CV planes (shared with the other detectors when main passes one pool)
+        self.plane_pool = plane_pool or PlanePool()
+        # Optional CVExecutor: runs the check on a thread/worker process instead of the event loop
+        self.cv_executor = cv_executor
+        
         # Expanded skin color ranges in HSV to cover all skin tones
         # These ranges are tuned to accept face, arms, legs, neck, torso
         # Lower threshold reduced to accept lighter skin tones (including faces)
@@ -41,6 +49,17 @@ class RelevanceDetector:
         Args:
             image: Preprocessed image array (RGB format)
         
+        Returns:
+            Tuple of (is_relevant, reason)
+        """
+        if self.cv_executor is not None:
+            return await self.cv_executor.run("relevance", self.check_relevance_sync, image)
+        return self.check_relevance_sync(image)
+    
+    def check_relevance_sync(self, image: np.ndarray) -> Tuple[bool, str]:
+        """
+        Synchronous relevance check (used by the pipeline executor on worker threads)
+        
         Returns:
             Tuple of (is_relevant, reason)
         """
@@ -57,80 +76,177 @@ class RelevanceDetector:
             if len(image.shape) != 3 or image.shape[2] != 3:
                 return (False, "Image must be a 3-channel RGB image")
             
-            # Convert RGB to BGR for OpenCV
-            bgr_image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-            
-            # Convert to HSV for better skin color detection
-            hsv_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV)
-            
-            # Create mask for skin color ranges (including face-friendly ranges)
-            mask1 = cv2.inRange(hsv_image, self.skin_lower_hsv, self.skin_upper_hsv)
-            mask2 = cv2.inRange(hsv_image, self.skin_lower_hsv2, self.skin_upper_hsv2)
-            mask3 = cv2.inRange(hsv_image, self.skin_lower_hsv3, self.skin_upper_hsv3)  # For very light skin/faces
-            skin_mask = cv2.bitwise_or(cv2.bitwise_or(mask1, mask2), mask3)
-            
-            # Calculate percentage of image that matches skin color
-            skin_pixel_count = np.sum(skin_mask > 0)
-            total_pixels = image.shape[0] * image.shape[1]
-            skin_percentage = (skin_pixel_count / total_pixels) * 100
-            
-            # Additional checks for human-like features
-            gray = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
-            edges = cv2.Canny(gray, 50, 150)
-            edge_density = np.sum(edges > 0) / total_pixels
-            
-            # Check image complexity (variance)
-            image_variance = np.var(gray)
-            
-            # FIXED HEURISTIC DECISION - More lenient to accept faces and all skin areas
-            # Reduced thresholds to accept:
-            # - Face images (often have lower skin percentage due to hair, eyes, etc.)
-            # - Close-up images
-            # - Various lighting conditions
-            
-            # Minimum skin percentage reduced from 15% to 10% to accept faces
-            # Edge density range expanded to accept face features
-            # Variance threshold reduced to accept smoother face skin
-            
-            is_relevant = (
-                skin_percentage >= 10.0 and  # Reduced from 15% to accept faces
-                (edge_density >= 0.03 or edge_density <= 0.5) and  # Expanded range for faces
-                image_variance > 50  # Reduced from 100 to accept smoother face skin
-            )
-            
-            # Additional check: If image has moderate skin percentage and reasonable features,
-            # accept it (this catches face images that might not pass strict thresholds)
-            if not is_relevant:
-                # Fallback: Accept if has some skin-like characteristics
-                # This ensures face images aren't rejected
-                has_some_skin = skin_percentage >= 8.0  # Very lenient threshold
-                has_reasonable_features = image_variance > 30  # Very lenient variance
-                
-                if has_some_skin and has_reasonable_features:
-                    is_relevant = True
-            
-            if not is_relevant:
-                reasons = []
-                if skin_percentage < 10.0:
-                    reasons.append(f"insufficient skin-colored pixels ({skin_percentage:.1f}%)")
-                if edge_density < 0.03:
-                    reasons.append("image appears too smooth/uniform")
-                elif edge_density > 0.5:
-                    reasons.append("image appears too complex/textured")
-                if image_variance <= 50:
-                    reasons.append("image lacks sufficient detail")
-                
-                reason = f"Uploaded image does not appear to be human skin. " + \
-                        f"Reasons: {', '.join(reasons)}. " + \
-                        f"Please upload a clear photo of affected skin area (face, arms, legs, neck, or torso)."
-                return False, reason
+            with self.plane_pool.checkout(image.shape[0], image.shape[1]) as arena:
+                skin_percentage, edge_density, image_variance = self._measure(image, arena)
             
-            return True, "Image appears to contain human skin (face, arms, legs, neck, or torso)"
+            return self._decide(skin_percentage, edge_density, image_variance)
         
         except Exception as e:
             # If detection fails, be conservative and allow the image
             # The model itself will provide the final assessment
             print(f"Warning: Relevance detection failed: {e}")
             return True, "Image relevance check completed"
-
-
+    
+    def check_relevance_batch(self, images: np.ndarray) -> List[Tuple[bool, str]]:
+        """
+        Batched relevance check (offline scoring); per-item results match check_relevance_sync
+        
+        Args:
+            images: N x H x W x 3 batch (RGB uint8; normalized float is converted per item)
+        
+        Returns:
+            One (is_relevant, reason) tuple per image
+        """
+        images = as_uint8_batch(images)
+        if images.ndim != 4 or images.shape[3] != 3:
+            return [(False, "Image must be a 3-channel RGB image")] * len(images)
+        
+        try:
+            n, h, w = images.shape[:3]
+            with self.plane_pool.checkout(n * h, w) as arena:
+                measurements = self._measure_batch(images, arena)
+            return [self._decide(*values) for values in zip(*measurements)]
+        
+        except Exception as e:
+            print(f"Warning: Batched relevance detection failed, checking per image: {e}")
+            return [self.check_relevance_sync(image) for image in images]
+    
+    def measure(self, image: np.ndarray) -> Dict[str, float]:
+        """
+        The measurements the relevance decision is based on (for golden_outputs.py)
+        
+        Args:
+            image: RGB uint8 image
+        
+        Returns:
+            Dictionary with skin_percentage, edge_density and image_variance
+        """
+        with self.plane_pool.checkout(image.shape[0], image.shape[1]) as arena:
+            values = self._measure(image, arena)
+        return dict(zip(("skin_percentage", "edge_density", "image_variance"), map(float, values)))
+    
+    def measure_batch(self, images: np.ndarray) -> List[Dict[str, float]]:
+        """Batched measure (N x H x W x 3 RGB uint8)"""
+        n, h, w = images.shape[:3]
+        with self.plane_pool.checkout(n * h, w) as arena:
+            measurements = self._measure_batch(images, arena)
+        return [
+            dict(zip(("skin_percentage", "edge_density", "image_variance"), map(float, values)))
+            for values in zip(*measurements)
+        ]
+    
+    def _decide(self, skin_percentage: float, edge_density: float, image_variance: float) -> Tuple[bool, str]:
+        """
+        Relevance decision from the measured features (shared by the single and batch paths)
+        
+        Returns:
+            Tuple of (is_relevant, reason)
+        """
+        # FIXED HEURISTIC DECISION - More lenient to accept faces and all skin areas
+        # Reduced thresholds to accept:
+        # - Face images (often have lower skin percentage due to hair, eyes, etc.)
+        # - Close-up images
+        # - Various lighting conditions
+        
+        # Minimum skin percentage reduced from 15% to 10% to accept faces
+        # Edge density range expanded to accept face features
+        # Variance threshold reduced to accept smoother face skin
+        
+        is_relevant = (
+            skin_percentage >= 10.0 and  # Reduced from 15% to accept faces
+            (edge_density >= 0.03 or edge_density <= 0.5) and  # Expanded range for faces
+            image_variance > 50  # Reduced from 100 to accept smoother face skin
+        )
+        
+        # Additional check: If image has moderate skin percentage and reasonable features,
+        # accept it (this catches face images that might not pass strict thresholds)
+        if not is_relevant:
+            # Fallback: Accept if has some skin-like characteristics
+            # This ensures face images aren't rejected
+            has_some_skin = skin_percentage >= 8.0  # Very lenient threshold
+            has_reasonable_features = image_variance > 30  # Very lenient variance
+            
+            if has_some_skin and has_reasonable_features:
+                is_relevant = True
+        
+        if not is_relevant:
+            reasons = []
+            if skin_percentage < 10.0:
+                reasons.append(f"insufficient skin-colored pixels ({skin_percentage:.1f}%)")
+            if edge_density < 0.03:
+                reasons.append("image appears too smooth/uniform")
+            elif edge_density > 0.5:
+                reasons.append("image appears too complex/textured")
+            if image_variance <= 50:
+                reasons.append("image lacks sufficient detail")
+            
+            reason = f"Uploaded image does not appear to be human skin. " + \
+                    f"Reasons: {', '.join(reasons)}. " + \
+                    f"Please upload a clear photo of affected skin area (face, arms, legs, neck, or torso)."
+            return False, reason
+        
+        return True, "Image appears to contain human skin (face, arms, legs, neck, or torso)"
+    
+    def _measure(self, image: np.ndarray, arena) -> Tuple[float, float, float]:
+        """
+        Compute skin percentage, edge density and gray variance into arena planes
+        
+        Returns:
+            Tuple of (skin_percentage, edge_density, image_variance)
+        """
+        # Convert RGB to BGR for OpenCV
+        bgr_image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR, dst=arena.bgr)
+        
+        # Convert to HSV for better skin color detection
+        hsv_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV, dst=arena.hsv)
+        
+        # Create mask for skin color ranges (including face-friendly ranges)
+        mask1 = cv2.inRange(hsv_image, self.skin_lower_hsv, self.skin_upper_hsv, dst=arena.mask)
+        mask2 = cv2.inRange(hsv_image, self.skin_lower_hsv2, self.skin_upper_hsv2, dst=arena.mask_alt)
+        mask3 = cv2.inRange(hsv_image, self.skin_lower_hsv3, self.skin_upper_hsv3, dst=arena.mask_extra)  # For very light skin/faces
+        skin_mask = cv2.bitwise_or(cv2.bitwise_or(mask1, mask2, dst=mask1), mask3, dst=mask1)
+        
+        # Calculate percentage of image that matches skin color
+        skin_pixel_count = cv2.countNonZero(skin_mask)
+        total_pixels = image.shape[0] * image.shape[1]
+        skin_percentage = (skin_pixel_count / total_pixels) * 100
+        
+        # Additional checks for human-like features
+        gray = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY, dst=arena.gray)
+        edges = cv2.Canny(gray, 50, 150, edges=arena.edges)
+        edge_density = cv2.countNonZero(edges) / total_pixels
+        
+        # Check image complexity (variance; meanStdDev avoids np.var's float64 copies)
+        _, std_dev = cv2.meanStdDev(gray)
+        image_variance = float(std_dev[0, 0]) ** 2
+        
+        return skin_percentage, edge_density, image_variance
+    
+    def _measure_batch(self, images: np.ndarray, arena) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Batched _measure: arena planes sized for the stacked (N*H) x W image
+        
+        Returns:
+            Arrays of skin_percentage, edge_density and image_variance (one value per image)
+        """
+        n, h, w = images.shape[:3]
+        total_pixels = h * w
+        
+        # Color conversions and range masks are per-pixel, so one call covers the batch
+        bgr_image = cv2.cvtColor(stacked(images), cv2.COLOR_RGB2BGR, dst=arena.bgr)
+        hsv_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV, dst=arena.hsv)
+        mask1 = cv2.inRange(hsv_image, self.skin_lower_hsv, self.skin_upper_hsv, dst=arena.mask)
+        mask2 = cv2.inRange(hsv_image, self.skin_lower_hsv2, self.skin_upper_hsv2, dst=arena.mask_alt)
+        mask3 = cv2.inRange(hsv_image, self.skin_lower_hsv3, self.skin_upper_hsv3, dst=arena.mask_extra)
+        skin_mask = cv2.bitwise_or(cv2.bitwise_or(mask1, mask2, dst=mask1), mask3, dst=mask1)
+        skin_percentage = (count_nonzero_batch(skin_mask.reshape(n, h, w)) / total_pixels) * 100
+        
+        gray = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY, dst=arena.gray).reshape(n, h, w)
+        
+        # Canny looks at neighbouring rows, so it runs per image to stay within image borders
+        edges = arena.edges.reshape(n, h, w)
+        for i in range(n):
+            cv2.Canny(gray[i], 50, 150, edges=edges[i])
+        edge_density = count_nonzero_batch(edges) / total_pixels
+        
+        return skin_percentage, edge_density, variance_batch(gray)
@@ -0,0 +1,286 @@
+"""
+Request Profiler - On-demand statistical profiles of single /analyze requests
+A sampler thread walks the Python stacks of every thread (event loop, pipeline and
+CV executor workers) while a request runs, and the samples are saved as a speedscope
+profile (one lane per thread) in a bounded local directory
+"""
+
+import asyncio
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+
+PROFILE_SUFFIX = ".speedscope.json"
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+# Leaf frames of a worker thread that is waiting for work rather than running it
+IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("selectors.py", "select"),
+}
+
+
+class RequestProfiler:
+    """
+    Decides which requests are profiled and keeps the captured profiles
+    
+    Configuration (environment):
+    - PROFILE_DIR: Directory of captured profiles (default: logs/profiles)
+    - PROFILE_SAMPLE_RATE: Profile 1 in N requests (default: 0, never)
+    - PROFILE_HEADER: Request header that asks for a profile when set to 1/true
+      (default: empty, header triggers disabled; e.g. X-Profile)
+    - PROFILE_SECRET: When set, the header must carry this value instead of 1/true
+    - PROFILE_INTERVAL_MS: Sampling interval (default: 5)
+    - PROFILE_MAX_FILES: Profiles kept; the oldest are deleted first (default: 50)
+    
+    Overlapping profiled requests each sample every thread, so a profile can also
+    contain work of requests running at the same time. Profiles hold the stacks with
+    absolute source paths, so only enable profiling where /profiles is not public.
+    """
+    
+    def __init__(self):
+        self.directory = os.getenv("PROFILE_DIR", "logs/profiles")
+        self.sample_rate = int(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+        self.header = os.getenv("PROFILE_HEADER", "").strip()
+        self.secret = os.getenv("PROFILE_SECRET", "")
+        self.interval = max(float(os.getenv("PROFILE_INTERVAL_MS", "5")), 0.5) / 1000.0
+        self.max_files = max(int(os.getenv("PROFILE_MAX_FILES", "50")), 1)
+        
+        self._lock = threading.Lock()
+        self.stats = {"captured": 0, "header": 0, "sampled": 0, "errors": 0}
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.header) or self.sample_rate > 0
+    
+    def trigger(self, headers) -> Optional[str]:
+        """Why this request should be profiled ("header" / "sampled"), or None"""
+        if self.header and self._header_matches(headers.get(self.header, "")):
+            return "header"
+        if self.sample_rate > 0 and random.randrange(self.sample_rate) == 0:
+            return "sampled"
+        return None
+    
+    def _header_matches(self, value: str) -> bool:
+        if self.secret:
+            return secrets.compare_digest(value.encode(), self.secret.encode())
+        return value.lower() in ("1", "true", "yes")
+    
+    @asynccontextmanager
+    async def capture(self, name: str, trigger: str):
+        """
+        Sample all threads for the duration of the block and save the profile
+        (must be entered on the event loop thread)
+        
+        Yields:
+            The profile ID (the file is written when the block exits)
+        """
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(4)}"
+        sampler = StackSampler(self.interval, threading.get_ident())
+        sampler.start()
+        failed = False
+        try:
+            yield profile_id
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            sampler.stop()
+            metadata = {
+                "id": profile_id,
+                "name": name,
+                "trigger": trigger,
+                "created_at": time.time(),
+                "duration_ms": round(sampler.duration * 1000.0, 1),
+                "samples": sampler.sample_count,
+                "interval_ms": self.interval * 1000.0,
+                "failed": failed,
+            }
+            await asyncio.to_thread(self._save, profile_id, sampler, metadata)
+    
+    def _save(self, profile_id: str, sampler: "StackSampler", metadata: Dict[str, Any]):
+        """Write the profile (temporary file + rename) and prune the directory"""
+        try:
+            document = sampler.to_speedscope(f"{metadata['name']} {profile_id}", metadata)
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, profile_id + PROFILE_SUFFIX)
+            temporary = path + ".tmp"
+            with open(temporary, "w") as f:
+                json.dump(document, f, separators=(",", ":"))
+            os.replace(temporary, path)
+        except OSError as e:
+            print(f"⚠️  Warning: Could not save profile {profile_id}: {e}")
+            with self._lock:
+                self.stats["errors"] += 1
+            return
+        with self._lock:
+            self.stats["captured"] += 1
+            self.stats[metadata["trigger"]] = self.stats.get(metadata["trigger"], 0) + 1
+        self._prune()
+    
+    def _prune(self):
+        """Delete the oldest profiles beyond max_files"""
+        with self._lock:
+            paths = sorted(self._paths(), key=os.path.getmtime)
+            for path in paths[:max(len(paths) - self.max_files, 0)]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    
+    def _paths(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return [
+            os.path.join(self.directory, entry) for entry in os.listdir(self.directory)
+            if entry.endswith(PROFILE_SUFFIX)
+        ]
+    
+    def path_of(self, profile_id: str) -> Optional[str]:
+        """File of a captured profile (None for unknown or malformed IDs)"""
+        if not profile_id or os.path.basename(profile_id) != profile_id or profile_id.startswith("."):
+            return None
+        path = os.path.join(self.directory, profile_id + PROFILE_SUFFIX)
+        return path if os.path.isfile(path) else None
+    
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        """Metadata of the captured profiles, newest first"""
+        profiles = []
+        for path in self._paths():
+            try:
+                with open(path) as f:
+                    metadata = json.load(f).get("metadata", {})
+                metadata["size_bytes"] = os.path.getsize(path)
+            except (OSError, ValueError):
+                continue
+            profiles.append(metadata)
+        return sorted(profiles, key=lambda item: item.get("created_at", 0), reverse=True)
+    
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "trigger_header": self.header or None,
+            "sample_rate": self.sample_rate,
+            "interval_ms": self.interval * 1000.0,
+            "max_files": self.max_files,
+            **self.stats,
+        }
+
+
+class StackSampler(threading.Thread):
+    """
+    Background thread taking a stack sample of every other thread each interval
+    
+    Samples of idle pool workers are dropped; the requesting thread (the event loop)
+    keeps its idle samples, so its lane shows where the request waited.
+    """
+    
+    def __init__(self, interval: float, owner_ident: int):
+        super().__init__(name="request-profiler", daemon=True)
+        self.interval = interval
+        self.owner_ident = owner_ident
+        self._stop_event = threading.Event()
+        self._frames: Dict[Tuple[str, str, int], int] = {}
+        # Thread ident -> {stack of frame indices, root first: sample count}
+        self._stacks: Dict[int, Counter] = {}
+        self._thread_names: Dict[int, str] = {}
+        self.sample_count = 0
+        self.duration = 0.0
+    
+    def run(self):
+        started = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            self._sample()
+        self.duration = time.perf_counter() - started
+    
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+    
+    def _frame_index(self, code) -> int:
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self._frames.get(key)
+        if index is None:
+            index = self._frames[key] = len(self._frames)
+        return index
+    
+    def _sample(self):
+        own_ident = threading.get_ident()
+        names = None
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            leaf = frame.f_code
+            if ident != self.owner_ident and (os.path.basename(leaf.co_filename), leaf.co_name) in IDLE_LEAVES:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_index(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            if ident not in self._thread_names:
+                if names is None:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                self._thread_names[ident] = names.get(ident, str(ident))
+            self._stacks.setdefault(ident, Counter())[tuple(stack)] += 1
+        self.sample_count += 1
+    
+    def to_speedscope(self, name: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Speedscope sampled-profile document (https://www.speedscope.app)"""
+        frames = [None] * len(self._frames)
+        for (function, filename, line), index in self._frames.items():
+            frames[index] = {"name": function, "file": filename, "line": line}
+        interval_ms = self.interval * 1000.0
+        
+        # Requesting thread first, then the busiest workers
+        idents = sorted(self._stacks, key=lambda ident: (ident != self.owner_ident, -sum(self._stacks[ident].values())))
+        profiles = []
+        for ident in idents:
+            stacks = self._stacks[ident]
+            thread_name = self._thread_names[ident]
+            if ident == self.owner_ident:
+                thread_name += " (request)"
+            profiles.append({
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(stacks.values()) * interval_ms,
+                "samples": [list(stack) for stack in stacks],
+                "weights": [count * interval_ms for count in stacks.values()],
+            })
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": name,
+            "exporter": "request_profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+            "metadata": metadata,
+        }
+
+
+def speedscope_to_folded(document: Dict[str, Any]) -> str:
+    """
+    Collapsed stacks ("thread;frame;frame count" lines) for flamegraph.pl / inferno,
+    with counts in sampling intervals
+    """
+    frames = document["shared"]["frames"]
+    interval_ms = document["metadata"].get("interval_ms") or 1.0
+    lines = []
+    for profile in document["profiles"]:
+        thread = profile["name"].replace(";", ":")
+        for stack, weight in zip(profile["samples"], profile["weights"]):
+            names = [f"{frames[index]['name']} ({os.path.basename(frames[index]['file'])})" for index in stack]
+            lines.append(f"{';'.join([thread] + names)} {max(int(round(weight / interval_ms)), 1)}")
+    return "\n".join(lines) + "\n"
@@ -4,7 +4,12 @@ Severity Estimator - Estimates eczema severity based on visual features
 
 import cv2
 import numpy as np
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.utils.batch_features import (
+    as_uint8_batch, count_nonzero_batch, local_binary_pattern_batch, stacked, variance_batch
+)
+from app.utils.buffer_pool import PlanePool
 
 
 class SeverityEstimator:
@@ -13,7 +18,18 @@ class SeverityEstimator:
     Based on heuristics: probability, redness, affected area, texture
     """
     
-    def __init__(self):
+    def __init__(self, plane_pool: Optional[PlanePool] = None, cv_executor=None):
+        # Reusable CV planes (shared with the other detectors when main passes one pool)
+        self.plane_pool = plane_pool or PlanePool()
+        # Optional CVExecutor: runs feature extraction on a thread/worker process
+        self.cv_executor = cv_executor
+        
+        # Red HSV ranges (red wraps around the hue axis)
+        self.lower_red1 = np.array([0, 50, 50], dtype=np.uint8)
+        self.upper_red1 = np.array([10, 255, 255], dtype=np.uint8)
+        self.lower_red2 = np.array([170, 50, 50], dtype=np.uint8)
+        self.upper_red2 = np.array([180, 255, 255], dtype=np.uint8)
+        
         # Severity thresholds
         self.mild_threshold = 0.5
         self.moderate_threshold = 0.7
@@ -23,7 +39,8 @@ class SeverityEstimator:
         self,
         image: np.ndarray,
         eczema_probability: float,
-        prediction_result: Dict[str, Any]
+        prediction_result: Dict[str, Any],
+        features: Optional[Dict[str, float]] = None
     ) -> str:
         """
         Estimate severity level based on multiple factors
@@ -32,91 +49,236 @@ class SeverityEstimator:
             image: Preprocessed image (RGB, may be normalized 0-1 or uint8 0-255)
             eczema_probability: Model's eczema probability (0-1)
             prediction_result: Full prediction result dictionary
+            features: Precomputed output of extract_image_features (computed here if omitted)
         
         Returns:
             Severity level: "Mild", "Moderate", or "Severe"
         """
         try:
-            # Ensure image is in correct format (uint8, 0-255 range)
-            if image.dtype != np.uint8:
-                # Convert float (0-1) to uint8 (0-255)
-                if image.max() <= 1.0:
-                    image = (image * 255).astype(np.uint8)
-                else:
-                    image = image.astype(np.uint8)
-            
-            # Ensure image has 3 channels
-            if len(image.shape) != 3 or image.shape[2] != 3:
-                # If grayscale, convert to RGB
-                if len(image.shape) == 2:
-                    image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+            if features is None:
+                if self.cv_executor is not None:
+                    features = await self.cv_executor.run("severity_features", self.extract_image_features, image)
                 else:
-                    raise ValueError(f"Unexpected image shape: {image.shape}")
+                    features = self.extract_image_features(image)
             
-            # Convert RGB to BGR for OpenCV
-            bgr_image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-            
-            # Factor 1: Model confidence
-            confidence_score = eczema_probability
+            return self._grade(features, eczema_probability)
+        
+        except Exception as e:
+            print(f"Error estimating severity: {e}")
+            return self._fallback_severity(eczema_probability)
+    
+    def estimate_severity_batch(
+        self,
+        images: np.ndarray,
+        eczema_probabilities: List[float],
+        prediction_results: List[Dict[str, Any]],
+        features: Optional[List[Dict[str, float]]] = None
+    ) -> List[str]:
+        """
+        Batched estimate_severity (offline scoring); per-item results are identical
+        
+        Args:
+            images: N x H x W x 3 batch (RGB uint8; normalized float is converted per item)
+            eczema_probabilities: Model's eczema probability per image
+            prediction_results: Full prediction result dictionary per image
+            features: Precomputed output of extract_image_features_batch (computed here if omitted)
+        
+        Returns:
+            One severity level per image
+        """
+        if features is None:
+            try:
+                features = self.extract_image_features_batch(images)
+            except Exception as e:
+                print(f"Error estimating severity: {e}")
+                return [self._fallback_severity(p) for p in eczema_probabilities]
+        
+        results = []
+        for item_features, eczema_probability in zip(features, eczema_probabilities):
+            try:
+                results.append(self._grade(item_features, eczema_probability))
+            except Exception as e:
+                print(f"Error estimating severity: {e}")
+                results.append(self._fallback_severity(eczema_probability))
+        return results
+    
+    def _grade(self, features: Dict[str, float], eczema_probability: float) -> str:
+        """Severity level from the image factors and model probability"""
+        # Factor 1: Model confidence
+        confidence_score = eczema_probability
+        
+        # Combine factors with weights
+        # Higher weights for model confidence and redness
+        combined_score = (
+            confidence_score * 0.4 +
+            features["redness_score"] * 0.3 +
+            features["affected_area_score"] * 0.2 +
+            features["texture_score"] * 0.1
+        )
+        
+        # Determine severity based on combined score
+        if combined_score >= self.severe_threshold:
+            return "Severe"
+        elif combined_score >= self.moderate_threshold:
+            return "Moderate"
+        else:
+            return "Mild"
+    
+    @staticmethod
+    def _fallback_severity(eczema_probability: float) -> str:
+        """Probability-only estimation used when the image factors are unavailable"""
+        if eczema_probability >= 0.85:
+            return "Severe"
+        elif eczema_probability >= 0.70:
+            return "Moderate"
+        else:
+            return "Mild"
+    
+    def extract_image_features(
+        self,
+        image: np.ndarray,
+        uncertainty_features: Optional[Dict[str, float]] = None
+    ) -> Dict[str, float]:
+        """
+        Compute the image-only severity factors (redness, affected area, texture)
+        Independent of the model output, so it can run concurrently with inference
+        
+        Args:
+            image: Preprocessed image (RGB, may be normalized 0-1 or uint8 0-255)
+            uncertainty_features: Optional UncertaintyDetector features for the same image;
+                its redness ratio and LBP variance are reused instead of recomputed
+        
+        Returns:
+            Dictionary with redness_score, affected_area_score and texture_score (0-1 each)
+        """
+        # Ensure image is in correct format (uint8, 0-255 range)
+        if image.dtype != np.uint8:
+            # Convert float (0-1) to uint8 (0-255)
+            if image.max() <= 1.0:
+                image = (image * 255).astype(np.uint8)
+            else:
+                image = image.astype(np.uint8)
+        
+        # Ensure image has 3 channels
+        if len(image.shape) != 3 or image.shape[2] != 3:
+            # If grayscale, convert to RGB
+            if len(image.shape) == 2:
+                image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+            else:
+                raise ValueError(f"Unexpected image shape: {image.shape}")
+        
+        with self.plane_pool.checkout(image.shape[0], image.shape[1]) as arena:
+            # Convert RGB to BGR for OpenCV; gray is shared by the area and texture factors
+            bgr_image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR, dst=arena.bgr)
+            gray = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY, dst=arena.gray)
             
-            # Factor 2: Redness intensity (eczema often shows redness)
-            redness_score = self._calculate_redness(bgr_image)
+            if uncertainty_features is not None:
+                # Same HSV red ranges and LBP as UncertaintyDetector, only the scaling differs
+                redness_score = min(uncertainty_features["redness_ratio"] * 3, 1.0)
+                texture_score = min(uncertainty_features["texture_variance"] / 1000.0, 1.0)
+            else:
+                # Factor 2: Redness intensity (eczema often shows redness)
+                redness_score = self._calculate_redness(bgr_image, arena)
+                # Factor 4: Texture irregularity
+                texture_score = self._calculate_texture_irregularity(gray, arena)
             
             # Factor 3: Affected area estimation
-            affected_area_score = self._estimate_affected_area(bgr_image)
-            
-            # Factor 4: Texture irregularity
-            texture_score = self._calculate_texture_irregularity(bgr_image)
-            
-            # Combine factors with weights
-            # Higher weights for model confidence and redness
-            combined_score = (
-                confidence_score * 0.4 +
-                redness_score * 0.3 +
-                affected_area_score * 0.2 +
-                texture_score * 0.1
-            )
+            affected_area_score = self._estimate_affected_area(gray, arena.mask_extra)
+        
+        return {
+            "redness_score": float(redness_score),
+            "affected_area_score": float(affected_area_score),
+            "texture_score": float(texture_score),
+        }
+    
+    def extract_image_features_batch(
+        self,
+        images: np.ndarray,
+        uncertainty_features: Optional[List[Dict[str, float]]] = None
+    ) -> List[Dict[str, float]]:
+        """
+        Batched extract_image_features: redness and LBP texture are reductions over the
+        batch axis; the affected-area contours are traced per image
+        
+        Args:
+            images: N x H x W x 3 batch (RGB uint8; normalized float is converted per item)
+            uncertainty_features: Optional UncertaintyDetector features per image (reused as
+                in the single-image path)
+        
+        Returns:
+            One feature dictionary per image (same values as extract_image_features)
+        """
+        images = as_uint8_batch(images)
+        if images.ndim != 4 or images.shape[3] != 3:
+            return [
+                self.extract_image_features(image, None if uncertainty_features is None else uncertainty_features[i])
+                for i, image in enumerate(images)
+            ]
+        
+        n, h, w = images.shape[:3]
+        with self.plane_pool.checkout(n * h, w) as arena:
+            bgr_image = cv2.cvtColor(stacked(images), cv2.COLOR_RGB2BGR, dst=arena.bgr)
+            gray = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY, dst=arena.gray).reshape(n, h, w)
             
-            # Determine severity based on combined score
-            if combined_score >= self.severe_threshold:
-                return "Severe"
-            elif combined_score >= self.moderate_threshold:
-                return "Moderate"
+            if uncertainty_features is not None:
+                redness_scores = [min(f["redness_ratio"] * 3, 1.0) for f in uncertainty_features]
+                texture_scores = [min(f["texture_variance"] / 1000.0, 1.0) for f in uncertainty_features]
             else:
-                return "Mild"
+                redness_scores, texture_scores = self._redness_and_texture_batch(bgr_image, gray, arena)
+            
+            # Adaptive threshold and contours are neighbourhood operations: one image at a time
+            thresholds = arena.mask_extra.reshape(n, h, w)
+            affected_area_scores = [self._estimate_affected_area(gray[i], thresholds[i]) for i in range(n)]
         
+        return [
+            {
+                "redness_score": float(redness_scores[i]),
+                "affected_area_score": float(affected_area_scores[i]),
+                "texture_score": float(texture_scores[i]),
+            }
+            for i in range(n)
+        ]
+    
+    def _redness_and_texture_batch(self, bgr_image: np.ndarray, gray: np.ndarray, arena) -> Tuple[list, list]:
+        """
+        Batched _calculate_redness and _calculate_texture_irregularity (same defaults on error)
+        """
+        n, h, w = gray.shape
+        try:
+            hsv = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV, dst=arena.hsv)
+            mask1 = cv2.inRange(hsv, self.lower_red1, self.upper_red1, dst=arena.mask)
+            mask2 = cv2.inRange(hsv, self.lower_red2, self.upper_red2, dst=arena.mask_alt)
+            red_mask = cv2.bitwise_or(mask1, mask2, dst=mask1)
+            redness_ratio = count_nonzero_batch(red_mask.reshape(n, h, w)) / (h * w)
+            redness_scores = [min(ratio * 3, 1.0) for ratio in redness_ratio]
         except Exception as e:
-            print(f"Error estimating severity: {e}")
-            # Fallback to probability-based estimation
-            if eczema_probability >= 0.85:
-                return "Severe"
-            elif eczema_probability >= 0.70:
-                return "Moderate"
-            else:
-                return "Mild"
+            print(f"Error calculating redness: {e}")
+            redness_scores = [0.5] * n
+        
+        try:
+            lbp = local_binary_pattern_batch(gray, out=arena.lbp.reshape(n, h, w))
+            texture_scores = [min(variance / 1000.0, 1.0) for variance in variance_batch(lbp)]
+        except Exception as e:
+            print(f"Error calculating texture irregularity: {e}")
+            texture_scores = [0.5] * n
+        
+        return redness_scores, texture_scores
     
-    def _calculate_redness(self, bgr_image: np.ndarray) -> float:
+    def _calculate_redness(self, bgr_image: np.ndarray, arena) -> float:
         """
         Calculate redness intensity in the image
         Returns normalized score (0-1)
         """
         try:
             # Convert to HSV
-            hsv = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV)
+            hsv = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV, dst=arena.hsv)
             
             # Red color range in HSV (red wraps around)
-            # Lower red range
-            lower_red1 = np.array([0, 50, 50])
-            upper_red1 = np.array([10, 255, 255])
-            mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
-            
-            # Upper red range
-            lower_red2 = np.array([170, 50, 50])
-            upper_red2 = np.array([180, 255, 255])
-            mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-            
-            red_mask = cv2.bitwise_or(mask1, mask2)
-            red_pixel_count = np.sum(red_mask > 0)
+            mask1 = cv2.inRange(hsv, self.lower_red1, self.upper_red1, dst=arena.mask)
+            mask2 = cv2.inRange(hsv, self.lower_red2, self.upper_red2, dst=arena.mask_alt)
+            
+            red_mask = cv2.bitwise_or(mask1, mask2, dst=mask1)
+            red_pixel_count = cv2.countNonZero(red_mask)
             total_pixels = bgr_image.shape[0] * bgr_image.shape[1]
             
             # Normalize to 0-1 range
@@ -127,34 +289,17 @@ class SeverityEstimator:
             print(f"Error calculating redness: {e}")
             return 0.5  # Default moderate redness
     
-    def _estimate_affected_area(self, bgr_image: np.ndarray) -> float:
+    def _estimate_affected_area(self, gray: np.ndarray, threshold_plane: np.ndarray) -> float:
         """
         Estimate the percentage of image showing affected skin
         Returns normalized score (0-1)
         """
         try:
-            # Ensure image is uint8
-            if bgr_image.dtype != np.uint8:
-                if bgr_image.max() <= 1.0:
-                    bgr_image = (bgr_image * 255).astype(np.uint8)
-                else:
-                    bgr_image = bgr_image.astype(np.uint8)
-            
-            # Convert to grayscale
-            gray = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
-            
-            # Ensure grayscale is uint8 (should be, but double-check)
-            if gray.dtype != np.uint8:
-                if gray.max() <= 1.0:
-                    gray = (gray * 255).astype(np.uint8)
-                else:
-                    gray = gray.astype(np.uint8)
-            
             # Use adaptive threshold to find irregular areas
             # Eczema often shows texture variations
             adaptive_thresh = cv2.adaptiveThreshold(
                 gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                cv2.THRESH_BINARY_INV, 11, 2
+                cv2.THRESH_BINARY_INV, 11, 2, dst=threshold_plane
             )
             
             # Find contours of irregular areas
@@ -167,7 +312,7 @@ class SeverityEstimator:
             
             # Calculate total area of contours
             total_area = sum(cv2.contourArea(c) for c in contours)
-            image_area = bgr_image.shape[0] * bgr_image.shape[1]
+            image_area = gray.shape[0] * gray.shape[1]
             
             affected_ratio = total_area / image_area
             return min(affected_ratio * 2, 1.0)  # Scale and cap at 1.0
@@ -176,33 +321,17 @@ class SeverityEstimator:
             print(f"Error estimating affected area: {e}")
             return 0.5  # Default moderate
     
-    def _calculate_texture_irregularity(self, bgr_image: np.ndarray) -> float:
+    def _calculate_texture_irregularity(self, gray: np.ndarray, arena) -> float:
         """
         Calculate texture irregularity (eczema often shows rough texture)
         Returns normalized score (0-1)
         """
         try:
-            # Ensure image is uint8
-            if bgr_image.dtype != np.uint8:
-                if bgr_image.max() <= 1.0:
-                    bgr_image = (bgr_image * 255).astype(np.uint8)
-                else:
-                    bgr_image = bgr_image.astype(np.uint8)
-            
-            # Convert to grayscale
-            gray = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
-            
-            # Ensure grayscale is uint8
-            if gray.dtype != np.uint8:
-                if gray.max() <= 1.0:
-                    gray = (gray * 255).astype(np.uint8)
-                else:
-                    gray = gray.astype(np.uint8)
-            
             # Calculate Local Binary Pattern (LBP) variance
             # Higher variance indicates more texture irregularity
-            lbp = self._local_binary_pattern(gray)
-            texture_variance = np.var(lbp)
+            lbp = self._local_binary_pattern(gray, out=arena.lbp)
+            _, std_dev = cv2.meanStdDev(lbp)
+            texture_variance = float(std_dev[0, 0]) ** 2
             
             # Normalize (typical range: 0-1000, normalize to 0-1)
             normalized_variance = min(texture_variance / 1000.0, 1.0)
@@ -213,14 +342,24 @@ class SeverityEstimator:
             print(f"Error calculating texture irregularity: {e}")
             return 0.5  # Default moderate
     
-    def _local_binary_pattern(self, image: np.ndarray, radius: int = 1, n_points: int = 8) -> np.ndarray:
+    def _local_binary_pattern(
+        self,
+        image: np.ndarray,
+        radius: int = 1,
+        n_points: int = 8,
+        out: Optional[np.ndarray] = None
+    ) -> np.ndarray:
         """
         Compute Local Binary Pattern for texture analysis
-        Simplified version
+        Simplified version (written into out, e.g. an arena plane, when given)
         """
         try:
             h, w = image.shape
-            lbp = np.zeros_like(image)
+            if out is None:
+                lbp = np.zeros_like(image)
+            else:
+                lbp = out
+                lbp.fill(0)
             
             for i in range(radius, h - radius):
                 for j in range(radius, w - radius):
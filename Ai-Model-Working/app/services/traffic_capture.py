@@ -0,0 +1,151 @@
+"""
+Traffic Capture - Anonymized records of sampled /analyze requests for workload replays
+One JSON line per request: arrival time, upload size and dimensions, content hash,
+status, stage timings and the Gemini latency and outcome. No file names, client
+addresses or response text are kept; image bytes only for consenting requests
+"""
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+
+class CapturedRequest:
+    """What a sampled request contributes to its capture record"""
+    
+    def __init__(self, consented: bool):
+        self.consented = consented
+        # Filled by run_analysis (sha256, image, timings, gemini)
+        self.details: Dict[str, Any] = {}
+        # Set by the endpoint once the upload is read / the analysis is done
+        self.image_bytes: Optional[bytes] = None
+        self.analysis = None
+
+
+class TrafficCapture:
+    """
+    Appends capture records for 1 in N /analyze requests
+    
+    Configuration (environment):
+    - TRAFFIC_CAPTURE_SAMPLE_RATE: Capture 1 in N requests (default: 0, off; 1 captures all)
+    - TRAFFIC_CAPTURE_PATH: JSON-lines capture file (default: logs/traffic.jsonl)
+    - TRAFFIC_CAPTURE_IMAGES_DIR: Where image bytes of consenting requests are kept,
+      named by content hash (unset: never kept)
+    - TRAFFIC_CAPTURE_CONSENT_HEADER: Request header marking an upload as consented for
+      the test set when set to 1/true (default: X-Test-Set-Consent)
+    """
+    
+    def __init__(self):
+        self.sample_rate = int(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", "0"))
+        self.path = os.getenv("TRAFFIC_CAPTURE_PATH", "logs/traffic.jsonl")
+        self.images_dir = os.getenv("TRAFFIC_CAPTURE_IMAGES_DIR") or None
+        self.consent_header = os.getenv("TRAFFIC_CAPTURE_CONSENT_HEADER", "X-Test-Set-Consent")
+        
+        self._lock = threading.Lock()
+        self._file = None
+        self.stats = {"captured": 0, "images_kept": 0}
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, "a")
+        if self.images_dir:
+            os.makedirs(self.images_dir, exist_ok=True)
+    
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 and bool(self.path)
+    
+    @asynccontextmanager
+    async def capture(self, headers):
+        """
+        Capture the request handled inside the block when it is sampled
+        
+        Yields:
+            CapturedRequest to fill in, or None when the request is not captured
+        """
+        if not self.enabled or random.randrange(self.sample_rate) != 0:
+            yield None
+            return
+        
+        consented = headers.get(self.consent_header, "").lower() in ("1", "true", "yes")
+        captured = CapturedRequest(consented)
+        arrived_at = time.time()
+        start = time.perf_counter()
+        status_code = 200
+        try:
+            yield captured
+        except HTTPException as e:
+            status_code = e.status_code
+            raise
+        except asyncio.CancelledError:
+            status_code = 499  # Client went away (see DisconnectGuard)
+            raise
+        except BaseException:
+            status_code = 500
+            raise
+        finally:
+            latency_ms = (time.perf_counter() - start) * 1000.0
+            self.record(captured, arrived_at, latency_ms, status_code)
+    
+    def record(self, captured: CapturedRequest, arrived_at: float, latency_ms: float, status_code: int):
+        """Append the record of one request (and keep its image if consented)"""
+        details = captured.details
+        analysis = captured.analysis
+        image = details.get("image", {})
+        record = {
+            "t": round(arrived_at, 3),
+            "sample_rate": self.sample_rate,
+            "status": status_code,
+            "latency_ms": round(latency_ms, 1),
+            "bytes": len(captured.image_bytes) if captured.image_bytes is not None else None,
+            "sha256": details.get("sha256"),
+            "format": image.get("format"),
+            "width": image.get("width"),
+            "height": image.get("height"),
+            "relevant": analysis.relevant if analysis is not None else None,
+            "prediction": analysis.prediction if analysis is not None else None,
+            "timings_ms": details.get("timings_ms", {}),
+            "gemini": details.get("gemini"),
+            "image_kept": False,
+        }
+        
+        if captured.consented and self.images_dir and captured.image_bytes is not None and record["sha256"]:
+            image_path = os.path.join(self.images_dir, record["sha256"])
+            try:
+                if not os.path.exists(image_path):
+                    with open(image_path + ".tmp", "wb") as f:
+                        f.write(captured.image_bytes)
+                    os.replace(image_path + ".tmp", image_path)
+                record["image_kept"] = True
+            except OSError as e:
+                print(f"⚠️  Warning: Could not keep captured image: {e}")
+        
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._file.flush()
+            self.stats["captured"] += 1
+            self.stats["images_kept"] += int(record["image_kept"])
+    
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "sample_rate": self.sample_rate,
+            "keeps_images": self.images_dir is not None,
+            **self.stats,
+        }
+    
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
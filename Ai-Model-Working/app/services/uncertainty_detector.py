@@ -5,9 +5,33 @@ Handles cases where model confidence is unreliable or patterns don't match train
 
 import cv2
 import numpy as np
-from typing import Dict, Any, Tuple
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Tuple
 import os
 
+from app.services.decision_policy import DecisionThresholds, decide
+from app.utils.batch_features import (
+    as_uint8_batch, count_nonzero_batch, local_binary_pattern_batch, stacked, variance_batch
+)
+from app.utils.buffer_pool import PlanePool
+
+
+@dataclass
+class UncertaintyFactors:
+    """
+    Image evidence for the uncertainty decision
+    
+    visual holds (reason, weight) pairs raised by the image (CV heuristics or the
+    embedding OOD score); unavailable is set when that evidence could not be
+    computed, which makes the decision Uncertain.
+    """
+    visual: List[Tuple[str, int]] = field(default_factory=list)
+    unavailable: Optional[str] = None
+    
+    @property
+    def weight(self) -> int:
+        return sum(weight for _, weight in self.visual)
+
 
 class UncertaintyDetector:
     """
@@ -20,15 +44,31 @@ class UncertaintyDetector:
     - Routes uncertain cases to "Uncertain / Other Skin Condition" state
     """
     
-    def __init__(self):
+    def __init__(self, plane_pool: Optional[PlanePool] = None, cv_executor=None, ood_scorer=None):
+        # Reusable CV planes (shared with the other detectors when main passes one pool)
+        self.plane_pool = plane_pool or PlanePool()
+        # Optional CVExecutor: runs feature extraction on a thread/worker process
+        self.cv_executor = cv_executor
+        # Optional EmbeddingOODScorer (UNCERTAINTY_MODE=embedding): when the prediction carries
+        # the model's embedding, its OOD score replaces the per-request CV heuristics
+        self.ood_scorer = ood_scorer
+        
+        # Red HSV ranges (red wraps around the hue axis)
+        self.lower_red1 = np.array([0, 50, 50], dtype=np.uint8)
+        self.upper_red1 = np.array([10, 255, 255], dtype=np.uint8)
+        self.lower_red2 = np.array([170, 50, 50], dtype=np.uint8)
+        self.upper_red2 = np.array([180, 255, 255], dtype=np.uint8)
+        
         # Confidence banding thresholds (configurable via environment)
-        # These define when to route to "Uncertain" state
+        # These define when to route to "Uncertain" state; the decision itself is
+        # decision_policy.decide, shared with the decision replay tool
         # ADJUSTED: More sensitive to eczema - lower threshold to catch more eczema cases
         # We want to catch eczema even at moderate probabilities (35%+)
-        self.high_confidence_threshold = float(os.getenv("HIGH_CONFIDENCE_THRESHOLD", "0.35"))  # >=35% = Eczema (was 0.60)
-        self.low_confidence_threshold = float(os.getenv("LOW_CONFIDENCE_THRESHOLD", "0.20"))    # <=20% = Normal (was 0.30)
-        self.uncertainty_band_lower = float(os.getenv("UNCERTAINTY_BAND_LOWER", "0.20"))        # 20-35% = Uncertain (was 0.30)
-        self.uncertainty_band_upper = float(os.getenv("UNCERTAINTY_BAND_UPPER", "0.35"))        # Was 0.60
+        self.thresholds = DecisionThresholds.from_env()
+        self.high_confidence_threshold = self.thresholds.high_confidence  # >=35% = Eczema (was 0.60)
+        self.low_confidence_threshold = self.thresholds.low_confidence    # <=20% = Normal (was 0.30)
+        self.uncertainty_band_lower = self.thresholds.band_lower          # 20-35% = Uncertain (was 0.30)
+        self.uncertainty_band_upper = self.thresholds.band_upper          # Was 0.60
         
         # Feature variance thresholds for OOD detection
         # RELAXED: Wider acceptable range
@@ -41,21 +81,24 @@ class UncertaintyDetector:
         
         # Minimum factors required to trigger uncertainty
         # INCREASED: Require more factors to avoid false uncertainty for eczema cases
-        self.min_uncertainty_factors = int(os.getenv("MIN_UNCERTAINTY_FACTORS", "3"))  # Was 2, now 3 to be less aggressive
+        self.min_uncertainty_factors = self.thresholds.min_uncertainty_factors  # Was 2, now 3 to be less aggressive
     
     async def evaluate_uncertainty(
         self,
         image: np.ndarray,
         eczema_probability: float,
-        prediction_result: Dict[str, Any]
+        prediction_result: Dict[str, Any],
+        features: Optional[Dict[str, float]] = None
     ) -> Tuple[bool, str, float]:
         """
         Evaluate if prediction should be routed to "Uncertain" state
         
         Args:
-            image: Preprocessed image (RGB, normalized or uint8)
+            image: Preprocessed image (RGB uint8; normalized float is converted)
             eczema_probability: Model's eczema probability (0-1)
-            prediction_result: Full prediction result dictionary
+            prediction_result: Full prediction result dictionary (with an OOD scorer set, its
+                "embedding" is scored instead of computing the CV features)
+            features: Precomputed output of extract_image_features (computed here if omitted)
         
         Returns:
             Tuple of (is_uncertain, reason, adjusted_confidence)
@@ -63,175 +106,371 @@ class UncertaintyDetector:
             - reason: Explanation for uncertainty
             - adjusted_confidence: Confidence score adjusted for uncertainty
         """
+        factors = await self.evaluate_factors(image, eczema_probability, prediction_result, features=features)
+        return self.route(factors, eczema_probability)
+    
+    async def evaluate_factors(
+        self,
+        image: np.ndarray,
+        eczema_probability: float,
+        prediction_result: Dict[str, Any],
+        features: Optional[Dict[str, float]] = None
+    ) -> UncertaintyFactors:
+        """
+        Image evidence of evaluate_uncertainty, before routing (same arguments)
+        
+        /analyze feeds its weight to decision_policy.decide and the decision log.
+        """
         try:
-            # Ensure image is in correct format
-            if image.dtype != np.uint8:
-                if image.max() <= 1.0:
-                    image_uint8 = (image * 255).astype(np.uint8)
-                else:
-                    image_uint8 = image.astype(np.uint8)
-            else:
-                image_uint8 = image
+            embedding = self._embedding_of(prediction_result)
+            if embedding is not None:
+                return UncertaintyFactors(self._embedding_factors(embedding))
             
-            # Ensure 3 channels
-            if len(image_uint8.shape) != 3 or image_uint8.shape[2] != 3:
-                if len(image_uint8.shape) == 2:
-                    image_uint8 = cv2.cvtColor(image_uint8, cv2.COLOR_GRAY2RGB)
+            if features is None:
+                if self.cv_executor is not None:
+                    features = await self.cv_executor.run("uncertainty_features", self.extract_image_features, image)
                 else:
-                    # If can't process, default to uncertain
-                    return True, "Image format not suitable for uncertainty analysis", 0.5
-            
-            # Convert RGB to BGR for OpenCV
-            bgr_image = cv2.cvtColor(image_uint8, cv2.COLOR_RGB2BGR)
-            
-            # Factor 1: Confidence Band Evaluation
-            # If confidence falls in mid-range, it's ambiguous
-            confidence_in_uncertainty_band = (
-                self.uncertainty_band_lower <= eczema_probability <= self.uncertainty_band_upper
-            )
-            
-            # Factor 2: Feature Variance Analysis
-            # OOD inputs often have abnormal texture variance
-            texture_variance = self._calculate_texture_variance(bgr_image)
-            abnormal_variance = (
-                texture_variance < self.texture_variance_threshold_low or
-                texture_variance > self.texture_variance_threshold_high
-            )
-            
-            # Factor 3: Pattern Mismatch Detection
-            # High confidence but low texture similarity suggests mismatch
-            texture_similarity = self._calculate_texture_similarity(bgr_image, eczema_probability)
-            pattern_mismatch = (
-                eczema_probability > self.high_confidence_threshold and
-                texture_similarity < self.confidence_texture_mismatch_threshold
-            )
-            
-            # Factor 4: Visual Feature Consistency
-            # Check if visual features align with confidence level
-            feature_consistency = self._check_feature_consistency(bgr_image, eczema_probability)
-            
-            # Decision Logic: Route to Uncertain only if MULTIPLE conditions are met
-            # This prevents over-aggressive uncertainty detection
-            uncertainty_factors = []
+                    features = self.extract_image_features(image)
             
-            # Factor weights (higher = more significant)
-            if confidence_in_uncertainty_band:
-                uncertainty_factors.append(("confidence falls in ambiguous range", 2))  # Weight 2 - very significant
+            if features is None:
+                # If can't process, default to uncertain
+                return UncertaintyFactors(unavailable="Image format not suitable for uncertainty analysis")
             
-            if abnormal_variance:
-                uncertainty_factors.append(("texture patterns are inconsistent", 1))  # Weight 1
-            
-            if pattern_mismatch:
-                uncertainty_factors.append(("visual patterns don't match eczema", 1))  # Weight 1
-            
-            if not feature_consistency:
-                uncertainty_factors.append(("visual features inconsistent with confidence", 1))  # Weight 1
-            
-            # Calculate total weight
-            total_weight = sum(weight for _, weight in uncertainty_factors)
-            uncertainty_reasons = [reason for reason, _ in uncertainty_factors]
-            
-            # CRITICAL: Only route to Uncertain if:
-            # 1. Confidence is truly in the ambiguous band (0.40-0.60), OR
-            # 2. Multiple other factors present (total weight >= min_uncertainty_factors)
-            # 
-            # HIGH CONFIDENCE (>= 0.60) should NOT be easily overridden
-            is_in_ambiguous_band = self.uncertainty_band_lower <= eczema_probability <= self.uncertainty_band_upper
-            has_multiple_issues = total_weight >= self.min_uncertainty_factors
-            
-            # If confidence is HIGH (>= 0.60), don't mark as uncertain unless there are severe issues
-            if eczema_probability >= self.high_confidence_threshold:
-                # High confidence - trust the model, don't mark uncertain
-                is_uncertain = False
-                reason = ""
-                adjusted_confidence = eczema_probability
-            elif eczema_probability <= self.low_confidence_threshold:
-                # Low confidence - this is "Normal", don't mark uncertain
-                is_uncertain = False
-                reason = ""
-                adjusted_confidence = eczema_probability
-            elif is_in_ambiguous_band and has_multiple_issues:
-                # Truly ambiguous: in mid-range AND has multiple issues
-                is_uncertain = True
-                reason = f"Uncertain classification: {', '.join(uncertainty_reasons)}. " + \
-                        "The image may show a different skin condition or the patterns are ambiguous."
-                adjusted_confidence = 0.5
+            return UncertaintyFactors(self._visual_factors(features, eczema_probability))
+        
+        except Exception as e:
+            print(f"Error in uncertainty evaluation: {e}")
+            # On error, default to uncertain (safe fallback)
+            return UncertaintyFactors(unavailable=f"Uncertainty analysis error: {str(e)}")
+    
+    def evaluate_uncertainty_batch(
+        self,
+        images: np.ndarray,
+        eczema_probabilities: List[float],
+        prediction_results: List[Dict[str, Any]],
+        features: Optional[List[Optional[Dict[str, float]]]] = None
+    ) -> List[Tuple[bool, str, float]]:
+        """
+        Batched evaluate_uncertainty (offline scoring); per-item results are identical
+        
+        Args:
+            images: N x H x W x 3 batch (RGB uint8; normalized float is converted per item)
+            eczema_probabilities: Model's eczema probability per image
+            prediction_results: Full prediction result dictionary per image
+            features: Precomputed output of extract_image_features_batch (computed here if omitted)
+        
+        Returns:
+            One (is_uncertain, reason, adjusted_confidence) tuple per image
+        """
+        factors = self.evaluate_factors_batch(images, eczema_probabilities, prediction_results, features=features)
+        return [
+            self.route(item_factors, eczema_probability)
+            for item_factors, eczema_probability in zip(factors, eczema_probabilities)
+        ]
+    
+    def evaluate_factors_batch(
+        self,
+        images: np.ndarray,
+        eczema_probabilities: List[float],
+        prediction_results: List[Dict[str, Any]],
+        features: Optional[List[Optional[Dict[str, float]]]] = None
+    ) -> List[UncertaintyFactors]:
+        """Batched evaluate_factors (same arguments as evaluate_uncertainty_batch)"""
+        embeddings = [self._embedding_of(result) for result in prediction_results]
+        if features is None:
+            if all(embedding is not None for embedding in embeddings):
+                features = [None] * len(embeddings)
+            else:
+                features = self.extract_image_features_batch(images)
+        
+        results = []
+        for item_features, embedding, eczema_probability in zip(features, embeddings, eczema_probabilities):
+            if embedding is None and item_features is None:
+                results.append(UncertaintyFactors(unavailable="Image format not suitable for uncertainty analysis"))
+                continue
+            try:
+                if embedding is not None:
+                    results.append(UncertaintyFactors(self._embedding_factors(embedding)))
+                else:
+                    results.append(UncertaintyFactors(self._visual_factors(item_features, eczema_probability)))
+            except Exception as e:
+                print(f"Error in uncertainty evaluation: {e}")
+                results.append(UncertaintyFactors(unavailable=f"Uncertainty analysis error: {str(e)}"))
+        return results
+    
+    @property
+    def uses_embedding(self) -> bool:
+        """Whether the CV feature stage can be skipped (embedding OOD scoring is active)"""
+        return self.ood_scorer is not None
+    
+    def _embedding_of(self, prediction_result: Dict[str, Any]) -> Optional[np.ndarray]:
+        if self.ood_scorer is None or not prediction_result:
+            return None
+        return prediction_result.get("embedding")
+    
+    def _visual_factors(self, features: Dict[str, float], eczema_probability: float) -> List[Tuple[str, int]]:
+        """
+        Uncertainty factors raised by the image features and model probability
+        (shared by the single and batch paths)
+        
+        Returns:
+            (reason, weight) pairs
+        """
+        # Factor 2: Feature Variance Analysis
+        # OOD inputs often have abnormal texture variance
+        texture_variance = features["texture_variance"]
+        abnormal_variance = (
+            texture_variance < self.texture_variance_threshold_low or
+            texture_variance > self.texture_variance_threshold_high
+        )
+        
+        # Factor 3: Pattern Mismatch Detection
+        # High confidence but low texture similarity suggests mismatch
+        texture_similarity = self._calculate_texture_similarity(features, eczema_probability)
+        pattern_mismatch = (
+            eczema_probability > self.high_confidence_threshold and
+            texture_similarity < self.confidence_texture_mismatch_threshold
+        )
+        
+        # Factor 4: Visual Feature Consistency
+        # Check if visual features align with confidence level
+        feature_consistency = self._check_feature_consistency(features, eczema_probability)
+        
+        # Factor weights (higher = more significant)
+        visual_factors = []
+        if abnormal_variance:
+            visual_factors.append(("texture patterns are inconsistent", 1))  # Weight 1
+        
+        if pattern_mismatch:
+            visual_factors.append(("visual patterns don't match eczema", 1))  # Weight 1
+        
+        if not feature_consistency:
+            visual_factors.append(("visual features inconsistent with confidence", 1))  # Weight 1
+        
+        return visual_factors
+    
+    def _embedding_factors(self, embedding: np.ndarray) -> List[Tuple[str, int]]:
+        """
+        Uncertainty factor of the embedding OOD score, in place of the CV heuristics
+        
+        Returns:
+            (reason, weight) pairs
+        """
+        ood_score = self.ood_scorer.score(embedding)
+        print(f"   OOD Score: {ood_score:.3f} (threshold {self.ood_scorer.threshold:.3f})")
+        
+        # One factor replaces texture / pattern / consistency (same weight as each of them)
+        visual_factors = []
+        if self.ood_scorer.is_out_of_distribution(ood_score):
+            visual_factors.append(("image is unlike the images the model was trained on", 1))
+        
+        return visual_factors
+    
+    def route(self, factors: UncertaintyFactors, eczema_probability: float) -> Tuple[bool, str, float]:
+        """
+        Combine the confidence band with the image factors into the final routing
+        
+        Args:
+            factors: Image evidence from evaluate_factors
+            eczema_probability: Model's eczema probability (0-1)
+        
+        Returns:
+            Tuple of (is_uncertain, reason, adjusted_confidence)
+        """
+        if factors.unavailable is not None:
+            return True, factors.unavailable, 0.5
+        visual_factors = factors.visual
+        
+        # Factor 1: Confidence Band Evaluation
+        # If confidence falls in mid-range, it's ambiguous
+        confidence_in_uncertainty_band = (
+            self.uncertainty_band_lower <= eczema_probability <= self.uncertainty_band_upper
+        )
+        
+        # Decision Logic: Route to Uncertain only if MULTIPLE conditions are met
+        # This prevents over-aggressive uncertainty detection
+        uncertainty_factors = []
+        
+        # Factor weights (higher = more significant)
+        if confidence_in_uncertainty_band:
+            uncertainty_factors.append(("confidence falls in ambiguous range", 2))  # Weight 2 - very significant
+        uncertainty_factors.extend(visual_factors)
+        
+        # Calculate total weight
+        total_weight = sum(weight for _, weight in uncertainty_factors)
+        uncertainty_reasons = [reason for reason, _ in uncertainty_factors]
+        
+        # CRITICAL: Only route to Uncertain if the confidence is in the ambiguous band
+        # AND the total factor weight reaches min_uncertainty_factors; confidences at or
+        # beyond the high / low thresholds are never overridden (decision_policy.decide)
+        is_in_ambiguous_band = confidence_in_uncertainty_band
+        decision = decide(eczema_probability, factors.weight, gemini_skipped=True, thresholds=self.thresholds)
+        is_uncertain = decision.reason == "uncertainty_factors"
+        if is_uncertain:
+            # Truly ambiguous: in mid-range AND has multiple issues
+            reason = f"Uncertain classification: {', '.join(uncertainty_reasons)}. " + \
+                    "The image may show a different skin condition or the patterns are ambiguous."
+            adjusted_confidence = 0.5
+        else:
+            # Not enough evidence for uncertainty - trust the model
+            reason = ""
+            adjusted_confidence = eczema_probability
+        
+        # Log uncertainty evaluation
+        print(f"\n📊 Uncertainty Evaluation:")
+        print(f"   Eczema Probability: {eczema_probability:.4f}")
+        print(f"   In Ambiguous Band (0.40-0.60): {is_in_ambiguous_band}")
+        print(f"   Uncertainty Factors: {len(uncertainty_factors)} (weight: {total_weight})")
+        print(f"   Factors: {uncertainty_reasons if uncertainty_reasons else 'None'}")
+        print(f"   Is Uncertain: {is_uncertain}")
+        print(f"   Adjusted Confidence: {adjusted_confidence:.4f}\n")
+        
+        return is_uncertain, reason, adjusted_confidence
+    
+    def extract_image_features(self, image: np.ndarray) -> Optional[Dict[str, float]]:
+        """
+        Compute the image-only inputs of the uncertainty factors
+        Independent of the model output, so it can run concurrently with inference
+        
+        Returns:
+            Dictionary with texture_variance, edge_density and redness_ratio,
+            or None if the image format is not suitable for analysis
+        """
+        # Ensure image is in correct format
+        if image.dtype != np.uint8:
+            if image.max() <= 1.0:
+                image_uint8 = (image * 255).astype(np.uint8)
+            else:
+                image_uint8 = image.astype(np.uint8)
+        else:
+            image_uint8 = image
+        
+        # Ensure 3 channels
+        if len(image_uint8.shape) != 3 or image_uint8.shape[2] != 3:
+            if len(image_uint8.shape) == 2:
+                image_uint8 = cv2.cvtColor(image_uint8, cv2.COLOR_GRAY2RGB)
             else:
-                # Not enough evidence for uncertainty - trust the model
-                is_uncertain = False
-                reason = ""
-                adjusted_confidence = eczema_probability
+                return None
+        
+        with self.plane_pool.checkout(image_uint8.shape[0], image_uint8.shape[1]) as arena:
+            # Convert RGB to BGR for OpenCV; gray is shared by the texture and edge factors
+            bgr_image = cv2.cvtColor(image_uint8, cv2.COLOR_RGB2BGR, dst=arena.bgr)
+            gray = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY, dst=arena.gray)
             
-            # Log uncertainty evaluation
-            print(f"\n📊 Uncertainty Evaluation:")
-            print(f"   Eczema Probability: {eczema_probability:.4f}")
-            print(f"   In Ambiguous Band (0.40-0.60): {is_in_ambiguous_band}")
-            print(f"   Uncertainty Factors: {len(uncertainty_factors)} (weight: {total_weight})")
-            print(f"   Factors: {uncertainty_reasons if uncertainty_reasons else 'None'}")
-            print(f"   Is Uncertain: {is_uncertain}")
-            print(f"   Adjusted Confidence: {adjusted_confidence:.4f}\n")
+            return {
+                "texture_variance": self._calculate_texture_variance(gray, arena),
+                "edge_density": self._calculate_edge_density(gray, arena),
+                "redness_ratio": self._calculate_redness_ratio(bgr_image, arena),
+            }
+    
+    def extract_image_features_batch(self, images: np.ndarray) -> List[Optional[Dict[str, float]]]:
+        """
+        Batched extract_image_features: color conversions and red masks run once over the
+        stacked batch, LBP variance and mask counts are reductions over the batch axis
+        
+        Args:
+            images: N x H x W x 3 batch (RGB uint8; normalized float is converted per item)
+        
+        Returns:
+            One feature dictionary per image (same values as extract_image_features)
+        """
+        images = as_uint8_batch(images)
+        if images.ndim != 4 or images.shape[3] != 3:
+            return [self.extract_image_features(image) for image in images]
+        
+        try:
+            n, h, w = images.shape[:3]
+            total_pixels = h * w
+            with self.plane_pool.checkout(n * h, w) as arena:
+                bgr_image = cv2.cvtColor(stacked(images), cv2.COLOR_RGB2BGR, dst=arena.bgr)
+                gray = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY, dst=arena.gray).reshape(n, h, w)
+                
+                lbp = local_binary_pattern_batch(gray, out=arena.lbp.reshape(n, h, w))
+                texture_variance = variance_batch(lbp)
+                
+                # Canny looks at neighbouring rows, so it runs per image to stay within image borders
+                edges = arena.edges.reshape(n, h, w)
+                for i in range(n):
+                    cv2.Canny(gray[i], 50, 150, edges=edges[i])
+                edge_density = count_nonzero_batch(edges) / total_pixels
+                
+                hsv = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV, dst=arena.hsv)
+                mask1 = cv2.inRange(hsv, self.lower_red1, self.upper_red1, dst=arena.mask)
+                mask2 = cv2.inRange(hsv, self.lower_red2, self.upper_red2, dst=arena.mask_alt)
+                red_mask = cv2.bitwise_or(mask1, mask2, dst=mask1)
+                redness_ratio = count_nonzero_batch(red_mask.reshape(n, h, w)) / total_pixels
             
-            return is_uncertain, reason, adjusted_confidence
+            return [
+                {
+                    "texture_variance": float(texture_variance[i]),
+                    "edge_density": float(edge_density[i]),
+                    "redness_ratio": float(redness_ratio[i]),
+                }
+                for i in range(n)
+            ]
         
         except Exception as e:
-            print(f"Error in uncertainty evaluation: {e}")
-            # On error, default to uncertain (safe fallback)
-            return True, f"Uncertainty analysis error: {str(e)}", 0.5
+            print(f"Error extracting batched uncertainty features, computing per image: {e}")
+            return [self.extract_image_features(image) for image in images]
     
-    def _calculate_texture_variance(self, bgr_image: np.ndarray) -> float:
+    def _calculate_texture_variance(self, gray: np.ndarray, arena) -> float:
         """
         Calculate texture variance to detect OOD patterns
         Returns variance value
         """
         try:
-            gray = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
-            if gray.dtype != np.uint8:
-                if gray.max() <= 1.0:
-                    gray = (gray * 255).astype(np.uint8)
-                else:
-                    gray = gray.astype(np.uint8)
-            
             # Calculate Local Binary Pattern variance
-            lbp = self._local_binary_pattern(gray)
-            variance = np.var(lbp)
-            return float(variance)
+            lbp = self._local_binary_pattern(gray, out=arena.lbp)
+            _, std_dev = cv2.meanStdDev(lbp)
+            return float(std_dev[0, 0]) ** 2
         
         except Exception as e:
             print(f"Error calculating texture variance: {e}")
             return 500.0  # Default moderate variance
     
-    def _calculate_texture_similarity(self, bgr_image: np.ndarray, confidence: float) -> float:
+    def _calculate_edge_density(self, gray: np.ndarray, arena) -> float:
+        """
+        Calculate Canny edge density (fraction of edge pixels)
+        """
+        try:
+            edges = cv2.Canny(gray, 50, 150, edges=arena.edges)
+            return float(cv2.countNonZero(edges) / (gray.shape[0] * gray.shape[1]))
+        
+        except Exception as e:
+            print(f"Error calculating edge density: {e}")
+            return 0.15  # Default: expected eczema edge density
+    
+    def _calculate_redness_ratio(self, bgr_image: np.ndarray, arena) -> float:
+        """
+        Calculate fraction of pixels in the red HSV ranges
+        """
+        try:
+            hsv = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV, dst=arena.hsv)
+            mask1 = cv2.inRange(hsv, self.lower_red1, self.upper_red1, dst=arena.mask)
+            mask2 = cv2.inRange(hsv, self.lower_red2, self.upper_red2, dst=arena.mask_alt)
+            red_mask = cv2.bitwise_or(mask1, mask2, dst=mask1)
+            return float(cv2.countNonZero(red_mask) / (bgr_image.shape[0] * bgr_image.shape[1]))
+        
+        except Exception as e:
+            print(f"Error calculating redness ratio: {e}")
+            return 0.1  # Default low redness
+    
+    def _calculate_texture_similarity(self, features: Dict[str, float], confidence: float) -> float:
         """
         Calculate how well texture patterns match expected eczema characteristics
         Returns similarity score (0-1)
         """
         try:
-            gray = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
-            if gray.dtype != np.uint8:
-                if gray.max() <= 1.0:
-                    gray = (gray * 255).astype(np.uint8)
-                else:
-                    gray = gray.astype(np.uint8)
-            
-            # Calculate edge density (eczema typically has moderate edge density)
-            edges = cv2.Canny(gray, 50, 150)
-            edge_density = np.sum(edges > 0) / (gray.shape[0] * gray.shape[1])
+            # Edge density (eczema typically has moderate edge density)
+            edge_density = features["edge_density"]
             
             # Expected edge density for eczema (moderate)
             expected_edge_density = 0.15
             edge_similarity = 1.0 - abs(edge_density - expected_edge_density) / 0.3
             edge_similarity = max(0.0, min(1.0, edge_similarity))
             
-            # Calculate redness (eczema often shows redness)
-            hsv = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV)
-            lower_red1 = np.array([0, 50, 50])
-            upper_red1 = np.array([10, 255, 255])
-            lower_red2 = np.array([170, 50, 50])
-            upper_red2 = np.array([180, 255, 255])
-            mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
-            mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-            red_mask = cv2.bitwise_or(mask1, mask2)
-            redness_ratio = np.sum(red_mask > 0) / (bgr_image.shape[0] * bgr_image.shape[1])
+            # Redness (eczema often shows redness)
+            redness_ratio = features["redness_ratio"]
             
             # If confidence is high but redness is low, similarity is low
             if confidence > 0.7 and redness_ratio < 0.1:
@@ -247,7 +486,7 @@ class UncertaintyDetector:
             print(f"Error calculating texture similarity: {e}")
             return 0.5  # Default moderate similarity
     
-    def _check_feature_consistency(self, bgr_image: np.ndarray, confidence: float) -> bool:
+    def _check_feature_consistency(self, features: Dict[str, float], confidence: float) -> bool:
         """
         Check if visual features are consistent with confidence level
         Returns True if consistent, False if inconsistent
@@ -255,27 +494,8 @@ class UncertaintyDetector:
         try:
             # High confidence should align with strong visual indicators
             # Low confidence should align with weak visual indicators
-            
-            gray = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
-            if gray.dtype != np.uint8:
-                if gray.max() <= 1.0:
-                    gray = (gray * 255).astype(np.uint8)
-                else:
-                    gray = gray.astype(np.uint8)
-            
-            # Calculate visual feature strength
-            edges = cv2.Canny(gray, 50, 150)
-            edge_strength = np.sum(edges > 0) / (gray.shape[0] * gray.shape[1])
-            
-            hsv = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV)
-            lower_red1 = np.array([0, 50, 50])
-            upper_red1 = np.array([10, 255, 255])
-            lower_red2 = np.array([170, 50, 50])
-            upper_red2 = np.array([180, 255, 255])
-            mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
-            mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-            red_mask = cv2.bitwise_or(mask1, mask2)
-            redness_strength = np.sum(red_mask > 0) / (bgr_image.shape[0] * bgr_image.shape[1])
+            edge_strength = features["edge_density"]
+            redness_strength = features["redness_ratio"]
             
             visual_strength = (edge_strength * 0.5) + (redness_strength * 2.0)
             visual_strength = min(visual_strength, 1.0)
@@ -294,13 +514,24 @@ class UncertaintyDetector:
             print(f"Error checking feature consistency: {e}")
             return True  # Default to consistent on error
     
-    def _local_binary_pattern(self, image: np.ndarray, radius: int = 1, n_points: int = 8) -> np.ndarray:
+    def _local_binary_pattern(
+        self,
+        image: np.ndarray,
+        radius: int = 1,
+        n_points: int = 8,
+        out: Optional[np.ndarray] = None
+    ) -> np.ndarray:
         """
         Compute Local Binary Pattern for texture analysis
+        Written into out (e.g. an arena plane) when given
         """
         try:
             h, w = image.shape
-            lbp = np.zeros_like(image)
+            if out is None:
+                lbp = np.zeros_like(image)
+            else:
+                lbp = out
+                lbp.fill(0)
             
             for i in range(radius, h - radius):
                 for j in range(radius, w - radius):
@@ -0,0 +1,73 @@
+"""
+Batch Features - Vectorized NHWC helpers for the heuristic detectors
+Per-pixel OpenCV conversions run once on the batch viewed as one tall image
+(N*H x W); LBP codes, mask counts and plane variances are NumPy reductions
+over the batch axis that reproduce the single-image results exactly
+"""
+
+import numpy as np
+
+# Neighbour offsets (dy, dx) in the bit order of the detectors' _local_binary_pattern
+LBP_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1))
+
+
+def as_uint8_batch(images: np.ndarray) -> np.ndarray:
+    """
+    Convert a batch to contiguous uint8 with the single-image rule applied per item
+    (float images with max <= 1.0 are scaled by 255, anything else is cast)
+    """
+    if images.ndim == 3:
+        images = images[np.newaxis]
+    if images.dtype != np.uint8:
+        images = np.stack([
+            (image * 255).astype(np.uint8) if image.max() <= 1.0 else image.astype(np.uint8)
+            for image in images
+        ])
+    return np.ascontiguousarray(images)
+
+
+def stacked(images: np.ndarray) -> np.ndarray:
+    """View an N x H x W (x C) batch as one (N*H) x W (x C) image for per-pixel OpenCV calls"""
+    return images.reshape((images.shape[0] * images.shape[1],) + images.shape[2:])
+
+
+def count_nonzero_batch(planes: np.ndarray) -> np.ndarray:
+    """Non-zero pixels per item of an N x H x W batch (cv2.countNonZero per item)"""
+    return np.count_nonzero(planes.reshape(planes.shape[0], -1), axis=1)
+
+
+def variance_batch(planes: np.ndarray) -> np.ndarray:
+    """
+    Per-item variance of an N x H x W uint8 batch, bit-identical to
+    float(cv2.meanStdDev(plane)[1]) ** 2 (same integer sums and double arithmetic)
+    """
+    flat = planes.reshape(planes.shape[0], -1).astype(np.int64)
+    sums = flat.sum(axis=1)
+    np.square(flat, out=flat)
+    square_sums = flat.sum(axis=1)
+
+    scale = 1.0 / planes[0].size
+    means = sums * scale
+    std_devs = np.sqrt(np.maximum(square_sums * scale - means * means, 0.0))
+    return std_devs ** 2
+
+
+def local_binary_pattern_batch(gray: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """
+    8-neighbour LBP codes for an N x H x W uint8 batch, written into out
+
+    Same codes as the per-pixel loop: bit k is set when neighbour k >= centre,
+    and the one-pixel border stays 0.
+    """
+    n, h, w = gray.shape
+    out.fill(0)
+    center = gray[:, 1:h - 1, 1:w - 1]
+    codes = out[:, 1:h - 1, 1:w - 1]
+    neighbor_ge = np.empty(center.shape, dtype=bool)
+
+    for bit, (dy, dx) in enumerate(LBP_OFFSETS):
+        neighbor = gray[:, 1 + dy:h - 1 + dy, 1 + dx:w - 1 + dx]
+        np.greater_equal(neighbor, center, out=neighbor_ge)
+        codes |= neighbor_ge.view(np.uint8) << bit
+
+    return out
@@ -0,0 +1,131 @@
+"""
+Buffer Pool - Reusable NumPy arenas for the CV heuristic stages
+Each heuristic stage used to allocate a fresh BGR copy, HSV image, gray plane and
+several masks per request; the detectors now write into a checked-out arena instead
+(OpenCV dst= outputs) and hand it back afterwards
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Tuple
+
+import numpy as np
+
+
+class PlaneArena:
+    """
+    One set of preallocated image planes for a single image size
+    
+    Attributes:
+        bgr, hsv: 3-channel uint8 planes (H x W x 3)
+        gray, mask, mask_alt, mask_extra, edges, lbp: single-channel uint8 planes (H x W)
+    
+    Every plane is fully overwritten by the stage that uses it, so arenas are
+    handed out without clearing.
+    """
+    
+    COLOR_PLANES = ("bgr", "hsv")
+    GRAY_PLANES = ("gray", "mask", "mask_alt", "mask_extra", "edges", "lbp")
+    
+    def __init__(self, height: int, width: int):
+        self.shape = (height, width)
+        for name in self.COLOR_PLANES:
+            setattr(self, name, np.empty((height, width, 3), dtype=np.uint8))
+        for name in self.GRAY_PLANES:
+            setattr(self, name, np.empty((height, width), dtype=np.uint8))
+    
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.COLOR_PLANES + self.GRAY_PLANES)
+
+
+class PlanePool:
+    """
+    Thread-safe pool of PlaneArena objects, keyed by image size
+    
+    Configuration (environment):
+    - BUFFER_POOL_SIZE: Arenas kept per image size (default 8; 0 disables reuse)
+    - BUFFER_POOL_MAX_BYTES: Total bytes of idle arenas kept over all sizes (default 128 MiB)
+    
+    Pipeline stages run concurrently on worker threads, so each stage checks out
+    its own arena. When the pool is empty a new arena is allocated (a miss); on
+    return it is kept only while the pool is below capacity. Batched stages check
+    out (n * h, w) arenas, so sizes vary with the batch size: over the byte limit,
+    the idle arenas of the least recently used sizes are dropped first.
+    """
+    
+    def __init__(self, capacity: int = None, max_bytes: int = None):
+        self.capacity = capacity if capacity is not None else int(os.getenv("BUFFER_POOL_SIZE", "8"))
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("BUFFER_POOL_MAX_BYTES", str(128 * 1024 * 1024)))
+        # Idle arenas by image size, least recently used size first
+        self._free: "OrderedDict[Tuple[int, int], List[PlaneArena]]" = OrderedDict()
+        self._idle_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "in_use": 0, "evicted": 0}
+    
+    @contextmanager
+    def checkout(self, height: int, width: int):
+        """
+        Borrow an arena for one image for the duration of a with-block
+        
+        Args:
+            height, width: Image size the planes must match
+        
+        Yields:
+            PlaneArena
+        """
+        arena = self.acquire(height, width)
+        try:
+            yield arena
+        finally:
+            self.release(arena)
+    
+    def acquire(self, height: int, width: int) -> PlaneArena:
+        shape = (height, width)
+        with self._lock:
+            self.stats["in_use"] += 1
+            free = self._free.get(shape)
+            if free:
+                self.stats["hits"] += 1
+                arena = free.pop()
+                self._idle_bytes -= arena.nbytes
+                if free:
+                    self._free.move_to_end(shape)
+                else:
+                    del self._free[shape]
+                return arena
+            self.stats["misses"] += 1
+        return PlaneArena(height, width)
+    
+    def release(self, arena: PlaneArena):
+        with self._lock:
+            self.stats["in_use"] -= 1
+            free = self._free.get(arena.shape, [])
+            if len(free) >= self.capacity or arena.nbytes > self.max_bytes:
+                return
+            free.append(arena)
+            self._free[arena.shape] = free
+            self._free.move_to_end(arena.shape)
+            self._idle_bytes += arena.nbytes
+            self._evict()
+    
+    def _evict(self):
+        """Drop idle arenas of the least recently used sizes until under max_bytes (lock held)"""
+        while self._idle_bytes > self.max_bytes:
+            shape, free = next(iter(self._free.items()))
+            self._idle_bytes -= free.pop(0).nbytes
+            self.stats["evicted"] += 1
+            if not free:
+                del self._free[shape]
+    
+    def snapshot(self) -> dict:
+        """Pool counters plus the number and size of idle arenas (for /health and benchmarks)"""
+        with self._lock:
+            return {
+                **self.stats,
+                "idle": sum(len(arenas) for arenas in self._free.values()),
+                "idle_bytes": self._idle_bytes,
+                "sizes": len(self._free),
+            }
@@ -0,0 +1,116 @@
+"""
+Decoded Upload - Single parse of an uploaded image
+Carries everything later stages need (format, MIME type, dimensions, EXIF orientation,
+content hash, canonical uint8 pixels) so the upload bytes are decoded exactly once per request
+"""
+
+import hashlib
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+PIL_FORMAT_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+    "BMP": "image/bmp",
+    "TIFF": "image/tiff",
+}
+
+
+class DecodedUpload:
+    """
+    Result of decoding one upload (built by ImageProcessor.decode_upload)
+    
+    Attributes:
+        data: Original upload bytes
+        format: PIL format name ("JPEG", "PNG", ...)
+        mime_type: MIME type derived from the decoded format
+        width, height: Original pixel dimensions
+        exif_orientation: EXIF orientation tag (1 = upright)
+        has_metadata: Whether the upload carries EXIF/ICC/XMP metadata
+        sha256: Hex digest of the upload bytes
+        pixels: Canonical resized image (target_size x target_size x 3, uint8 RGB) shared
+            by every stage; normalization to float happens only at the model boundary
+    
+    The decoded full-resolution image is kept only until the Gemini re-encode has been
+    produced (gemini_payload), or until the caller knows none will be, then released
+    together with its pixel budget lease.
+    """
+    
+    def __init__(
+        self,
+        data: bytes,
+        image_format: Optional[str],
+        width: int,
+        height: int,
+        exif_orientation: int,
+        has_metadata: bool,
+        pixels: np.ndarray,
+        image: Optional[Image.Image] = None
+    ):
+        self.data = data
+        self.format = image_format
+        self.mime_type = PIL_FORMAT_MIME_TYPES.get(image_format or "", "image/jpeg")
+        self.width = width
+        self.height = height
+        self.exif_orientation = exif_orientation
+        self.has_metadata = has_metadata
+        self.sha256 = hashlib.sha256(data).hexdigest()
+        self.pixels = pixels
+        
+        self._image = image
+        self._gemini_payload: Optional[Tuple[bytes, str]] = None
+        self._lock = threading.Lock()
+        # PixelLease of ImageProcessor.decode_upload (None for synchronous decodes)
+        self._lease = None
+    
+    @property
+    def byte_size(self) -> int:
+        return len(self.data)
+    
+    @property
+    def image(self) -> Optional[Image.Image]:
+        """Decoded full-resolution RGB image (None once released)"""
+        return self._image
+    
+    def gemini_payload(self, encoder) -> Tuple[bytes, str]:
+        """
+        Lazily produce (bytes, mime_type) for the Gemini vision API
+        
+        Computed once per upload even if the speculative and regular Gemini paths
+        both ask for it. CPU-bound: call off the event loop.
+        """
+        with self._lock:
+            if self._gemini_payload is None:
+                self._gemini_payload = encoder.encode_upload(self)
+                self._release()
+            return self._gemini_payload
+    
+    def hold(self, lease):
+        """Keep a pixel budget lease until the full-resolution image is released"""
+        self._lease = lease
+    
+    def release_image(self):
+        """
+        Drop the full-resolution decode (pixels and metadata stay available)
+        
+        Never blocks: while a re-encode is running (e.g. an abandoned speculative
+        call's), the image stays in use and gemini_payload releases it when done.
+        """
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._release()
+        finally:
+            self._lock.release()
+    
+    def _release(self):
+        self._image = None
+        if self._lease is not None:
+            self._lease.release()
+            self._lease = None
@@ -2,17 +2,142 @@
 Image Processor - Handles image preprocessing for model input
 """
 
+import asyncio
 import numpy as np
 from PIL import Image
 import io
+import math
+import os
 import cv2
+from typing import Optional, Tuple
+
+from app.utils.decoded_upload import DecodedUpload
+from app.utils.pixel_budget import PixelBudget
+
+
+# EXIF tag id for Orientation
+EXIF_ORIENTATION_TAG = 274
+
+# Read uploads in 64KB chunks; try to parse the header while the first 512KB arrive
+# (JPEG dimensions follow the EXIF block, which can be up to 64KB)
+UPLOAD_CHUNK_SIZE = 64 * 1024
+HEADER_PROBE_LIMIT = 512 * 1024
+
+# JPEG DCT scaling factors PIL's draft mode can decode at
+JPEG_DRAFT_SCALES = (8, 4, 2)
+
+
+class UploadRejected(Exception):
+    """Upload failed a size/dimension limit before being decoded"""
+    
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
 
 
 class ImageProcessor:
     """Processes images for model input"""
     
-    def __init__(self, target_size: int = 224):
-        self.target_size = target_size
+    def __init__(self, target_size: Optional[int] = None):
+        # Should match the model's input size (main passes ModelService.input_size)
+        self.target_size = target_size or int(os.getenv("MODEL_INPUT_SIZE", 224))
+        
+        # Upload limits (configurable via environment)
+        self.max_file_size = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))  # 10MB
+        self.min_dimension = int(os.getenv("MIN_IMAGE_DIMENSION", "50"))
+        self.max_dimension = int(os.getenv("MAX_IMAGE_DIMENSION", "10000"))
+        # Decompression-bomb guard: total pixels (50MP ~ 150MB of decoded RGB)
+        self.max_pixels = int(os.getenv("MAX_IMAGE_PIXELS", "50000000"))
+        
+        # Decoded pixels held at once by decode_upload callers (0 = unlimited; 100MP ~ 300MB of RGB).
+        # A JPEG still waiting after DECODE_BUDGET_WAIT_SECONDS is decoded at a reduced
+        # DCT scale (longest edge >= DECODE_DOWNSCALE_EDGE) instead; other formats keep waiting
+        self.pixel_budget = PixelBudget(int(os.getenv("DECODE_PIXEL_BUDGET", "100000000")))
+        self.budget_wait = float(os.getenv("DECODE_BUDGET_WAIT_SECONDS", "5"))
+        self.downscale_edge = int(os.getenv("DECODE_DOWNSCALE_EDGE", "2048"))
+    
+    async def read_upload(self, file) -> bytes:
+        """
+        Copy an upload into memory in chunks, enforcing limits as it is copied
+        
+        The request body has already been received and spooled by Starlette at this
+        point; the UploadSizeLimit middleware caps it while it arrives. Here the byte
+        limit applies to the file part itself, and the image header (format and
+        dimensions) is parsed from the first chunks, so oversized or bomb-like images
+        are rejected before anything is decoded.
+        
+        Args:
+            file: FastAPI UploadFile (anything with an async read(size) method)
+        
+        Returns:
+            Upload bytes
+        
+        Raises:
+            UploadRejected: 413 for byte/pixel limits, 400 for invalid dimensions
+        """
+        buffer = bytearray()
+        header_checked = False
+        
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            
+            buffer.extend(chunk)
+            if len(buffer) > self.max_file_size:
+                raise UploadRejected(413, f"Image file is too large. Maximum size is {self._format_bytes(self.max_file_size)}.")
+            
+            if not header_checked and len(buffer) <= HEADER_PROBE_LIMIT:
+                header = self.probe_header(buffer)
+                if header is not None:
+                    header_checked = True
+                    self._check_header(*header)
+        
+        return bytes(buffer)
+    
+    def probe_header(self, header_bytes) -> Optional[Tuple[str, int, int]]:
+        """
+        Parse only the image header (no pixel decode)
+        
+        Returns:
+            Tuple of (format, width, height), or None if the header is incomplete/unknown
+        """
+        try:
+            # Image.open is lazy: it reads the header and stops before pixel data
+            with Image.open(io.BytesIO(header_bytes)) as image:
+                width, height = image.size
+                return image.format, width, height
+        except Exception:
+            return None
+    
+    def validate_dimensions(self, width: int, height: int) -> Tuple[bool, str]:
+        """
+        Check dimension and pixel-count limits
+        
+        Returns:
+            Tuple of (is_valid, error_message)
+        """
+        if width < self.min_dimension or height < self.min_dimension:
+            return False, f"Image dimensions are too small. Minimum size is {self.min_dimension}x{self.min_dimension} pixels."
+        
+        if width > self.max_dimension or height > self.max_dimension:
+            return False, f"Image dimensions are too large. Maximum size is {self.max_dimension}x{self.max_dimension} pixels."
+        
+        if width * height > self.max_pixels:
+            return False, f"Image has too many pixels ({width}x{height}). Maximum is {self.max_pixels / 1_000_000:.0f} megapixels."
+        
+        return True, "Image is valid"
+    
+    def _check_header(self, image_format: str, width: int, height: int):
+        is_valid, message = self.validate_dimensions(width, height)
+        if not is_valid:
+            status_code = 413 if width * height > self.max_pixels else 400
+            raise UploadRejected(status_code, message)
+    
+    @staticmethod
+    def _format_bytes(size: int) -> str:
+        return f"{size / (1024 * 1024):.0f}MB"
     
     async def process_image(self, image_bytes: bytes) -> np.ndarray:
         """
@@ -22,57 +147,147 @@ class ImageProcessor:
             image_bytes: Raw image bytes
         
         Returns:
-            Preprocessed numpy array (224x224x3, normalized 0-1)
+            Preprocessed numpy array (224x224x3, uint8 RGB; the model normalizes on input)
+        """
+        upload = await self.decode_upload(image_bytes)
+        if upload is None:
+            return None
+        try:
+            return upload.pixels
+        finally:
+            # Only the model-size pixels are kept: return the decode's lease right away
+            upload.release_image()
+    
+    async def decode_upload(self, image_bytes: bytes) -> DecodedUpload:
+        """
+        Decode an upload once and collect everything later stages need
+        
+        The decode leases its header pixel count from the pixel budget; the lease is
+        held until the upload's full-resolution image is released (release_image).
+        The decode itself runs on a worker thread, so large images neither block the
+        event loop nor keep other leased decodes from overlapping.
+        
+        Args:
+            image_bytes: Raw image bytes
+        
+        Returns:
+            DecodedUpload (metadata + canonical uint8 pixels), or None if the bytes are not a valid image
+        
+        Raises:
+            UploadRejected: If the header shows dimensions outside the configured limits
+        """
+        header = self.probe_header(image_bytes)
+        if header is None or not self.pixel_budget.enabled:
+            return await asyncio.to_thread(self.decode_upload_sync, image_bytes)
+        
+        image_format, width, height = header
+        self._check_header(image_format, width, height)
+        draft_edge = None
+        lease = await self.pixel_budget.acquire(
+            width * height,
+            timeout=self.budget_wait if image_format == "JPEG" else None
+        )
+        if lease is None:
+            # Budget still taken: decode the JPEG at a reduced scale rather than keep waiting
+            draft_edge = self.downscale_edge
+            lease = await self.pixel_budget.acquire(self._draft_pixels(width, height, draft_edge))
+            self.pixel_budget.stats["downscaled"] += 1
+        
+        decode = asyncio.ensure_future(asyncio.to_thread(self.decode_upload_sync, image_bytes, draft_edge=draft_edge))
+        try:
+            upload = await asyncio.shield(decode)
+        except asyncio.CancelledError:
+            # The thread keeps decoding: its pixels stay leased until it finishes
+            def release_when_decoded(task):
+                lease.release()
+                if not task.cancelled():
+                    task.exception()  # Mark retrieved: nobody awaits the abandoned decode
+            decode.add_done_callback(release_when_decoded)
+            raise
+        except BaseException:
+            lease.release()
+            raise
+        if upload is None:
+            lease.release()
+            return None
+        upload.hold(lease)
+        return upload
+    
+    @staticmethod
+    def _draft_size(width: int, height: int, edge: int) -> Tuple[int, int]:
+        """Draft request keeping the aspect ratio with the longest edge at `edge`"""
+        scale = edge / max(width, height)
+        return max(1, math.ceil(width * scale)), max(1, math.ceil(height * scale))
+    
+    @classmethod
+    def _draft_pixels(cls, width: int, height: int, edge: int) -> int:
+        """Pixels of a JPEG draft decode: the largest DCT reduction still covering the draft size"""
+        draft_width, draft_height = cls._draft_size(width, height, edge)
+        for scale in JPEG_DRAFT_SCALES:
+            if -(-width // scale) >= draft_width and -(-height // scale) >= draft_height:
+                return -(-width // scale) * -(-height // scale)
+        return width * height
+    
+    def decode_upload_sync(self, image_bytes: bytes, draft_edge: Optional[int] = None) -> DecodedUpload:
+        """
+        Synchronous decode (used by offline scoring on worker threads; PIL releases the GIL)
+        
+        Args:
+            image_bytes: Raw image bytes
+            draft_edge: Decode JPEGs at a reduced DCT scale keeping the longest edge >= this
+                (width and height still report the original dimensions)
         """
         try:
-            # Load image from bytes
+            # Load image from bytes (header only until pixels are accessed)
             image = Image.open(io.BytesIO(image_bytes))
+            image_format = image.format
+            width, height = image.size
+            
+            # Enforce limits before the full decode (also covers headers read_upload could not probe)
+            self._check_header(image_format, width, height)
+            if draft_edge is not None and image_format == "JPEG":
+                image.draft("RGB", self._draft_size(width, height, draft_edge))
+            exif_orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+            has_metadata = any(key in image.info for key in ("exif", "icc_profile", "xmp"))
             
             # Convert to RGB if needed
             if image.mode != "RGB":
                 image = image.convert("RGB")
             
             # Resize to target size (224x224)
-            image = image.resize((self.target_size, self.target_size), Image.Resampling.LANCZOS)
-            
-            # Convert to numpy array
-            image_array = np.array(image, dtype=np.float32)
+            resized = image.resize((self.target_size, self.target_size), Image.Resampling.LANCZOS)
             
-            # Normalize to 0-1 range (as per training: rescale 1/255)
-            image_array = image_array / 255.0
+            # Convert to numpy array (canonical uint8 buffer; the 1/255 rescale used
+            # in training is applied by ModelService at the model boundary)
+            image_array = np.asarray(resized, dtype=np.uint8)
             
-            return image_array
+            return DecodedUpload(
+                data=image_bytes,
+                image_format=image_format,
+                width=width,
+                height=height,
+                exif_orientation=exif_orientation,
+                has_metadata=has_metadata,
+                pixels=image_array,
+                image=image
+            )
         
+        except UploadRejected:
+            raise
         except Exception as e:
             print(f"Error processing image: {e}")
             return None
     
-    def validate_image(self, image_bytes: bytes) -> tuple:
+    def validate_image(self, upload: DecodedUpload) -> tuple:
         """
-        Validate image before processing
+        Validate a decoded upload (uses its recorded size and dimensions, no re-decode)
         
         Returns:
             Tuple of (is_valid, error_message)
         """
-        try:
-            # Check file size (max 10MB)
-            max_size = 10 * 1024 * 1024  # 10MB
-            if len(image_bytes) > max_size:
-                return False, "Image file is too large. Maximum size is 10MB."
-            
-            # Try to open image
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            # Check dimensions
-            width, height = image.size
-            if width < 50 or height < 50:
-                return False, "Image dimensions are too small. Minimum size is 50x50 pixels."
-            
-            if width > 10000 or height > 10000:
-                return False, "Image dimensions are too large. Maximum size is 10000x10000 pixels."
-            
-            return True, "Image is valid"
+        # Check file size (max 10MB by default)
+        if upload.byte_size > self.max_file_size:
+            return False, f"Image file is too large. Maximum size is {self._format_bytes(self.max_file_size)}."
         
-        except Exception as e:
-            return False, f"Invalid image file: {str(e)}"
-
+        # Check dimensions
+        return self.validate_dimensions(upload.width, upload.height)
@@ -0,0 +1,39 @@
+"""
+Perceptual Hash - 64-bit pHash and dHash of the canonical (already resized) image
+Re-encoded, recompressed or re-photographed copies of an image differ in their bytes
+but stay within a few bits of each other's hashes
+"""
+
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int(np.packbits(bits.ravel().astype(np.uint8)).view(">u8")[0])
+
+
+def dhash(gray: np.ndarray) -> int:
+    """Difference hash: sign of horizontal gradients on a 9x8 thumbnail"""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+
+def phash(gray: np.ndarray) -> int:
+    """DCT hash: low-frequency 8x8 DCT coefficients of a 32x32 thumbnail against their median"""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    # The DC term only reflects overall brightness; leave it out of the median
+    return _bits_to_int(low > np.median(low.ravel()[1:]))
+
+
+def perceptual_hashes(pixels: np.ndarray) -> Tuple[int, int]:
+    """
+    Hashes of a canonical RGB uint8 image
+    
+    Returns:
+        Tuple of (phash, dhash), each a 64-bit integer
+    """
+    gray = cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY)
+    return phash(gray), dhash(gray)
@@ -0,0 +1,115 @@
+"""
+Pixel Budget - Weighted semaphore over the decoded pixels a worker holds at once
+Each decode leases its pixel count (from the image header) until the full-resolution
+image is released, so one 100 MP upload counts as much as fifty 2 MP phone photos
+"""
+
+import asyncio
+from collections import deque
+from typing import Any, Dict, Optional
+
+
+class PixelLease:
+    """Pixels held by one decoded upload; release() is idempotent and thread-safe"""
+    
+    def __init__(self, budget: "PixelBudget", pixels: int, loop: asyncio.AbstractEventLoop):
+        self.budget = budget
+        self.pixels = pixels
+        self._loop = loop
+        self._released = False
+    
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self.budget._release(self.pixels)
+        elif not self._loop.is_closed():
+            # Released from a worker thread (e.g. after the Gemini re-encode)
+            self._loop.call_soon_threadsafe(self.budget._release, self.pixels)
+
+
+class PixelBudget:
+    """
+    FIFO weighted semaphore: a lease is granted once its pixels fit in the budget
+    and every earlier waiter has been served, so large images are not starved by
+    a stream of small ones. Requests larger than the whole budget wait for all of it.
+    
+    acquire() and the bookkeeping run on the event loop thread.
+    """
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_use = 0
+        self._waiters = deque()
+        self.stats = {"leases": 0, "waited": 0, "timed_out": 0, "downscaled": 0, "peak_pixels": 0}
+    
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+    
+    async def acquire(self, pixels: int, timeout: Optional[float] = None) -> Optional[PixelLease]:
+        """
+        Lease `pixels` (capped at the capacity)
+        
+        Returns:
+            PixelLease, or None if the budget did not free up within timeout seconds
+        """
+        loop = asyncio.get_running_loop()
+        pixels = min(pixels, self.capacity)
+        if not self._waiters and self.in_use + pixels <= self.capacity:
+            self._grant(pixels)
+            return PixelLease(self, pixels, loop)
+        
+        waiter = loop.create_future()
+        self._waiters.append((pixels, waiter))
+        self.stats["waited"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted together with the timeout / cancellation: give it back
+                self._release(pixels)
+            else:
+                waiter.cancel()
+                self._waiters.remove((pixels, waiter))
+                # A large waiter leaving the head of the queue can unblock smaller ones
+                self._wake()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.stats["timed_out"] += 1
+            return None
+        return PixelLease(self, pixels, loop)
+    
+    def _grant(self, pixels: int):
+        self.in_use += pixels
+        self.stats["leases"] += 1
+        self.stats["peak_pixels"] = max(self.stats["peak_pixels"], self.in_use)
+    
+    def _release(self, pixels: int):
+        self.in_use -= pixels
+        self._wake()
+    
+    def _wake(self):
+        while self._waiters:
+            pixels, waiter = self._waiters[0]
+            if waiter.done():
+                self._waiters.popleft()
+                continue
+            if self.in_use + pixels > self.capacity:
+                return
+            self._waiters.popleft()
+            self._grant(pixels)
+            waiter.set_result(None)
+    
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "capacity_pixels": self.capacity,
+            "in_use_pixels": self.in_use,
+            "waiting": len(self._waiters),
+            **self.stats,
+        }
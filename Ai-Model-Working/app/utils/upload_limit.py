@@ -0,0 +1,72 @@
+"""
+Upload Limit - Caps request body bytes while the body is being received
+Starlette spools a multipart body completely before the handler runs, so the limit
+has to sit in front of the parser: a declared Content-Length over the limit is
+rejected before anything is read, and a chunked body is cut off as soon as the
+running total passes it
+"""
+
+from typing import Callable, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+
+
+class BodyTooLarge(Exception):
+    """Raised from receive() once the body has passed the limit"""
+
+
+class UploadSizeLimit:
+    """
+    Pure ASGI middleware for POST bodies (a function middleware would wrap receive
+    in a way that hides client disconnects from request.is_disconnected())
+    
+    Args:
+        app: Wrapped ASGI app
+        limit: Called per request; returns (max body bytes, 413 detail message),
+            or None while no limit is configured
+    """
+    
+    def __init__(self, app, limit: Callable[[], Optional[Tuple[int, str]]]):
+        self.app = app
+        self.limit = limit
+    
+    async def __call__(self, scope, receive, send):
+        limit = self.limit() if scope["type"] == "http" and scope["method"] == "POST" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        
+        max_bytes, detail = limit
+        rejection = JSONResponse(status_code=413, content={"detail": detail})
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > max_bytes:
+            await rejection(scope, receive, send)
+            return
+        
+        state = {"received": 0, "exceeded": False, "started": False}
+        
+        async def limited_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if state["received"] > max_bytes:
+                    state["exceeded"] = True
+                    raise BodyTooLarge()
+            return message
+        
+        async def limited_send(message):
+            if state["exceeded"]:
+                # The app turned the aborted read into its own error (FastAPI: 400): send the 413 instead
+                if message["type"] == "http.response.start" and not state["started"]:
+                    state["started"] = True
+                    await rejection(scope, receive, send)
+                return
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            await send(message)
+        
+        try:
+            await self.app(scope, limited_receive, limited_send)
+        except BodyTooLarge:
+            if not state["started"]:
+                await rejection(scope, receive, send)
@@ -0,0 +1,119 @@
+"""
+Buffer Pool Benchmark Script
+Runs the CV heuristic stages concurrently over testing-images with plane pooling
+disabled and enabled, and reports plane allocations, traced memory and GC activity
+"""
+
+import argparse
+import asyncio
+import gc
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Add app directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+from app.services.relevance_detector import RelevanceDetector
+from app.services.severity_estimator import SeverityEstimator
+from app.services.uncertainty_detector import UncertaintyDetector
+from app.utils.buffer_pool import PlanePool
+from app.utils.image_processor import ImageProcessor
+
+# Load environment variables
+load_dotenv()
+
+TEST_IMAGES_DIR = "testing-images"
+
+
+def analyze(processed_image, relevance_detector, uncertainty_detector, severity_estimator):
+    """The image-only heuristic work of one request"""
+    relevance_detector.check_relevance_sync(processed_image)
+    features = uncertainty_detector.extract_image_features(processed_image)
+    severity_estimator.extract_image_features(processed_image, features)
+
+
+def run_mode(label: str, capacity: int, processed, rounds: int, concurrency: int):
+    plane_pool = PlanePool(capacity=capacity)
+    relevance_detector = RelevanceDetector(plane_pool=plane_pool)
+    uncertainty_detector = UncertaintyDetector(plane_pool=plane_pool)
+    severity_estimator = SeverityEstimator(plane_pool=plane_pool)
+    
+    collections = [0, 0, 0]
+    
+    def on_gc(phase, info):
+        if phase == "start":
+            collections[info["generation"]] += 1
+    
+    work = [image for _ in range(rounds) for image in processed]
+    latencies = []
+    
+    def timed(image):
+        start = time.perf_counter()
+        analyze(image, relevance_detector, uncertainty_detector, severity_estimator)
+        latencies.append((time.perf_counter() - start) * 1000)
+    
+    gc.collect()
+    gc.callbacks.append(on_gc)
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(timed, work))
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        gc.callbacks.remove(on_gc)
+    
+    stats = plane_pool.snapshot()
+    checkouts = stats["hits"] + stats["misses"]
+    print(f"\n📊 {label}:")
+    print(f"   throughput: {len(work) / elapsed:.1f} images/s")
+    print(f"   mean latency: {statistics.mean(latencies):.1f} ms")
+    print(f"   plane arena allocations: {stats['misses']} of {checkouts} checkouts")
+    print(f"   traced peak memory: {peak / (1024 * 1024):.1f} MB")
+    print(f"   GC collections (gen0/gen1/gen2): {collections[0]}/{collections[1]}/{collections[2]}")
+    return stats["misses"], peak
+
+
+def benchmark(rounds: int, concurrency: int):
+    images = sorted(
+        p for p in Path(TEST_IMAGES_DIR).iterdir()
+        if p.suffix.lower() in {".jpg", ".jpeg", ".png", ".webp"}
+    )
+    if not images:
+        print(f"❌ No images found in {TEST_IMAGES_DIR}")
+        return
+    
+    image_processor = ImageProcessor()
+    processed = []
+    for path in images:
+        processed_image = asyncio.run(image_processor.process_image(path.read_bytes()))
+        if processed_image is not None:
+            processed.append(processed_image)
+    
+    print("=" * 60)
+    print(f"BUFFER POOL BENCHMARK ({len(processed)} images x {rounds} rounds, {concurrency} threads)")
+    print("=" * 60)
+    
+    before = run_mode("pooling disabled (fresh planes per stage)", 0, processed, rounds, concurrency)
+    after = run_mode("pooling enabled", max(concurrency * 3, 1), processed, rounds, concurrency)
+    
+    print(f"\n⚡ Plane allocations: {before[0]} -> {after[0]}")
+    print(f"⚡ Traced peak memory: {before[1] / (1024 * 1024):.1f} MB -> {after[1] / (1024 * 1024):.1f} MB")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark CV plane pooling under concurrent load")
+    parser.add_argument("--rounds", type=int, default=3, help="Passes over the test images per mode")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent worker threads")
+    args = parser.parse_args()
+    benchmark(args.rounds, args.concurrency)
@@ -0,0 +1,108 @@
+"""
+Pipeline Benchmark Script
+Runs the analysis stage graph over testing-images in sequential and parallel modes
+and reports per-image latency for each mode
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add app directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+from app.services.cv_executor import CVExecutor
+from app.services.pipeline_executor import PipelineExecutor, PipelineAborted, build_analysis_stages
+from app.services.relevance_detector import RelevanceDetector
+from app.services.severity_estimator import SeverityEstimator
+from app.services.uncertainty_detector import UncertaintyDetector
+from app.utils.image_processor import ImageProcessor
+
+# Load environment variables
+load_dotenv()
+
+TEST_IMAGES_DIR = "testing-images"
+
+
+async def load_model_service():
+    """Load the model if available (benchmark runs heuristics only otherwise)"""
+    model_path = os.getenv("MODEL_PATH", "models/eczema_detector_efficientnet.h5")
+    if not os.path.exists(model_path):
+        print(f"⚠️  Model not found at {model_path} - benchmarking heuristic stages only")
+        return None
+    from app.services.model_service import ModelService
+    model_service = ModelService(model_path)
+    await model_service.load_model()
+    return model_service
+
+
+async def benchmark(rounds: int, process_stages):
+    images = sorted(
+        p for p in Path(TEST_IMAGES_DIR).iterdir()
+        if p.suffix.lower() in {".jpg", ".jpeg", ".png", ".webp"}
+    )
+    if not images:
+        print(f"❌ No images found in {TEST_IMAGES_DIR}")
+        return
+
+    image_processor = ImageProcessor()
+    relevance_detector = RelevanceDetector()
+    uncertainty_detector = UncertaintyDetector()
+    severity_estimator = SeverityEstimator()
+    model_service = await load_model_service()
+    executor = PipelineExecutor()
+    cv_executor = CVExecutor(process_stages=process_stages)
+    cv_executor.warm_up()
+
+    processed = []
+    for path in images:
+        processed_image = await image_processor.process_image(path.read_bytes())
+        if processed_image is not None:
+            processed.append((path.name, processed_image))
+
+    print("=" * 60)
+    print(f"PIPELINE BENCHMARK ({len(processed)} images x {rounds} rounds, {executor.max_workers} workers)")
+    print(f"CV stage backends: {cv_executor.describe()}")
+    print("=" * 60)
+
+    summary = {}
+    for mode in ("sequential", "parallel"):
+        latencies = []
+        for _ in range(rounds):
+            for name, processed_image in processed:
+                stages = build_analysis_stages(
+                    processed_image, relevance_detector, model_service,
+                    uncertainty_detector, severity_estimator, cv_executor=cv_executor
+                )
+                start = time.perf_counter()
+                try:
+                    await executor.run(stages, mode=mode)
+                except PipelineAborted:
+                    pass
+                latencies.append((time.perf_counter() - start) * 1000)
+        summary[mode] = latencies
+        print(f"\n📊 {mode}:")
+        print(f"   mean: {statistics.mean(latencies):.1f} ms")
+        print(f"   median: {statistics.median(latencies):.1f} ms")
+        print(f"   max: {max(latencies):.1f} ms")
+
+    speedup = statistics.mean(summary["sequential"]) / statistics.mean(summary["parallel"])
+    print(f"\n⚡ Parallel speedup: {speedup:.2f}x")
+    print("=" * 60)
+    executor.shutdown()
+    cv_executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sequential vs parallel pipeline execution")
+    parser.add_argument("--rounds", type=int, default=3, help="Passes over the test images per mode")
+    parser.add_argument("--process-stages", nargs="*", default=None,
+                        help="CV stages to run in worker processes (default: CV_PROCESS_STAGES)")
+    args = parser.parse_args()
+    asyncio.run(benchmark(args.rounds, args.process_stages))
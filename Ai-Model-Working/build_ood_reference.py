@@ -0,0 +1,133 @@
+"""
+OOD Reference Builder Script
+Embeds a folder of in-distribution images with the model's penultimate layer and
+writes the class centroids, whitening matrix and distance threshold used by
+UNCERTAINTY_MODE=embedding
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+# Add app directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+from app.services.ood_scorer import EmbeddingOODScorer, build_reference
+from app.utils.image_processor import ImageProcessor, UploadRejected
+
+# Load environment variables
+load_dotenv()
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+
+def find_images(folder: Path):
+    return sorted(p for p in folder.rglob("*") if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def collect_classes(reference_dir: Path):
+    """One class per subfolder (e.g. eczema/, normal/); loose images form a single class"""
+    classes = [(d.name, find_images(d)) for d in sorted(reference_dir.iterdir()) if d.is_dir()]
+    classes = [(name, paths) for name, paths in classes if paths]
+    if not classes:
+        classes = [("reference", find_images(reference_dir))]
+    return classes
+
+
+def embed(model_service, image_processor, paths, batch_size: int, workers: int):
+    """Embeddings of every decodable image in paths (undecodable files are skipped)"""
+    def decode(path: Path):
+        try:
+            upload = image_processor.decode_upload_sync(path.read_bytes())
+        except (UploadRejected, OSError):
+            return None
+        return upload.pixels if upload is not None else None
+    
+    embeddings = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(paths), batch_size):
+            pixels = [p for p in pool.map(decode, paths[start:start + batch_size]) if p is not None]
+            if pixels:
+                results = model_service.predict_batch_sync(np.stack(pixels))
+                embeddings.extend(result["embedding"] for result in results)
+            print(f"   {min(start + batch_size, len(paths))}/{len(paths)}", end="\r")
+    print()
+    return np.array(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+
+
+async def build(args):
+    model_path = os.getenv("MODEL_PATH", "models/eczema_detector_efficientnet.h5")
+    if not os.path.exists(model_path):
+        print(f"❌ Model not found at {model_path} (set MODEL_PATH)")
+        return
+    
+    classes = collect_classes(args.reference_dir)
+    if not any(paths for _, paths in classes):
+        print(f"❌ No images found in {args.reference_dir}")
+        return
+    
+    from app.services.model_service import ModelService
+    model_service = ModelService(model_path, return_embedding=True)
+    await model_service.load_model()
+    image_processor = ImageProcessor(target_size=model_service.input_size)
+    
+    print("=" * 60)
+    print(f"OOD REFERENCE: {model_service.embedding_dim}-dim embeddings, {len(classes)} class(es)")
+    print("=" * 60)
+    
+    embeddings, labels = [], []
+    for label, (name, paths) in enumerate(classes):
+        print(f"\n📁 {name}: {len(paths)} images")
+        class_embeddings = embed(model_service, image_processor, paths, args.batch_size, args.workers)
+        embeddings.append(class_embeddings)
+        labels.append(np.full(len(class_embeddings), label))
+    
+    embeddings = np.concatenate(embeddings)
+    labels = np.concatenate(labels)
+    if len(embeddings) < 2:
+        print("❌ Need at least two decodable reference images")
+        return
+    
+    reference = build_reference(
+        embeddings, labels, [name for name, _ in classes],
+        percentile=args.percentile, shrinkage=args.shrinkage
+    )
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(args.output, **reference)
+    
+    scorer = EmbeddingOODScorer.from_arrays(reference)
+    distances = scorer.score_batch(embeddings)
+    print(f"\n✅ Saved {args.output} ({args.output.stat().st_size / 1024:.0f} KB, {len(embeddings)} images)")
+    print(f"📊 Reference distances: median {np.median(distances):.2f}, max {distances.max():.2f}")
+    print(f"📊 Threshold (p{args.percentile:g}): {scorer.threshold:.2f}")
+    print("⚠️  Distances are measured on the reference images themselves; prefer held-out images for --validate-dir")
+    
+    if args.validate_dir is not None:
+        paths = find_images(args.validate_dir)
+        print(f"\n📁 Validation ({args.validate_dir}): {len(paths)} images")
+        validation = scorer.score_batch(embed(model_service, image_processor, paths, args.batch_size, args.workers))
+        flagged = int((validation > scorer.threshold).sum())
+        print(f"📊 Flagged as out-of-distribution: {flagged}/{len(validation)}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the embedding OOD reference for UNCERTAINTY_MODE=embedding")
+    parser.add_argument("reference_dir", type=Path, help="In-distribution images, one subfolder per class")
+    parser.add_argument("--output", type=Path, default=Path(os.getenv("OOD_REFERENCE_PATH", "models/ood_reference.npz")),
+                        help="Reference file to write")
+    parser.add_argument("--percentile", type=float, default=95.0, help="Reference distance percentile used as threshold")
+    parser.add_argument("--shrinkage", type=float, default=0.1, help="Covariance shrinkage towards identity (0-1)")
+    parser.add_argument("--validate-dir", type=Path, default=None,
+                        help="Optional folder of images to score against the new threshold")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per inference batch")
+    parser.add_argument("--workers", type=int, default=4, help="Decode threads")
+    args = parser.parse_args()
+    asyncio.run(build(args))
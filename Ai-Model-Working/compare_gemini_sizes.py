@@ -0,0 +1,94 @@
+"""
+Gemini Upload Size Comparison Script
+Sends every image in testing-images to Gemini at several max-edge sizes and checks
+that the verdict stays stable when uploads are downsized and re-encoded
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+# Add app directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+from app.services.llm_service import LLMService
+from app.utils.gemini_image_encoder import GeminiImageEncoder
+from app.utils.image_processor import ImageProcessor
+
+# Load environment variables
+load_dotenv()
+
+TEST_IMAGES_DIR = "testing-images"
+
+
+async def compare(sizes, image_format: str, quality: int, confidence_tolerance: float):
+    api_key = os.getenv("GEMINI_API_KEY")
+    model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
+    if not api_key:
+        print("❌ No API key found. Please set GEMINI_API_KEY in your .env file")
+        sys.exit(1)
+    
+    image_processor = ImageProcessor()
+    images = sorted(
+        p for p in Path(TEST_IMAGES_DIR).iterdir()
+        if p.suffix.lower() in {".jpg", ".jpeg", ".png", ".webp"}
+    )
+    
+    # "original" column: upload sent untouched (the previous behaviour)
+    variants = [("original", GeminiImageEncoder(image_format="original"))]
+    for size in sizes:
+        variants.append((f"{size}px", GeminiImageEncoder(max_edge=size, image_format=image_format, quality=quality)))
+    
+    print("=" * 60)
+    print(f"GEMINI VERDICT STABILITY ({model_name}, {image_format} q{quality})")
+    print("=" * 60)
+    
+    unstable = []
+    for path in images:
+        image_bytes = path.read_bytes()
+        print(f"\n🖼️  {path.name} ({len(image_bytes) / 1024:.1f} KB)")
+        
+        verdicts = []
+        for label, encoder in variants:
+            # Fresh decode per variant: the Gemini payload is cached on the upload
+            upload = await image_processor.decode_upload(image_bytes)
+            encoded_bytes, _ = upload.gemini_payload(encoder)
+            llm_service = LLMService(api_key=api_key, model_name=model_name, image_encoder=encoder)
+            start = time.perf_counter()
+            _, assessment, confidence = await llm_service.assess_image(upload)
+            elapsed = (time.perf_counter() - start) * 1000
+            verdicts.append((assessment, confidence))
+            confidence_text = f"{confidence:.2f}" if confidence is not None else "N/A"
+            print(
+                f"   {label:>9}: {len(encoded_bytes) / 1024:8.1f} KB  "
+                f"assessment={str(assessment):5}  confidence={confidence_text:4}  {elapsed:7.0f} ms"
+            )
+        
+        assessments = {assessment for assessment, _ in verdicts}
+        confidences = [confidence for _, confidence in verdicts if confidence is not None]
+        spread = max(confidences) - min(confidences) if confidences else 0.0
+        stable = len(assessments) == 1 and spread <= confidence_tolerance
+        print(f"   {'✅ stable' if stable else '⚠️  UNSTABLE'} (confidence spread {spread:.2f})")
+        if not stable:
+            unstable.append(path.name)
+    
+    print("\n" + "=" * 60)
+    print(f"Stable: {len(images) - len(unstable)}/{len(images)}")
+    if unstable:
+        print(f"Unstable: {', '.join(unstable)}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check Gemini verdict stability across upload sizes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 768, 512], help="Max-edge sizes to compare")
+    parser.add_argument("--format", default="jpeg", choices=["jpeg", "webp"], help="Re-encode format")
+    parser.add_argument("--quality", type=int, default=85, help="Re-encode quality")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed confidence spread")
+    args = parser.parse_args()
+    asyncio.run(compare(args.sizes, args.format, args.quality, args.tolerance))
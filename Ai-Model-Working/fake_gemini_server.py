@@ -0,0 +1,320 @@
+"""
+Fake Gemini Server
+Local stand-in for the Gemini generateContent endpoint, for load and fault tests of
+LLMService and the override logic without an API key or network access.
+Point the service at it with GEMINI_BASE_URL=http://127.0.0.1:8090/v1beta
+
+Latency, 503/429 errors, malformed and non-JSON bodies, markdown-wrapped and prose
+answers are injected at configurable rates. Each decision is drawn from a random
+stream seeded by (seed, image hash, attempt number), so a run replays the same faults
+regardless of request concurrency. Verdicts can be scripted per image
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+# Add app directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from app.utils.image_processor import ImageProcessor
+from app.utils.perceptual_hash import perceptual_hashes
+
+# Max differing pHash bits for a received image to match a scripted one
+# (uploads are downsized and re-encoded by LLMService before they are sent)
+SCRIPT_MATCH_DISTANCE = 10
+
+# Response kinds, in the order their rates are applied
+FAULT_KINDS = ("503", "429", "malformed", "non_json", "markdown", "prose")
+
+
+@dataclass
+class FakeGeminiConfig:
+    """Behaviour of the fake server (rates are probabilities per request)"""
+    latency: str = "fixed:50"           # fixed:MS, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA (ms)
+    rate_503: float = 0.0
+    rate_429: float = 0.0
+    rate_malformed: float = 0.0         # 200 with a body missing "candidates"
+    rate_non_json: float = 0.0          # 200 with an HTML error page
+    rate_markdown: float = 0.0          # Verdict JSON wrapped in a ```json block
+    rate_prose: float = 0.0             # Free text without JSON (heuristic parse path)
+    seed: int = 0
+    
+    def rate(self, kind: str) -> float:
+        return getattr(self, "rate_" + kind)
+
+
+def parse_latency(spec: str):
+    """Sampler of response latencies in seconds from a latency spec"""
+    kind, _, values = spec.partition(":")
+    numbers = [float(value) for value in values.split(",") if value]
+    if kind == "fixed" and len(numbers) == 1:
+        return lambda rng: numbers[0] / 1000.0
+    if kind == "uniform" and len(numbers) == 2:
+        return lambda rng: rng.uniform(*numbers) / 1000.0
+    if kind == "lognormal" and len(numbers) == 2:
+        import math
+        return lambda rng: rng.lognormvariate(math.log(numbers[0]), numbers[1]) / 1000.0
+    raise ValueError(f"Invalid latency spec {spec!r} (fixed:MS, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA)")
+
+
+class VerdictScript:
+    """
+    Scripted verdicts from a JSON file: {"<image path or payload sha256>": {...}}
+    
+    Values hold "assessment" (true/false/null), "confidence", optionally "explanation"
+    and "fault" (one of FAULT_KINDS, forced on every request for that image). Path keys
+    are matched by perceptual hash, so they survive the re-encoding before upload.
+    """
+    
+    def __init__(self, entries: Dict[str, Dict[str, Any]], base_dir: str = "."):
+        self.by_sha256: Dict[str, Dict[str, Any]] = {}
+        self.by_phash: List[Tuple[int, Dict[str, Any]]] = []
+        image_processor = ImageProcessor()
+        for key, verdict in entries.items():
+            path = key if os.path.isabs(key) else os.path.join(base_dir, key)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    upload = image_processor.decode_upload_sync(f.read())
+                if upload is None:
+                    raise ValueError(f"Scripted image {key} could not be decoded")
+                self.by_phash.append((perceptual_hashes(upload.pixels)[0], verdict))
+            elif len(key) == 64:
+                self.by_sha256[key.lower()] = verdict
+            else:
+                raise ValueError(f"Script key {key} is neither an image file nor a sha256")
+    
+    @classmethod
+    def load(cls, path: str) -> "VerdictScript":
+        with open(path) as f:
+            return cls(json.load(f), base_dir=os.path.dirname(os.path.abspath(path)))
+    
+    def lookup(self, sha256: str, phash: Optional[int]) -> Optional[Dict[str, Any]]:
+        if sha256 in self.by_sha256:
+            return self.by_sha256[sha256]
+        if phash is None or not self.by_phash:
+            return None
+        distance, verdict = min(((bin(phash ^ known).count("1"), verdict) for known, verdict in self.by_phash),
+                                key=lambda item: item[0])
+        return verdict if distance <= SCRIPT_MATCH_DISTANCE else None
+
+
+class FakeGemini:
+    """Request handling and counters of the fake server"""
+    
+    def __init__(self, config: FakeGeminiConfig, script: Optional[VerdictScript] = None):
+        self.config = config
+        self.script = script
+        self.sample_latency = parse_latency(config.latency)
+        self.image_processor = ImageProcessor()
+        self._attempts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"requests": 0, "vision": 0, "text": 0, "scripted": 0}
+    
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+    
+    def _stream(self, request_key: str, per_attempt: bool) -> random.Random:
+        """
+        Random stream of the n-th request with this key (per_attempt), or of the key
+        alone (text requests: the same prompt is sent by many concurrent requests)
+        """
+        attempt = 0
+        if per_attempt:
+            with self._lock:
+                attempt = self._attempts.get(request_key, 0)
+                self._attempts[request_key] = attempt + 1
+        digest = hashlib.sha256(f"{self.config.seed}:{request_key}:{attempt}".encode()).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+    
+    def _image_of(self, body: Dict[str, Any]) -> Optional[bytes]:
+        for content in body.get("contents", []):
+            for part in content.get("parts", []):
+                inline = part.get("inline_data") or part.get("inlineData")
+                if inline:
+                    return base64.b64decode(inline.get("data", ""))
+        return None
+    
+    def _prompt_of(self, body: Dict[str, Any]) -> str:
+        return " ".join(
+            part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", [])
+        )
+    
+    async def generate_content(self, model: str, body: Dict[str, Any]):
+        self._count("requests")
+        image = self._image_of(body)
+        request_key = hashlib.sha256(image if image is not None else self._prompt_of(body).encode()).hexdigest()
+        rng = self._stream(request_key, per_attempt=image is not None)
+        
+        verdict = None
+        if image is not None:
+            self._count("vision")
+            if self.script is not None:
+                upload = await asyncio.to_thread(self.image_processor.decode_upload_sync, image)
+                phash = perceptual_hashes(upload.pixels)[0] if upload is not None else None
+                verdict = self.script.lookup(request_key, phash)
+        else:
+            self._count("text")
+        if verdict is not None:
+            self._count("scripted")
+        
+        await asyncio.sleep(self.sample_latency(rng))
+        
+        # One draw per kind, always in the same order, keeps the stream aligned
+        draws = {kind: rng.random() for kind in FAULT_KINDS}
+        fault = (verdict or {}).get("fault")
+        if fault is None:
+            fault = next((kind for kind in FAULT_KINDS if draws[kind] < self.config.rate(kind)), None)
+        if fault in ("markdown", "prose") and image is None:
+            fault = None  # Text-only explanations have no verdict to wrap
+        self._count(fault or "ok")
+        
+        if fault == "503":
+            return JSONResponse(status_code=503, content=error_body(503, "The model is overloaded. Please try again later.", "UNAVAILABLE"))
+        if fault == "429":
+            return JSONResponse(status_code=429, content=error_body(429, "Resource has been exhausted (e.g. check quota).", "RESOURCE_EXHAUSTED"))
+        if fault == "malformed":
+            return JSONResponse(content={"promptFeedback": {"blockReason": "OTHER"}, "modelVersion": model})
+        if fault == "non_json":
+            return PlainTextResponse("<html><body><h1>502 Bad Gateway</h1></body></html>", media_type="text/html")
+        
+        if image is None:
+            text = ("This is a simulated explanation from the local Gemini stand-in. "
+                    "It is not a medical diagnosis; please consult a dermatologist.")
+        else:
+            if verdict is None:
+                # Unscripted: a stable verdict per image
+                image_rng = random.Random(int(request_key[:16], 16) ^ self.config.seed)
+                verdict = {
+                    "assessment": image_rng.random() < 0.5,
+                    "confidence": round(image_rng.uniform(0.5, 0.95), 2),
+                }
+            text = verdict_text(verdict, fault)
+        return JSONResponse(content=candidate_body(text, model))
+
+
+def error_body(code: int, message: str, status: str) -> Dict[str, Any]:
+    return {"error": {"code": code, "message": message, "status": status}}
+
+
+def candidate_body(text: str, model: str) -> Dict[str, Any]:
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+        "modelVersion": model,
+    }
+
+
+def verdict_text(verdict: Dict[str, Any], fault: Optional[str]) -> str:
+    """Answer text for a verdict: plain JSON, markdown-wrapped JSON, or prose"""
+    assessment = verdict.get("assessment")
+    explanation = verdict.get("explanation") or (
+        "Simulated assessment from the local Gemini stand-in. "
+        "This is NOT a medical diagnosis; please consult a dermatologist."
+    )
+    if fault == "prose":
+        if assessment:
+            return "I can see redness and inflammation consistent with eczema. " + explanation
+        return "I do not see clear signs of a skin condition in this image. " + explanation
+    document = json.dumps({
+        "gemini_assessment": assessment,
+        "gemini_confidence": verdict.get("confidence"),
+        "explanation": explanation,
+    }, indent=2)
+    if fault == "markdown":
+        return f"Here is my assessment:\n```json\n{document}\n```"
+    return document
+
+
+def create_app(config: FakeGeminiConfig, script: Optional[VerdictScript] = None) -> FastAPI:
+    fake = FakeGemini(config, script)
+    app = FastAPI(title="Fake Gemini")
+    app.state.fake = fake
+    
+    @app.post("/v1beta/models/{model_action}")
+    async def generate_content(model_action: str, request: Request):
+        model, _, action = model_action.partition(":")
+        if action != "generateContent":
+            return JSONResponse(status_code=404, content=error_body(404, f"Unsupported action {action!r}", "NOT_FOUND"))
+        if not request.headers.get("x-goog-api-key"):
+            return JSONResponse(status_code=403, content=error_body(403, "Method doesn't allow unregistered callers.", "PERMISSION_DENIED"))
+        return await fake.generate_content(model, await request.json())
+    
+    @app.get("/stats")
+    async def stats():
+        return fake.stats
+    
+    return app
+
+
+class BackgroundServer:
+    """Runs the fake server on a background thread (used by load_test_gemini.py)"""
+    
+    def __init__(self, app: FastAPI, host: str = "127.0.0.1", port: int = 0):
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning", access_log=False))
+        self.thread = threading.Thread(target=self.server.run, name="fake-gemini", daemon=True)
+    
+    def __enter__(self) -> str:
+        """Start the server; returns its GEMINI_BASE_URL"""
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("Fake Gemini server failed to start")
+            threading.Event().wait(0.01)
+        host, port = self.server.servers[0].sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/v1beta"
+    
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser):
+    """Options shared with load_test_gemini.py"""
+    parser.add_argument("--latency", default="fixed:50", help="fixed:MS, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA")
+    for kind in FAULT_KINDS:
+        parser.add_argument(f"--rate-{kind.replace('_', '-')}", type=float, default=0.0, dest=f"rate_{kind}",
+                            help=f"Share of requests answered with the {kind} fault")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the fault and verdict streams")
+    parser.add_argument("--script", default=None, help="JSON file of scripted verdicts per image")
+
+
+def config_from_args(args) -> Tuple[FakeGeminiConfig, Optional[VerdictScript]]:
+    config = FakeGeminiConfig(
+        latency=args.latency,
+        seed=args.seed,
+        **{f"rate_{kind}": getattr(args, f"rate_{kind}") for kind in FAULT_KINDS}
+    )
+    parse_latency(config.latency)
+    return config, VerdictScript.load(args.script) if args.script else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Gemini generateContent API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    config, script = config_from_args(args)
+    
+    print("=" * 60)
+    print(f"FAKE GEMINI SERVER on http://{args.host}:{args.port}")
+    print("=" * 60)
+    print(f"   Set GEMINI_BASE_URL=http://{args.host}:{args.port}/v1beta (any GEMINI_API_KEY)")
+    print(f"   Latency: {config.latency}; faults: "
+          + ", ".join(f"{kind} {config.rate(kind):.0%}" for kind in FAULT_KINDS))
+    if script is not None:
+        print(f"   Scripted verdicts: {len(script.by_phash) + len(script.by_sha256)}")
+    uvicorn.run(create_app(config, script), host=args.host, port=args.port, log_level="warning")
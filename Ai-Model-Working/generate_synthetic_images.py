@@ -0,0 +1,380 @@
+"""
+Synthetic Image Generator
+Writes deterministic synthetic uploads for benchmarks and load tests (no patient photos):
+skin-toned smooth skin, reddened and textured patches, and non-skin scenes at
+configurable resolutions (0.3-48 MP) and formats, including small PNGs that
+decompress to huge images. The same seed always produces the same pixels
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+from pathlib import Path
+
+import cv2
+import numpy as np
+import PIL
+from PIL import Image
+
+# Add app directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+from app.services.relevance_detector import RelevanceDetector
+from app.services.severity_estimator import SeverityEstimator
+from app.services.uncertainty_detector import UncertaintyDetector
+from app.utils.buffer_pool import PlanePool
+from app.utils.image_processor import ImageProcessor, UploadRejected
+
+# Load environment variables
+load_dotenv()
+
+PROFILES = ("skin_smooth", "eczema_patches", "non_skin")
+FORMATS = ("jpeg", "png", "webp", "png-bomb")
+EXTENSIONS = {"jpeg": "jpg", "png": "png", "webp": "webp", "png-bomb": "png"}
+
+# Pixel-content images are rendered in memory, so they stay in this range;
+# PNG bombs are streamed and can be any size (e.g. beyond MAX_IMAGE_PIXELS)
+MIN_MEGAPIXELS = 0.3
+MAX_MEGAPIXELS = 48.0
+
+# Layouts are drawn on a canvas of at most this many pixels and upscaled;
+# the per-pixel noise is added at full resolution in strips of ROW_STRIP rows
+CANVAS_PIXELS = 1_000_000
+ROW_STRIP = 512
+
+# Skin tones as OpenCV HSV (hue 12-16 stays clear of the 0-10 red range)
+SKIN_TONES_HSV = ((13, 80, 240), (14, 100, 225), (13, 120, 200), (14, 135, 170), (15, 140, 140), (15, 150, 105))
+
+# Relevance rule of RelevanceDetector._decide, to tell its primary and fallback branches apart
+PRIMARY_SKIN, PRIMARY_VARIANCE = 10.0, 50.0
+
+# Verification outcome each profile is designed for
+EXPECTED_RELEVANT = {"skin_smooth": True, "eczema_patches": True, "non_skin": False}
+
+
+def parse_resolution(spec: str, aspect: float):
+    """'12' (megapixels) or '4000x3000' -> (width, height)"""
+    if "x" in spec:
+        width, height = (int(value) for value in spec.lower().split("x"))
+    else:
+        pixels = float(spec) * 1_000_000
+        width = int(round((pixels * aspect) ** 0.5))
+        height = int(round(pixels / width))
+    if width < 1 or height < 1:
+        raise ValueError(f"invalid resolution {spec!r}")
+    return width, height
+
+
+def hsv_color(hue: float, saturation: float, value: float) -> np.ndarray:
+    """One OpenCV HSV color as float32 RGB"""
+    hsv = np.array([[[hue, saturation, value]]], dtype=np.uint8)
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)[0, 0].astype(np.float32)
+
+
+def low_frequency(rng, width: int, height: int, cells: int) -> np.ndarray:
+    """Smooth random field in [-1, 1] with about `cells` blobs across the width"""
+    cells_y = max(2, int(round(cells * height / width)))
+    grid = rng.uniform(-1.0, 1.0, (cells_y, max(cells, 2))).astype(np.float32)
+    return cv2.resize(grid, (width, height), interpolation=cv2.INTER_CUBIC)
+
+
+def render_skin(rng, width: int, height: int):
+    """Skin tone with soft shading; (RGB canvas, noise amplitude plane)"""
+    tone = hsv_color(*SKIN_TONES_HSV[rng.integers(len(SKIN_TONES_HSV))])
+    # Shading is added equally to all channels, so hue stays in the skin range
+    shading = 22.0 * low_frequency(rng, width, height, 3) + 6.0 * low_frequency(rng, width, height, 12)
+    canvas = tone[None, None, :] + shading[..., None]
+    return canvas, np.full((height, width), 3.0, dtype=np.float32)
+
+
+def render_eczema(rng, width: int, height: int):
+    """Skin with reddened, scaly patches covering 15-45% of the area"""
+    canvas, amplitude = render_skin(rng, width, height)
+    field = low_frequency(rng, width, height, int(rng.integers(4, 9))) + 0.5 * low_frequency(rng, width, height, 18)
+    threshold = np.quantile(field, 1.0 - rng.uniform(0.15, 0.45))
+    mask = np.clip((field - threshold) / 0.25, 0.0, 1.0)
+    mask = mask * mask * (3.0 - 2.0 * mask)  # Smoothstep: soft patch borders
+    
+    red_hue = rng.choice([rng.uniform(0, 6), rng.uniform(174, 179)])
+    red = hsv_color(red_hue, rng.uniform(130, 200), rng.uniform(150, 210))
+    canvas = canvas * (1.0 - mask[..., None]) + red[None, None, :] * mask[..., None]
+    # Scale: sparse light flecks and much stronger fine texture inside the patches
+    flecks = (rng.random((height, width)) < 0.02 * mask).astype(np.float32)
+    canvas += 45.0 * flecks[..., None]
+    amplitude += 15.0 * mask
+    return canvas, amplitude
+
+
+def render_non_skin(rng, width: int, height: int):
+    """Sky, ground and saturated / dark shapes (blue, green, purple, gray)"""
+    horizon = int(height * rng.uniform(0.35, 0.65))
+    sky = hsv_color(rng.uniform(100, 115), rng.uniform(80, 160), rng.uniform(180, 240))
+    ground = hsv_color(rng.uniform(40, 75), rng.uniform(90, 200), rng.uniform(60, 160))
+    canvas = np.empty((height, width, 3), dtype=np.float32)
+    canvas[:horizon] = sky
+    canvas[horizon:] = ground
+    canvas[:horizon] *= np.linspace(0.8, 1.0, horizon, dtype=np.float32)[:, None, None]
+    
+    for _ in range(int(rng.integers(3, 9))):
+        kind = rng.integers(4)
+        if kind == 0:
+            color = hsv_color(0, rng.uniform(0, 20), rng.uniform(40, 90))  # Dark gray (light gray reads as skin)
+        else:
+            color = hsv_color((rng.uniform(95, 120), rng.uniform(45, 80), rng.uniform(125, 150))[kind - 1],
+                              rng.uniform(90, 220), rng.uniform(70, 220))
+        color = tuple(float(c) for c in color)
+        x, y = int(rng.uniform(0, width)), int(rng.uniform(0, height))
+        size = int(rng.uniform(0.05, 0.25) * min(width, height)) + 1
+        if rng.random() < 0.5:
+            cv2.rectangle(canvas, (x - size, y - size // 2), (x + size, y + size // 2), color, -1)
+        else:
+            cv2.circle(canvas, (x, y), size, color, -1)
+    return canvas, np.full((height, width), 5.0, dtype=np.float32)
+
+
+RENDERERS = {"skin_smooth": render_skin, "eczema_patches": render_eczema, "non_skin": render_non_skin}
+
+
+def item_seed(seed: int, profile: str, width: int, height: int, index: int) -> np.random.SeedSequence:
+    """Seed of one image: independent of the format and of the other images generated"""
+    return np.random.SeedSequence([seed, PROFILES.index(profile), width, height, index])
+
+
+def generate_pixels(profile: str, width: int, height: int, seed_sequence) -> np.ndarray:
+    """Full-resolution RGB uint8 image of a profile"""
+    layout_rng, noise_rng = (np.random.default_rng(child) for child in seed_sequence.spawn(2))
+    scale = min(1.0, (CANVAS_PIXELS / (width * height)) ** 0.5)
+    canvas_size = (max(int(width * scale), 8), max(int(height * scale), 8))
+    canvas, amplitude = RENDERERS[profile](layout_rng, *canvas_size)
+    
+    canvas = cv2.resize(np.clip(canvas, 0, 255).astype(np.uint8), (width, height), interpolation=cv2.INTER_LINEAR)
+    amplitude = cv2.resize(amplitude, (width, height), interpolation=cv2.INTER_LINEAR)
+    # Luminance noise (equal in every channel, so it does not move the hue)
+    for top in range(0, height, ROW_STRIP):
+        rows = slice(top, min(top + ROW_STRIP, height))
+        noise = noise_rng.standard_normal((rows.stop - top, width), dtype=np.float32) * amplitude[rows]
+        strip = canvas[rows].astype(np.float32) + noise[..., None]
+        canvas[rows] = np.clip(strip, 0, 255).astype(np.uint8)
+    return canvas
+
+
+def encode(pixels: np.ndarray, image_format: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if image_format == "jpeg":
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=quality)
+    elif image_format == "webp":
+        Image.fromarray(pixels).save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        Image.fromarray(pixels).save(buffer, format="PNG", compress_level=6)
+    return buffer.getvalue()
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+def write_png_bomb(path: Path, width: int, height: int, color) -> int:
+    """
+    Stream a flat-colored RGB PNG row by row (deflate shrinks it ~1000x), so its
+    header declares width x height while the file stays small; returns the size
+    """
+    row = b"\x00" + bytes(int(c) for c in color) * width
+    rows_per_block = max(1, (4 << 20) // len(row))
+    compressor = zlib.compressobj(9)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        for top in range(0, height, rows_per_block):
+            data = compressor.compress(row * min(rows_per_block, height - top))
+            if data:
+                f.write(png_chunk(b"IDAT", data))
+        f.write(png_chunk(b"IDAT", compressor.flush()))
+        f.write(png_chunk(b"IEND", b""))
+        return f.tell()
+
+
+def bomb_color(profile: str, seed_sequence):
+    """Base color of a profile (a bomb has no room for more content)"""
+    rng = np.random.default_rng(seed_sequence)
+    if profile == "non_skin":
+        return hsv_color(rng.uniform(100, 115), rng.uniform(80, 160), rng.uniform(180, 240))
+    tone = hsv_color(*SKIN_TONES_HSV[rng.integers(len(SKIN_TONES_HSV))])
+    return hsv_color(rng.uniform(0, 6), 170, 180) if profile == "eczema_patches" else tone
+
+
+class Verifier:
+    """Runs the image heuristics on the canonical decode, as /analyze does before the model"""
+    
+    def __init__(self, eczema_probability: float):
+        self.eczema_probability = eczema_probability
+        self.image_processor = ImageProcessor()
+        plane_pool = PlanePool()
+        self.relevance_detector = RelevanceDetector(plane_pool=plane_pool)
+        self.uncertainty_detector = UncertaintyDetector(plane_pool=plane_pool)
+        self.severity_estimator = SeverityEstimator(plane_pool=plane_pool)
+    
+    def verify(self, path: Path) -> dict:
+        """Which branches of the three detectors the image reaches"""
+        try:
+            upload = self.image_processor.decode_upload_sync(path.read_bytes())
+        except UploadRejected as rejected:
+            return {"decode": f"rejected {rejected.status_code}"}
+        if upload is None:
+            return {"decode": "failed"}
+        pixels = upload.pixels
+        
+        measured = self.relevance_detector.measure(pixels)
+        is_relevant, _ = self.relevance_detector.check_relevance_sync(pixels)
+        if not is_relevant:
+            branch = "rejected"
+        elif measured["skin_percentage"] >= PRIMARY_SKIN and measured["image_variance"] > PRIMARY_VARIANCE:
+            branch = "primary"
+        else:
+            branch = "fallback"
+        
+        features = self.uncertainty_detector.extract_image_features(pixels)
+        factors = self.uncertainty_detector.evaluate_factors_batch(
+            pixels[None], [self.eczema_probability], [{}], features=[features]
+        )[0]
+        severity_features = self.severity_estimator.extract_image_features(pixels, features)
+        severity = self.severity_estimator.estimate_severity_batch(
+            None, [self.eczema_probability], [{}], features=[severity_features]
+        )[0]
+        return {
+            "decode": "ok",
+            "relevant": is_relevant,
+            "relevance_branch": branch,
+            "skin_percentage": round(measured["skin_percentage"], 1),
+            "image_variance": round(measured["image_variance"], 1),
+            "texture_variance": round(features["texture_variance"], 1),
+            "edge_density": round(features["edge_density"], 4),
+            "redness_ratio": round(features["redness_ratio"], 4),
+            "uncertainty_factors": sorted(reason for reason, _ in factors.visual),
+            "severity_image_score": round(
+                0.3 * severity_features["redness_score"] + 0.2 * severity_features["affected_area_score"]
+                + 0.1 * severity_features["texture_score"], 3
+            ),
+            "severity": severity,
+        }
+
+
+def main(args):
+    output_dir = Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    resolutions = [(spec, parse_resolution(spec, args.aspect)) for spec in args.resolutions.split(",")]
+    
+    print("=" * 60)
+    print(f"SYNTHETIC IMAGES: seed {args.seed} → {output_dir}")
+    print(f"   Profiles: {', '.join(args.profiles)}")
+    print(f"   Formats: {', '.join(args.formats)}")
+    print(f"   Resolutions: {', '.join(f'{w}x{h}' for _, (w, h) in resolutions)}; {args.count} per combination")
+    print("=" * 60)
+    
+    entries = []
+    start = time.perf_counter()
+    for profile in args.profiles:
+        for spec, (width, height) in resolutions:
+            megapixels = width * height / 1e6
+            for index in range(args.count):
+                seed_sequence = item_seed(args.seed, profile, width, height, index)
+                pixels = None
+                for image_format in args.formats:
+                    suffix = "-bomb" if image_format == "png-bomb" else ""
+                    name = f"{profile}-{width}x{height}-{index:03d}{suffix}.{EXTENSIONS[image_format]}"
+                    path = output_dir / name
+                    if image_format == "png-bomb":
+                        size = write_png_bomb(path, width, height, bomb_color(profile, seed_sequence))
+                        content_sha256 = None
+                    else:
+                        if pixels is None:
+                            pixels = generate_pixels(profile, width, height, seed_sequence)
+                        data = encode(pixels, image_format, args.quality)
+                        path.write_bytes(data)
+                        size = len(data)
+                        content_sha256 = hashlib.sha256(pixels.tobytes()).hexdigest()
+                    
+                    entries.append({
+                        "file": name,
+                        "profile": profile,
+                        "format": image_format,
+                        "width": width,
+                        "height": height,
+                        "megapixels": round(megapixels, 2),
+                        "index": index,
+                        "bytes": size,
+                        "sha256": hashlib.sha256(path.read_bytes()).hexdigest(),
+                        "pixels_sha256": content_sha256,
+                    })
+                    print(f"   ✅ {name}  {size / 1024:,.0f} KB")
+    
+    manifest = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "seed": args.seed,
+        "aspect": args.aspect,
+        "quality": args.quality,
+        "versions": {"numpy": np.__version__, "opencv": cv2.__version__, "pillow": PIL.__version__},
+        "images": entries,
+    }
+    
+    failed = 0
+    if args.verify:
+        verifier = Verifier(args.probability)
+        print(f"\n🔎 Detector branches on the canonical decode (eczema probability {args.probability:g})")
+        for entry in entries:
+            entry["verify"] = result = verifier.verify(output_dir / entry["file"])
+            if result["decode"] != "ok":
+                print(f"   {entry['file']:<44} decode {result['decode']}")
+                continue
+            # A bomb is one flat color: only its decode path is of interest
+            ok = entry["format"] == "png-bomb" or result["relevant"] == EXPECTED_RELEVANT[entry["profile"]]
+            failed += not ok
+            print(f"   {'✅' if ok else '❌'} {entry['file']:<44} {result['relevance_branch']:<8} "
+                  f"skin {result['skin_percentage']:>5.1f}%  var {result['image_variance']:>7.1f}  "
+                  f"lbp {result['texture_variance']:>7.1f}  red {result['redness_ratio']:.3f}  "
+                  f"factors {len(result['uncertainty_factors'])}  {result['severity']}")
+        if failed:
+            print(f"\n⚠️  {failed} images did not reach the relevance branch their profile is designed for")
+    
+    manifest_path = output_dir / "manifest.json"
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"\n💾 {len(entries)} images in {time.perf_counter() - start:.1f}s; manifest: {manifest_path}")
+    print("=" * 60)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate deterministic synthetic images for benchmarks")
+    parser.add_argument("--output", default="synthetic-images", help="Output directory")
+    parser.add_argument("--seed", type=int, default=0, help="Generation seed")
+    parser.add_argument("--profiles", nargs="+", choices=PROFILES, default=list(PROFILES), help="Content profiles")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=["jpeg", "png", "webp"], help="Output formats")
+    parser.add_argument("--resolutions", default="0.3,2,12",
+                        help=f"Comma-separated megapixels ({MIN_MEGAPIXELS:g}-{MAX_MEGAPIXELS:g}) or WxH "
+                             "(png-bomb sizes are not limited)")
+    parser.add_argument("--aspect", type=float, default=4 / 3, help="Width / height for megapixel resolutions")
+    parser.add_argument("--count", type=int, default=1, help="Images per profile, resolution and format")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG / WebP quality")
+    parser.add_argument("--verify", action="store_true",
+                        help="Run the relevance, uncertainty and severity heuristics on every image")
+    parser.add_argument("--probability", type=float, default=0.6,
+                        help="Eczema probability assumed for the uncertainty and severity branches with --verify")
+    args = parser.parse_args()
+    try:
+        sizes = [parse_resolution(spec, args.aspect) for spec in args.resolutions.split(",")]
+    except ValueError as e:
+        parser.error(f"--resolutions: {e}")
+    if set(args.formats) - {"png-bomb"}:
+        for width, height in sizes:
+            if not MIN_MEGAPIXELS <= width * height / 1e6 <= MAX_MEGAPIXELS:
+                parser.error(f"{width}x{height} is outside {MIN_MEGAPIXELS:g}-{MAX_MEGAPIXELS:g} MP "
+                             "(only --formats png-bomb accepts any size)")
+    sys.exit(main(args))
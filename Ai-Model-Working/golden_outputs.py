@@ -0,0 +1,385 @@
+"""
+Golden Output Regression Script
+Records the intermediate values of every pipeline stage for a reference image set, then
+diffs any later build or configuration against that record with per-field tolerances,
+so speed work (decode, vectorized heuristics, model backends) cannot silently change outputs
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Add app directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+from app.services.decision_policy import decide
+from app.services.ood_scorer import embedding_mode_requested, load_ood_scorer
+from app.services.relevance_detector import RelevanceDetector
+from app.services.severity_estimator import SeverityEstimator
+from app.services.uncertainty_detector import UncertaintyDetector
+from app.utils.buffer_pool import PlanePool
+from app.utils.image_processor import ImageProcessor, UploadRejected
+
+# Load environment variables
+load_dotenv()
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+# Side of the pixel thumbnail kept per image: a changed decode shows up as a
+# mean absolute difference in gray levels, not only as a different checksum
+THUMBNAIL_SIZE = 8
+
+# Allowed drift per field: a number is an absolute tolerance, "N%" a relative one,
+# "exact" requires equality and "ignore" skips the field
+DEFAULT_TOLERANCES = {
+    "width": "exact",
+    "height": "exact",
+    "pixels_sha256": "exact",
+    "pixels_mad": 1.0,
+    "relevant": "exact",
+    "skin_percentage": 0.5,
+    "relevance_edge_density": 0.005,
+    "image_variance": "1%",
+    "texture_variance": "1%",
+    "edge_density": 0.005,
+    "redness_ratio": 0.005,
+    "redness_score": 0.01,
+    "affected_area_score": 0.01,
+    "texture_score": 0.01,
+    "eczema_probability": 0.005,
+    "uncertainty_weight": "exact",
+    "uncertainty_factors": "exact",
+    "model_state": "exact",
+    "prediction": "exact",
+    "confidence": 0.005,
+    "severity": "exact",
+}
+
+# Settings that change outputs on purpose; a difference is reported before the drift
+CONFIG_ENV = (
+    "MODEL_PATH", "MODEL_INPUT_SIZE", "MODEL_IN_GRAPH_PREPROCESSING", "UNCERTAINTY_MODE",
+    "OOD_REFERENCE_PATH", "HIGH_CONFIDENCE_THRESHOLD", "LOW_CONFIDENCE_THRESHOLD", "MIN_UNCERTAINTY_FACTORS",
+)
+
+
+def find_images(folder: Path):
+    return sorted(p for p in folder.rglob("*") if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def describe_config(model_service, batch: bool) -> dict:
+    """Build and configuration the values were produced with"""
+    import tensorflow as tf
+    return {
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "path": "batch" if batch else "single",
+        "model_sha256": file_sha256(model_service.model_path),
+        "input_size": model_service.input_size,
+        "env": {name: os.getenv(name) for name in CONFIG_ENV if os.getenv(name) is not None},
+        "versions": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "tensorflow": tf.__version__,
+        },
+    }
+
+
+class GoldenRecorder:
+    """Runs the /analyze stages (without Gemini) and keeps every intermediate value"""
+    
+    def __init__(self, model_service):
+        self.model_service = model_service
+        self.image_processor = ImageProcessor(target_size=model_service.input_size)
+        plane_pool = PlanePool()
+        self.relevance_detector = RelevanceDetector(plane_pool=plane_pool)
+        self.uncertainty_detector = UncertaintyDetector(plane_pool=plane_pool, ood_scorer=load_ood_scorer(model_service))
+        self.severity_estimator = SeverityEstimator(plane_pool=plane_pool)
+    
+    def decode(self, path: Path):
+        """(record, pixels) of one file; pixels is None when it does not decode"""
+        record = {"file_sha256": file_sha256(str(path))}
+        try:
+            upload = self.image_processor.decode_upload_sync(path.read_bytes())
+        except UploadRejected as rejected:
+            upload = None
+            record["error"] = rejected.message
+        if upload is None:
+            record.setdefault("error", "Failed to decode image")
+            return record, None
+        
+        pixels = upload.pixels
+        gray = cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY)
+        record.update(
+            width=upload.width,
+            height=upload.height,
+            pixels_sha256=hashlib.sha256(np.ascontiguousarray(pixels).tobytes()).hexdigest(),
+            thumbnail=cv2.resize(gray, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA).ravel().tolist(),
+        )
+        return record, pixels
+    
+    def complete(self, record, relevance, is_relevant, prediction, uncertainty_features, factors, severity_features):
+        """Fill in the measured values and run the decision"""
+        record.update(
+            relevant=is_relevant,
+            skin_percentage=relevance["skin_percentage"],
+            relevance_edge_density=relevance["edge_density"],
+            image_variance=relevance["image_variance"],
+        )
+        if not is_relevant:
+            record["prediction"] = "Normal"
+            return
+        
+        eczema_probability = float(prediction["eczema_probability"])
+        record.update(uncertainty_features or {})
+        record.update(severity_features)
+        # Same decision as /analyze when Gemini gives no verdict
+        decision = decide(
+            eczema_probability,
+            factors.weight,
+            analysis_unavailable=factors.unavailable is not None,
+            thresholds=self.uncertainty_detector.thresholds
+        )
+        record.update(
+            eczema_probability=eczema_probability,
+            uncertainty_weight=factors.weight,
+            uncertainty_factors=sorted(reason for reason, _ in factors.visual),
+            model_state=decision.model_state,
+            prediction=decision.state,
+            confidence=round(decision.confidence, 6),
+            severity=None,
+        )
+        if decision.severity_probability is not None:
+            record["severity"] = self.severity_estimator.estimate_severity_batch(
+                None, [decision.severity_probability], [prediction], features=[severity_features]
+            )[0]
+    
+    async def record_one(self, path: Path) -> dict:
+        """Single-image path (as /analyze)"""
+        record, pixels = self.decode(path)
+        if pixels is None:
+            return record
+        relevance = self.relevance_detector.measure(pixels)
+        is_relevant, _ = self.relevance_detector.check_relevance_sync(pixels)
+        prediction = self.model_service.predict_sync(pixels)
+        eczema_probability = float(prediction["eczema_probability"])
+        uncertainty_features = None if self.uncertainty_detector.uses_embedding else \
+            self.uncertainty_detector.extract_image_features(pixels)
+        factors = await self.uncertainty_detector.evaluate_factors(
+            pixels, eczema_probability, prediction, features=uncertainty_features
+        )
+        severity_features = self.severity_estimator.extract_image_features(pixels, uncertainty_features)
+        self.complete(record, relevance, is_relevant, prediction, uncertainty_features, factors, severity_features)
+        return record
+    
+    def record_batch(self, paths) -> list:
+        """Batched path (as score_folder.py)"""
+        decoded = [self.decode(path) for path in paths]
+        items = [(record, pixels) for record, pixels in decoded if pixels is not None]
+        if not items:
+            return [record for record, _ in decoded]
+        
+        pixels = np.stack([item_pixels for _, item_pixels in items])
+        relevance = self.relevance_detector.measure_batch(pixels)
+        relevant = self.relevance_detector.check_relevance_batch(pixels)
+        predictions = self.model_service.predict_batch_sync(pixels)
+        probabilities = [float(prediction["eczema_probability"]) for prediction in predictions]
+        uncertainty_features = [None] * len(items) if self.uncertainty_detector.uses_embedding else \
+            self.uncertainty_detector.extract_image_features_batch(pixels)
+        factors = self.uncertainty_detector.evaluate_factors_batch(
+            pixels, probabilities, predictions, features=uncertainty_features
+        )
+        severity_features = self.severity_estimator.extract_image_features_batch(
+            pixels, None if self.uncertainty_detector.uses_embedding else uncertainty_features
+        )
+        for index, (record, _) in enumerate(items):
+            self.complete(
+                record, relevance[index], relevant[index][0], predictions[index],
+                uncertainty_features[index], factors[index], severity_features[index]
+            )
+        return [record for record, _ in decoded]
+
+
+async def run_reference_set(args):
+    model_path = os.getenv("MODEL_PATH", "models/eczema_detector_efficientnet.h5")
+    if not os.path.exists(model_path):
+        print(f"❌ Model not found at {model_path} (set MODEL_PATH)")
+        sys.exit(1)
+    paths = find_images(args.images_dir)
+    if not paths:
+        print(f"❌ No images found in {args.images_dir}")
+        sys.exit(1)
+    
+    from app.services.model_service import ModelService
+    model_service = ModelService(model_path, return_embedding=embedding_mode_requested() or None)
+    await model_service.load_model()
+    recorder = GoldenRecorder(model_service)
+    
+    images = {}
+    start = time.perf_counter()
+    if args.batch:
+        for offset in range(0, len(paths), args.batch_size):
+            batch = paths[offset:offset + args.batch_size]
+            for path, record in zip(batch, recorder.record_batch(batch)):
+                images[path.relative_to(args.images_dir).as_posix()] = record
+    else:
+        for path in paths:
+            images[path.relative_to(args.images_dir).as_posix()] = await recorder.record_one(path)
+    elapsed = time.perf_counter() - start
+    return {"config": describe_config(model_service, args.batch), "images": images}, elapsed
+
+
+def parse_tolerance(value):
+    if isinstance(value, (int, float)) or value in ("exact", "ignore") or str(value).endswith("%"):
+        return value
+    return float(value)
+
+
+def field_drift(field: str, reference, current, tolerance):
+    """Drift description of one field, or None when within tolerance"""
+    if tolerance == "ignore" or reference == current:
+        return None
+    if tolerance == "exact" or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (reference, current)):
+        return {"field": field, "reference": reference, "current": current, "tolerance": tolerance}
+    delta = current - reference
+    if isinstance(tolerance, str):
+        allowed = abs(reference) * float(tolerance[:-1]) / 100.0
+    else:
+        allowed = tolerance
+    if abs(delta) <= allowed:
+        return None
+    return {"field": field, "reference": reference, "current": current, "delta": delta, "tolerance": tolerance}
+
+
+def diff_records(reference: dict, current: dict, tolerances: dict) -> list:
+    """Every out-of-tolerance field of one image"""
+    drifts = []
+    if reference.get("thumbnail") is not None and current.get("thumbnail") is not None:
+        mad = float(np.abs(np.array(current["thumbnail"], float) - np.array(reference["thumbnail"], float)).mean())
+        drift = field_drift("pixels_mad", 0.0, mad, tolerances.get("pixels_mad", "exact"))
+        if drift is not None:
+            drifts.append(drift)
+    for field in sorted(set(reference) | set(current)):
+        if field in ("thumbnail", "file_sha256"):
+            continue
+        drift = field_drift(field, reference.get(field), current.get(field), tolerances.get(field, "exact"))
+        if drift is not None:
+            drifts.append(drift)
+    return drifts
+
+
+def format_value(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    if isinstance(value, str) and len(value) == 64:
+        return value[:12] + "…"
+    return str(value)
+
+
+def print_report(reference: dict, current: dict, tolerances: dict) -> int:
+    """Readable drift report; returns the number of drifted images"""
+    config_changes = {
+        key: (reference["config"].get(key), current["config"].get(key))
+        for key in ("path", "model_sha256", "input_size", "env", "versions")
+        if reference["config"].get(key) != current["config"].get(key)
+    }
+    if config_changes:
+        print("\n⚙️  Configuration differs from the reference:")
+        for key, (before, after) in config_changes.items():
+            print(f"   {key}: {format_value(before)} → {format_value(after)}")
+    
+    reference_images, current_images = reference["images"], current["images"]
+    missing = sorted(set(reference_images) - set(current_images))
+    added = sorted(set(current_images) - set(reference_images))
+    
+    drifted = {}
+    field_counts = {}
+    for name in sorted(set(reference_images) & set(current_images)):
+        drifts = diff_records(reference_images[name], current_images[name], tolerances)
+        if drifts:
+            drifted[name] = drifts
+            for drift in drifts:
+                field_counts[drift["field"]] = field_counts.get(drift["field"], 0) + 1
+    
+    compared = len(set(reference_images) & set(current_images))
+    print(f"\n📊 {compared} images compared, {len(drifted)} drifted"
+          + (f", {len(missing)} missing" if missing else "") + (f", {len(added)} new" if added else ""))
+    if field_counts:
+        print("\n   Field                      Images  Tolerance")
+        for field, count in sorted(field_counts.items(), key=lambda item: -item[1]):
+            print(f"   {field:<26} {count:>6}  {tolerances.get(field, 'exact')}")
+    for name, drifts in drifted.items():
+        print(f"\n❌ {name}")
+        for drift in drifts:
+            delta = f"  (Δ {drift['delta']:+.6g})" if "delta" in drift else ""
+            print(f"   {drift['field']}: {format_value(drift['reference'])} → {format_value(drift['current'])}{delta}")
+    for name in missing:
+        print(f"\n⚠️  {name}: in the reference but not in the image set")
+    
+    return len(drifted) + len(missing)
+
+
+async def main(args):
+    tolerances = dict(DEFAULT_TOLERANCES)
+    for name, value in args.tolerance:
+        tolerances[name] = parse_tolerance(value)
+    
+    print("=" * 60)
+    print(f"GOLDEN OUTPUTS: {args.command} ({'batch' if args.batch else 'single-image'} path)")
+    print("=" * 60)
+    
+    result, elapsed = await run_reference_set(args)
+    print(f"🖼️  {len(result['images'])} images processed in {elapsed:.2f}s")
+    
+    if args.command == "record":
+        args.reference.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.reference, "w") as f:
+            json.dump(result, f, indent=1)
+        print(f"✅ Reference written to {args.reference}")
+        return 0
+    
+    if not args.reference.exists():
+        print(f"❌ No reference at {args.reference}; run the record command first")
+        return 1
+    with open(args.reference) as f:
+        reference = json.load(f)
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(result, f, indent=1)
+    
+    problems = print_report(reference, result, tolerances)
+    print("=" * 60)
+    print("✅ No drift beyond tolerances" if problems == 0 else f"❌ Drift in {problems} image(s)")
+    return 0 if problems == 0 else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record or check golden per-image pipeline outputs")
+    parser.add_argument("command", choices=["record", "check"], help="record a reference, or check against it")
+    parser.add_argument("images_dir", type=Path, nargs="?", default=Path("testing-images"), help="Reference image set")
+    parser.add_argument("--reference", type=Path, default=Path("golden/reference.json"), help="Reference file")
+    parser.add_argument("--batch", action="store_true", help="Use the batched (score_folder.py) path")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per batch with --batch")
+    parser.add_argument("--tolerance", type=lambda text: tuple(text.split("=", 1)), action="append", default=[],
+                        metavar="FIELD=VALUE", help="Override a tolerance: number, N%%, exact or ignore (repeatable)")
+    parser.add_argument("--report", type=Path, default=None, help="Also write the current values (JSON) here")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args)))
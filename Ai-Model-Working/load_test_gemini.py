@@ -0,0 +1,175 @@
+"""
+Gemini Load / Fault Test Script
+Drives LLMService against fake_gemini_server.py (started in-process) with injected
+latency and faults, and reports how the retry, fallback and parse paths and the
+Gemini override decision behave. No API key or network access is needed.
+Runs are deterministic for a given seed: --repeat checks that they replay identically
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# Add app directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+from app.services.decision_policy import decide
+from app.services.llm_service import LLMService
+from app.utils.image_processor import ImageProcessor
+from fake_gemini_server import FAULT_KINDS, BackgroundServer, add_fault_arguments, config_from_args, create_app
+
+# Load environment variables
+load_dotenv()
+
+TEST_IMAGES_DIR = "testing-images"
+
+# Model probabilities cycled over the calls: confident, borderline and ambiguous
+# decisions, so every override and fallback branch is reached
+MODEL_PROBABILITIES = (0.05, 0.18, 0.25, 0.30, 0.38, 0.60, 0.92)
+
+
+def build_uploads(count: int):
+    """
+    One upload per call, each a distinct variant of a test image (the first pixel
+    row is recoloured), so every call has its own fault stream in the fake server
+    """
+    image_processor = ImageProcessor()
+    sources = sorted(
+        p for p in Path(TEST_IMAGES_DIR).iterdir()
+        if p.suffix.lower() in {".jpg", ".jpeg", ".png", ".webp"}
+    )
+    images = [np.asarray(Image.open(path).convert("RGB")) for path in sources]
+    uploads = []
+    for index in range(count):
+        pixels = images[index % len(images)].copy()
+        pixels[0, :, :] = (index % 256, index // 256 % 256, 128)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="PNG")
+        uploads.append(image_processor.decode_upload_sync(buffer.getvalue()))
+    return uploads
+
+
+async def run_call(llm_service: LLMService, upload, eczema_probability: float, mode: str, semaphore):
+    """One Gemini call as /analyze makes it; returns its outcome record"""
+    async with semaphore:
+        start = time.perf_counter()
+        if mode == "speculative":
+            explanation, assessment, confidence = await llm_service.assess_image(upload)
+        else:
+            model_decision = decide(eczema_probability, gemini_skipped=True)
+            explanation, assessment, confidence = await llm_service.generate_explanation(
+                eczema_probability, model_decision.state, upload=upload
+            )
+        elapsed = time.perf_counter() - start
+    
+    decision = decide(
+        eczema_probability,
+        gemini_assessment=assessment,
+        gemini_confidence=confidence
+    )
+    if explanation is None:
+        outcome = "failed"
+    elif assessment is None and confidence is None:
+        outcome = "no_verdict"
+    else:
+        outcome = "verdict"
+    return {
+        "outcome": outcome,
+        "assessment": assessment,
+        "confidence": confidence,
+        "state": decision.state,
+        "reason": decision.reason,
+        "latency": elapsed,
+    }
+
+
+async def run_scenario(args, config, script, uploads):
+    app = create_app(config, script)
+    with BackgroundServer(app) as base_url:
+        llm_service = LLMService(api_key="fake-key", model_name=args.model, base_url=base_url)
+        llm_service.retry_delay = args.retry_delay
+        semaphore = asyncio.Semaphore(args.concurrency)
+        
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        start = time.perf_counter()
+        with quiet:
+            results = await asyncio.gather(*[
+                run_call(llm_service, upload, MODEL_PROBABILITIES[index % len(MODEL_PROBABILITIES)], args.mode, semaphore)
+                for index, upload in enumerate(uploads)
+            ])
+        elapsed = time.perf_counter() - start
+    return results, elapsed, dict(app.state.fake.stats)
+
+
+def print_summary(results, elapsed: float, fake_stats: dict):
+    latencies = np.array([result["latency"] for result in results]) * 1000.0
+    print(f"\n⏱️  {len(results)} calls in {elapsed:.2f}s ({len(results) / max(elapsed, 1e-9):.1f} calls/s)")
+    print(f"   Latency p50 {np.percentile(latencies, 50):.0f}ms  p95 {np.percentile(latencies, 95):.0f}ms  "
+          f"max {latencies.max():.0f}ms")
+    
+    print("\n📡 Fake server responses")
+    print("   " + "  ".join(f"{key} {fake_stats.get(key, 0)}" for key in ("requests", "vision", "text", "scripted")))
+    print("   " + "  ".join(f"{kind} {fake_stats.get(kind, 0)}" for kind in ("ok",) + FAULT_KINDS))
+    retried = fake_stats.get("vision", 0) - len(results)
+    print(f"   Vision requests beyond one per call (retries): {max(retried, 0)}")
+    
+    print("\n🔎 Call outcomes (verdict: parsed from JSON or prose; no_verdict: fallback text)")
+    print("   " + "  ".join(f"{name} {count}" for name, count in sorted(Counter(r["outcome"] for r in results).items())))
+    print("\n🎯 Decisions with Gemini's verdict")
+    print("   " + "  ".join(f"{name} {count}" for name, count in sorted(Counter(r["state"] for r in results).items())))
+    print("   " + "  ".join(f"{name} {count}" for name, count in sorted(Counter(r["reason"] for r in results).items())))
+
+
+async def main(args):
+    config, script = config_from_args(args)
+    print("=" * 60)
+    print(f"GEMINI LOAD TEST: {args.requests} {args.mode} calls, concurrency {args.concurrency}")
+    print(f"   Latency {config.latency}; faults: " + ", ".join(f"{kind} {config.rate(kind):.0%}" for kind in FAULT_KINDS))
+    print("=" * 60)
+    
+    uploads = build_uploads(args.requests)
+    runs = []
+    for run in range(args.repeat):
+        results, elapsed, fake_stats = await run_scenario(args, config, script, uploads)
+        runs.append(results)
+        if run == 0:
+            print_summary(results, elapsed, fake_stats)
+    
+    if args.repeat > 1:
+        keys = ("outcome", "assessment", "confidence", "state", "reason")
+        differing = [
+            index for index in range(len(runs[0]))
+            if any(tuple(run[index][key] for key in keys) != tuple(runs[0][index][key] for key in keys) for run in runs[1:])
+        ]
+        print(f"\n🔁 {args.repeat} runs: " + ("identical outcomes" if not differing
+                                              else f"{len(differing)} calls differ (first: {differing[:10]})"))
+        if differing:
+            return 1
+    print("=" * 60)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load and fault test LLMService against a local fake Gemini")
+    parser.add_argument("--requests", type=int, default=200, help="Gemini calls to make")
+    parser.add_argument("--concurrency", type=int, default=32, help="Calls in flight at once")
+    parser.add_argument("--mode", choices=["analyze", "speculative"], default="analyze",
+                        help="analyze: generate_explanation with vision (text fallback); speculative: assess_image")
+    parser.add_argument("--model", default="gemini-1.5-pro", help="Model name sent in the URL")
+    parser.add_argument("--retry-delay", type=float, default=0.05, help="First 503 retry delay in seconds")
+    parser.add_argument("--repeat", type=int, default=1, help="Run the scenario N times and compare the outcomes")
+    parser.add_argument("--verbose", action="store_true", help="Keep LLMService's per-call logging")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,135 @@
+"""
+Decision Replay Script
+Re-evaluates logged /analyze decisions (DECISION_LOG_PATH) under candidate thresholds,
+without re-running the model or Gemini, and reports how the predictions would shift
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+
+# Add app directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+from app.services.decision_log import read_decision_log
+from app.services.decision_policy import PREDICTION_STATES, DecisionThresholds, decide_batch, decision_summary
+
+# Load environment variables
+load_dotenv()
+
+# Decisions evaluated per decide_batch call (bounds the temporary arrays)
+REPLAY_CHUNK = 1_000_000
+
+
+def parse_assignment(text: str):
+    name, _, value = text.partition("=")
+    if name not in DecisionThresholds.__dataclass_fields__ or not value:
+        valid = ", ".join(DecisionThresholds.__dataclass_fields__)
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE with NAME one of: {valid}")
+    return name, value
+
+
+def replay(records: np.ndarray, thresholds: DecisionThresholds) -> np.ndarray:
+    """Final state code of every logged decision under thresholds"""
+    states = np.empty(len(records), dtype=np.int8)
+    for start in range(0, len(records), REPLAY_CHUNK):
+        chunk = records[start:start + REPLAY_CHUNK]
+        states[start:start + len(chunk)] = decide_batch(
+            chunk["probability"],
+            chunk["visual_weight"],
+            chunk["gemini_assessment"],
+            chunk["gemini_confidence"],
+            chunk["gemini_skipped"],
+            chunk["analysis_unavailable"],
+            thresholds
+        )["state"]
+    return states
+
+
+def format_distribution(states: np.ndarray) -> str:
+    counts = decision_summary(states)
+    total = max(len(states), 1)
+    return "  ".join(f"{name} {count} ({count / total:.1%})" for name, count in counts.items())
+
+
+def print_transitions(before: np.ndarray, after: np.ndarray):
+    """Matrix of logged state (rows) against replayed state (columns)"""
+    size = len(PREDICTION_STATES)
+    matrix = np.bincount(before.astype(np.int64) * size + after, minlength=size * size).reshape(size, size)
+    print(f"   {'logged → replayed':<18}" + "".join(f"{name:>12}" for name in PREDICTION_STATES))
+    for name, row in zip(PREDICTION_STATES, matrix):
+        print(f"   {name:<18}" + "".join(f"{count:>12}" for count in row))
+
+
+def main(args):
+    parts = [read_decision_log(path) for path in args.logs]
+    records = np.concatenate(parts) if len(parts) > 1 else parts[0]
+    if args.since is not None:
+        records = records[records["time"] >= args.since]
+    if len(records) == 0:
+        print("❌ No decisions to replay")
+        return
+    logged = np.asarray(records["state"])
+    
+    print("=" * 60)
+    print(f"DECISION REPLAY: {len(records)} decisions from {len(args.logs)} log(s)")
+    print(f"   {time.strftime('%Y-%m-%d %H:%M', time.localtime(records['time'].min()))} → "
+          f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(records['time'].max()))}")
+    print("=" * 60)
+    print(f"\n📋 Logged:   {format_distribution(logged)}")
+    
+    # Current configuration: decisions logged under it should replay unchanged
+    current = DecisionThresholds.from_env()
+    start = time.perf_counter()
+    replayed = replay(records, current)
+    elapsed = time.perf_counter() - start
+    mismatched = int((replayed != logged).sum())
+    print(f"🔁 Current thresholds replay: {len(records) - mismatched}/{len(records)} identical "
+          f"({elapsed:.2f}s, {len(records) / max(elapsed, 1e-9):,.0f} decisions/s)")
+    if mismatched:
+        print("⚠️  Some decisions were logged under other thresholds (or before a policy change)")
+    
+    candidate = current.replace(**{name: float(value) for name, value in args.set})
+    sweeps = [(name, [float(v) for v in values.split(",")]) for name, values in args.sweep]
+    
+    if not sweeps:
+        states = replay(records, candidate)
+        changes = {name: value for name, value in candidate.as_dict().items() if value != current.as_dict()[name]}
+        print(f"\n🧪 Candidate: {changes or 'same as current'}")
+        print(f"   {format_distribution(states)}")
+        print(f"   Changed vs logged: {int((states != logged).sum())} ({(states != logged).mean():.2%})\n")
+        print_transitions(logged, states)
+        print("=" * 60)
+        return
+    
+    # Grid over the swept thresholds (on top of --set)
+    names = [name for name, _ in sweeps]
+    header = "".join(f"{name:>24}" for name in names)
+    print(f"\n🧪 Sweep ({np.prod([len(values) for _, values in sweeps])} combinations)\n")
+    print(f"{header}" + "".join(f"{name:>11}" for name in PREDICTION_STATES) + f"{'changed':>10}")
+    for combination in itertools.product(*[values for _, values in sweeps]):
+        states = replay(records, candidate.replace(**dict(zip(names, combination))))
+        shares = np.bincount(states, minlength=len(PREDICTION_STATES)) / len(states)
+        print("".join(f"{value:>24g}" for value in combination)
+              + "".join(f"{share:>11.2%}" for share in shares)
+              + f"{(states != logged).mean():>10.2%}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay logged decisions under candidate thresholds")
+    parser.add_argument("logs", nargs="*", default=[os.getenv("DECISION_LOG_PATH", "logs/decisions.bin")],
+                        help="Decision log file(s) (default: DECISION_LOG_PATH)")
+    parser.add_argument("--set", type=parse_assignment, action="append", default=[], metavar="NAME=VALUE",
+                        help="Candidate threshold, e.g. high_confidence=0.4 (repeatable)")
+    parser.add_argument("--sweep", type=parse_assignment, action="append", default=[], metavar="NAME=V1,V2,...",
+                        help="Threshold values to sweep over (repeatable; all combinations are replayed)")
+    parser.add_argument("--since", type=float, default=None, help="Only decisions after this epoch time")
+    args = parser.parse_args()
+    main(args)
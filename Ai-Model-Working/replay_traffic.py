@@ -0,0 +1,234 @@
+"""
+Traffic Replay Script
+Re-drives a captured /analyze workload (TRAFFIC_CAPTURE_PATH) against a running service,
+keeping the recorded inter-arrival times (optionally N times faster), and reports
+latency against the capture or against an earlier replay of another build
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import requests
+from PIL import Image
+
+# Add app directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+TEST_IMAGES_DIR = "testing-images"
+PIL_FORMATS = {"JPEG": "JPEG", "PNG": "PNG", "WEBP": "WEBP", "BMP": "BMP"}
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "BMP": "image/bmp"}
+
+# Megapixel buckets of the per-size latency table
+SIZE_BUCKETS = ((0, 0.5), (0.5, 2), (2, 8), (8, 24), (24, float("inf")))
+
+
+def load_capture(path: str, since=None, limit=None):
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Torn last line of a running capture
+            if since is not None and record["t"] < since:
+                continue
+            records.append(record)
+    records.sort(key=lambda record: record["t"])
+    return records[:limit] if limit else records
+
+
+class PayloadSource:
+    """
+    Upload bytes per capture record: the kept image when the request consented,
+    otherwise a stand-in of the recorded format and dimensions (built from a test
+    image, so decode and heuristic cost scale like the original upload)
+    """
+    
+    def __init__(self, images_dir):
+        self.images_dir = Path(images_dir) if images_dir else None
+        self.sources = [
+            Image.open(path).convert("RGB") for path in sorted(Path(TEST_IMAGES_DIR).iterdir())
+            if path.suffix.lower() in {".jpg", ".jpeg", ".png", ".webp"}
+        ]
+        self._cache = {}
+        self.stats = {"kept": 0, "stand_in": 0, "skipped": 0}
+    
+    def payload(self, index: int, record):
+        """(bytes, mime type), or None when the record cannot be reproduced"""
+        if record.get("image_kept") and self.images_dir is not None:
+            path = self.images_dir / record["sha256"]
+            if path.exists():
+                self.stats["kept"] += 1
+                return path.read_bytes(), MIME_TYPES.get(record.get("format"), "image/jpeg")
+        if not record.get("width") or not record.get("height"):
+            # Rejected before decoding (e.g. 413): nothing to rebuild
+            self.stats["skipped"] += 1
+            return None
+        
+        image_format = PIL_FORMATS.get(record.get("format"), "JPEG")
+        key = (record["width"], record["height"], image_format, index % len(self.sources))
+        if key not in self._cache:
+            source = self.sources[index % len(self.sources)]
+            stand_in = source.resize((record["width"], record["height"]), Image.Resampling.BILINEAR)
+            buffer = io.BytesIO()
+            stand_in.save(buffer, format=image_format, **({"quality": 90} if image_format in ("JPEG", "WEBP") else {}))
+            self._cache[key] = buffer.getvalue()
+        self.stats["stand_in"] += 1
+        return self._cache[key], MIME_TYPES[image_format]
+
+
+def post_analyze(url: str, payload, timeout: float):
+    data, mime_type = payload
+    start = time.perf_counter()
+    try:
+        response = requests.post(f"{url}/analyze", files={"file": ("replay", data, mime_type)}, timeout=timeout)
+        status = response.status_code
+    except requests.exceptions.RequestException as e:
+        status = type(e).__name__
+    return status, (time.perf_counter() - start) * 1000.0
+
+
+async def replay(args, records, payloads):
+    """Send every request at its recorded offset / speed; returns one result per record"""
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=args.max_in_flight)
+    results = [None] * len(records)
+    t0 = records[0]["t"]
+    start = time.perf_counter()
+    
+    async def send(index, record, payload):
+        due = (record["t"] - t0) / args.speed
+        await asyncio.sleep(max(due - (time.perf_counter() - start), 0))
+        lag_ms = max((time.perf_counter() - start) - due, 0) * 1000.0
+        status, latency_ms = await loop.run_in_executor(pool, post_analyze, args.url, payload, args.timeout)
+        results[index] = {"index": index, "status": status, "latency_ms": round(latency_ms, 1), "lag_ms": round(lag_ms, 1)}
+    
+    tasks = [
+        send(index, record, payload)
+        for index, (record, payload) in enumerate(zip(records, payloads)) if payload is not None
+    ]
+    await asyncio.gather(*tasks)
+    pool.shutdown()
+    return results, time.perf_counter() - start
+
+
+def percentiles(values):
+    if len(values) == 0:
+        return None
+    return {name: float(np.percentile(values, q)) for name, q in (("p50", 50), ("p90", 90), ("p95", 95), ("p99", 99))}
+
+
+def print_comparison(title: str, current, baseline):
+    """Percentile table of current vs baseline latencies (ms)"""
+    current_p, baseline_p = percentiles(current), percentiles(baseline)
+    print(f"\n📊 {title}")
+    if current_p is None or baseline_p is None:
+        print("   (no successful requests to compare)")
+        return
+    print(f"   {'':<6}{'baseline':>12}{'current':>12}{'delta':>12}{'change':>9}")
+    for name in current_p:
+        delta = current_p[name] - baseline_p[name]
+        change = delta / baseline_p[name] if baseline_p[name] else 0.0
+        print(f"   {name:<6}{baseline_p[name]:>12.1f}{current_p[name]:>12.1f}{delta:>+12.1f}{change:>+9.1%}")
+
+
+def main(args):
+    records = load_capture(args.capture, since=args.since, limit=args.limit)
+    if not records:
+        print(f"❌ No captured requests in {args.capture}")
+        sys.exit(1)
+    payload_source = PayloadSource(args.images_dir)
+    payloads = [payload_source.payload(index, record) for index, record in enumerate(records)]
+    span = records[-1]["t"] - records[0]["t"]
+    sample_rates = {record.get("sample_rate", 1) for record in records}
+    
+    print("=" * 60)
+    print(f"TRAFFIC REPLAY: {len(records)} requests over {span:.0f}s at {args.speed:g}x → {args.url}")
+    print(f"   Payloads: {payload_source.stats['kept']} kept images, {payload_source.stats['stand_in']} stand-ins, "
+          f"{payload_source.stats['skipped']} not reproducible (rejected before decode)")
+    if sample_rates != {1}:
+        print(f"   Captured at 1 in {', '.join(str(rate) for rate in sorted(sample_rates))} requests: "
+              "use --speed to restore the full arrival rate")
+    print("=" * 60)
+    
+    try:
+        requests.get(f"{args.url}/health", timeout=5).raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Service not reachable at {args.url}: {e}")
+        sys.exit(1)
+    
+    results, elapsed = asyncio.run(replay(args, records, payloads))
+    sent = [result for result in results if result is not None]
+    ok = [result for result in sent if result["status"] == 200]
+    statuses = {}
+    for result in sent:
+        statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+    lags = np.array([result["lag_ms"] for result in sent])
+    
+    print(f"\n⏱️  {len(sent)} requests in {elapsed:.1f}s ({len(sent) / max(elapsed, 1e-9):.2f} req/s)")
+    print("   Status: " + "  ".join(f"{status} {count}" for status, count in sorted(statuses.items())))
+    print(f"   Send lag behind schedule: p50 {np.percentile(lags, 50):.0f}ms  max {lags.max():.0f}ms"
+          + ("  ⚠️ raise --max-in-flight" if lags.max() > 1000 else ""))
+    
+    # Against the capture: server-side handler time of the captured build
+    captured = np.array([records[r["index"]]["latency_ms"] for r in ok if records[r["index"]]["status"] == 200])
+    replayed = np.array([r["latency_ms"] for r in ok if records[r["index"]]["status"] == 200])
+    print_comparison("Latency vs capture (ms; captured values are server time, replayed are client time)",
+                     replayed, captured)
+    
+    print("\n📐 By image size (p50 ms, replayed vs captured)")
+    megapixels = np.array([records[r["index"]]["width"] * records[r["index"]]["height"] / 1e6
+                           for r in ok if records[r["index"]]["status"] == 200])
+    for low, high in SIZE_BUCKETS:
+        in_bucket = (megapixels >= low) & (megapixels < high)
+        if in_bucket.any():
+            print(f"   {low:>4g}-{high:<4g} MP  n={int(in_bucket.sum()):<5} "
+                  f"{np.median(replayed[in_bucket]):>9.1f} vs {np.median(captured[in_bucket]):>9.1f}")
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {row["index"]: row for row in map(json.loads, f)}
+        pairs = [(r["latency_ms"], baseline[r["index"]]["latency_ms"]) for r in ok
+                 if r["index"] in baseline and baseline[r["index"]]["status"] == 200]
+        print_comparison(f"Latency vs baseline replay {args.baseline} ({len(pairs)} paired requests)",
+                         np.array([pair[0] for pair in pairs]), np.array([pair[1] for pair in pairs]))
+    
+    if args.output:
+        with open(args.output, "w") as f:
+            for result in sent:
+                f.write(json.dumps(result) + "\n")
+        print(f"\n💾 Per-request results written to {args.output} (use as --baseline for the next build)")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captured /analyze traffic against a service instance")
+    parser.add_argument("capture", nargs="?", default=os.getenv("TRAFFIC_CAPTURE_PATH", "logs/traffic.jsonl"),
+                        help="Capture file (default: TRAFFIC_CAPTURE_PATH)")
+    parser.add_argument("--url", default="http://localhost:8000", help="Service base URL")
+    parser.add_argument("--speed", type=float, default=1.0, help="Time scale: 2 replays twice as fast")
+    parser.add_argument("--images-dir", default=os.getenv("TRAFFIC_CAPTURE_IMAGES_DIR"),
+                        help="Kept images of consenting requests (default: TRAFFIC_CAPTURE_IMAGES_DIR)")
+    parser.add_argument("--since", type=float, default=None, help="Only requests after this epoch time")
+    parser.add_argument("--limit", type=int, default=None, help="Replay only the first N requests")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="Concurrent requests allowed")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--output", default=None, help="Write per-request results (JSON lines)")
+    parser.add_argument("--baseline", default=None, help="Results of an earlier replay to compare with")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+    main(args)
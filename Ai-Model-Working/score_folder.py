@@ -0,0 +1,444 @@
+"""
+Bulk Scoring Script
+Scores a folder of images offline: parallel decode, batched heuristics and model
+inference, and optional rate-limited Gemini, streamed to resumable JSONL or Parquet
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+# Add app directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+from app.services.decision_policy import DECISION_REASONS, PREDICTION_STATES, decide_batch
+from app.services.ood_scorer import embedding_mode_requested, load_ood_scorer
+from app.services.relevance_detector import RelevanceDetector
+from app.services.severity_estimator import SeverityEstimator
+from app.services.uncertainty_detector import UncertaintyDetector
+from app.utils.buffer_pool import PlanePool
+from app.utils.image_processor import ImageProcessor, UploadRejected
+
+# Load environment variables
+load_dotenv()
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+# Output columns (Parquet needs a fixed schema; JSONL rows use the same keys)
+RESULT_COLUMNS = [
+    ("path", "string"),
+    ("sha256", "string"),
+    ("width", "int64"),
+    ("height", "int64"),
+    ("status", "string"),
+    ("error", "string"),
+    ("relevant", "bool_"),
+    ("relevance_reason", "string"),
+    ("eczema_probability", "float64"),
+    ("prediction", "string"),
+    ("confidence", "float64"),
+    ("severity", "string"),
+    ("uncertainty_reason", "string"),
+    ("gemini_assessment", "bool_"),
+    ("gemini_confidence", "float64"),
+]
+
+
+def log(message: str):
+    """Progress goes to stderr so it stays visible when service logs are silenced"""
+    print(message, file=sys.stderr, flush=True)
+
+
+class JsonlSink:
+    """Append-only JSONL output; the file itself is the checkpoint"""
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+    
+    def completed(self) -> set:
+        if not self.path.exists():
+            return set()
+        
+        done = set()
+        valid_bytes = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Partial line from an interrupted write
+                try:
+                    done.add(json.loads(line)["path"])
+                except (ValueError, KeyError):
+                    break
+                valid_bytes += len(line)
+        
+        # Drop anything after the last complete row before appending
+        if valid_bytes < self.path.stat().st_size:
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_bytes)
+        return done
+    
+    def write(self, rows):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        for row in rows:
+            self._file.write(json.dumps(row) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParquetSink:
+    """
+    Parquet output as a directory of part files (Parquet files cannot be appended to)
+    
+    Rows are buffered and written as one part per rows_per_part; each part is
+    written to a temporary name and renamed, so a crash never leaves a partial part.
+    """
+    
+    def __init__(self, path: Path, rows_per_part: int = 1000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            print("❌ Parquet output requires pyarrow (pip install pyarrow)")
+            sys.exit(1)
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        self.rows_per_part = rows_per_part
+        self.schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in RESULT_COLUMNS])
+        self._buffer = []
+    
+    def completed(self) -> set:
+        if not self.path.exists():
+            return set()
+        for leftover in self.path.glob("*.tmp"):
+            leftover.unlink()
+        done = set()
+        for part in sorted(self.path.glob("part-*.parquet")):
+            done.update(self.pq.read_table(part, columns=["path"]).column("path").to_pylist())
+        return done
+    
+    def write(self, rows):
+        self._buffer.extend(rows)
+        if len(self._buffer) >= self.rows_per_part:
+            self._flush()
+    
+    def close(self):
+        self._flush()
+    
+    def _flush(self):
+        if not self._buffer:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        part = self.path / f"part-{time.time_ns()}.parquet"
+        tmp = part.with_suffix(".tmp")
+        self.pq.write_table(self.pa.Table.from_pylist(self._buffer, schema=self.schema), tmp)
+        os.replace(tmp, part)
+        self._buffer = []
+
+
+class RateLimiter:
+    """Spaces calls out to at most `rate` per second"""
+    
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+    
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.interval
+
+
+class Progress:
+    """Periodic throughput report (overall and over the last interval)"""
+    
+    def __init__(self, total: int, interval: float):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.errors = 0
+        self.start = time.perf_counter()
+        self._last_time = self.start
+        self._last_done = 0
+    
+    def update(self, rows):
+        self.done += len(rows)
+        self.errors += sum(1 for row in rows if row["status"] != "ok")
+        if time.perf_counter() - self._last_time >= self.interval:
+            self.report()
+    
+    def report(self, final: bool = False):
+        now = time.perf_counter()
+        elapsed = max(now - self.start, 1e-9)
+        rate = self.done / elapsed
+        recent = (self.done - self._last_done) / max(now - self._last_time, 1e-9)
+        remaining = (self.total - self.done) / rate if rate > 0 else float("inf")
+        percent = 100.0 * self.done / self.total if self.total else 100.0
+        label = "✅ Done" if final else "📈"
+        log(
+            f"{label} {self.done}/{self.total} ({percent:.1f}%) | {rate:.1f} img/s "
+            f"(recent {recent:.1f}) | errors {self.errors} | "
+            + (f"elapsed {elapsed:.0f}s" if final else f"ETA {remaining:.0f}s")
+        )
+        self._last_time = now
+        self._last_done = self.done
+
+
+def find_images(root: Path, recursive: bool):
+    pattern = "**/*" if recursive else "*"
+    return sorted(p for p in root.glob(pattern) if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def empty_row(rel_path: str) -> dict:
+    return {name: None for name, _ in RESULT_COLUMNS} | {"path": rel_path}
+
+
+class BulkScorer:
+    """Runs the /analyze stages over batches of files"""
+    
+    def __init__(self, args, model_service, llm_service):
+        self.args = args
+        self.model_service = model_service
+        self.llm_service = llm_service
+        self.limiter = RateLimiter(args.gemini_rate) if llm_service is not None else None
+        
+        self.image_processor = ImageProcessor(target_size=model_service.input_size)
+        plane_pool = PlanePool()
+        self.relevance_detector = RelevanceDetector(plane_pool=plane_pool)
+        self.uncertainty_detector = UncertaintyDetector(plane_pool=plane_pool, ood_scorer=load_ood_scorer(model_service))
+        self.severity_estimator = SeverityEstimator(plane_pool=plane_pool)
+        self.pool = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="score")
+    
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+    
+    def submit_decode(self, batch):
+        return [self.pool.submit(self._decode_one, path) for path in batch]
+    
+    def _decode_one(self, path: Path):
+        row = empty_row(path.relative_to(self.args.input_dir).as_posix())
+        try:
+            upload = self.image_processor.decode_upload_sync(path.read_bytes())
+        except UploadRejected as rejected:
+            upload = None
+            row["error"] = rejected.message
+        except OSError as e:
+            upload = None
+            row["error"] = f"Read failed: {e}"
+        
+        if upload is None:
+            row["status"] = "error"
+            row["error"] = row["error"] or "Failed to decode image"
+            return row, None
+        
+        if self.llm_service is None:
+            upload.release_image()  # Full-resolution decode only needed for Gemini
+        row.update(sha256=upload.sha256, width=upload.width, height=upload.height, status="ok")
+        return row, upload
+    
+    def _image_features(self, pixels: np.ndarray):
+        """Image-only uncertainty/severity features for the relevant images (one batched pass each)"""
+        if self.uncertainty_detector.uses_embedding:
+            uncertainty_features = None  # Scored from the model embedding instead
+        else:
+            uncertainty_features = self.uncertainty_detector.extract_image_features_batch(pixels)
+        severity_features = self.severity_estimator.extract_image_features_batch(pixels, uncertainty_features)
+        return uncertainty_features, severity_features
+    
+    async def score_batch(self, decoded):
+        loop = asyncio.get_running_loop()
+        rows = [row for row, _ in decoded]
+        items = [(row, upload) for row, upload in decoded if upload is not None]
+        if not items:
+            return rows
+        
+        pixels = np.stack([upload.pixels for _, upload in items])
+        relevance = await loop.run_in_executor(self.pool, self.relevance_detector.check_relevance_batch, pixels)
+        
+        relevant = []
+        for index, ((row, upload), (is_relevant, reason)) in enumerate(zip(items, relevance)):
+            row["relevant"], row["relevance_reason"] = is_relevant, reason
+            if is_relevant:
+                relevant.append(index)
+            else:
+                # Same response as /analyze for non-skin images
+                row.update(prediction="Normal", confidence=0.0)
+        
+        if relevant:
+            relevant_pixels = pixels[relevant]
+            # Heuristic features and inference are independent: run them side by side
+            (uncertainty_features, severity_features), predictions = await asyncio.gather(
+                loop.run_in_executor(self.pool, self._image_features, relevant_pixels),
+                loop.run_in_executor(self.pool, self.model_service.predict_batch_sync, relevant_pixels)
+            )
+            self._decide(
+                [items[index][0] for index in relevant], relevant_pixels,
+                predictions, uncertainty_features, severity_features
+            )
+        
+        if self.llm_service is not None:
+            await asyncio.gather(*[self._assess(*items[index]) for index in relevant])
+        
+        return rows
+    
+    def _decide(self, rows, pixels, predictions, uncertainty_features, severity_features):
+        """Model-side decision (STEP 4-6 of /analyze; the Gemini override is not applied)"""
+        probabilities = [float(prediction["eczema_probability"]) for prediction in predictions]
+        factors = self.uncertainty_detector.evaluate_factors_batch(
+            pixels, probabilities, predictions, features=uncertainty_features
+        )
+        decisions = decide_batch(
+            np.array(probabilities),
+            np.array([item.weight for item in factors]),
+            analysis_unavailable=np.array([item.unavailable is not None for item in factors]),
+            thresholds=self.uncertainty_detector.thresholds
+        )
+        
+        eczema = []
+        for index, (row, eczema_probability, item_factors) in enumerate(zip(rows, probabilities, factors)):
+            prediction_state = PREDICTION_STATES[decisions["model_state"][index]]
+            reason = DECISION_REASONS[decisions["reason"][index]]
+            uncertainty_reason = None
+            if reason == "ambiguous_range":
+                uncertainty_reason = "Confidence falls in ambiguous range between high and low thresholds."
+            elif prediction_state == "Uncertain":
+                _, uncertainty_reason, _ = self.uncertainty_detector.route(item_factors, eczema_probability)
+            if prediction_state == "Eczema":
+                eczema.append(index)
+            
+            row.update(
+                eczema_probability=eczema_probability,
+                prediction=prediction_state,
+                confidence=round(float(decisions["confidence"][index]), 4),
+                uncertainty_reason=uncertainty_reason
+            )
+        
+        if eczema:
+            severities = self.severity_estimator.estimate_severity_batch(
+                pixels[eczema],
+                [probabilities[index] for index in eczema],
+                [predictions[index] for index in eczema],
+                features=[severity_features[index] for index in eczema]
+            )
+            for index, severity in zip(eczema, severities):
+                rows[index]["severity"] = severity
+    
+    async def _assess(self, row, upload):
+        await self.limiter.wait()
+        _, assessment, confidence = await self.llm_service.assess_image(upload)
+        row["gemini_assessment"] = assessment
+        row["gemini_confidence"] = confidence
+        upload.release_image()
+
+
+async def load_services(args):
+    model_path = os.getenv("MODEL_PATH", "models/eczema_detector_efficientnet.h5")
+    if not os.path.exists(model_path):
+        log(f"❌ Model not found at {model_path} (set MODEL_PATH)")
+        sys.exit(1)
+    from app.services.model_service import ModelService
+    model_service = ModelService(model_path, return_embedding=embedding_mode_requested() or None)
+    await model_service.load_model()
+    
+    llm_service = None
+    if args.gemini:
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            log("❌ --gemini requires GEMINI_API_KEY")
+            sys.exit(1)
+        from app.services.llm_service import LLMService
+        llm_service = LLMService(api_key, os.getenv("GEMINI_MODEL", "gemini-1.5-pro"))
+    return model_service, llm_service
+
+
+async def score(args):
+    args.input_dir = args.input_dir.resolve()
+    files = find_images(args.input_dir, args.recursive)
+    if not files:
+        log(f"❌ No images found in {args.input_dir}")
+        return
+    
+    if args.format == "parquet":
+        sink = ParquetSink(args.output, rows_per_part=args.rows_per_part)
+    else:
+        sink = JsonlSink(args.output)
+    
+    if args.overwrite and args.output.exists():
+        if args.output.is_dir():
+            for part in args.output.iterdir():
+                part.unlink()
+        else:
+            args.output.unlink()
+    done = sink.completed()
+    todo = [p for p in files if p.relative_to(args.input_dir).as_posix() not in done]
+    
+    log("=" * 60)
+    log(f"BULK SCORING: {len(files)} images in {args.input_dir}")
+    log(f"Resuming: {len(files) - len(todo)} already scored, {len(todo)} to go" if done else f"Scoring {len(todo)} images")
+    log(f"Output: {args.output} ({args.format}), batch {args.batch_size}, {args.workers} workers"
+        + (f", Gemini at {args.gemini_rate}/s" if args.gemini else ""))
+    log("=" * 60)
+    
+    # Service logs are per-image; keep them off stdout unless asked for
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with quiet:
+        model_service, llm_service = await load_services(args)
+        scorer = BulkScorer(args, model_service, llm_service)
+        progress = Progress(len(todo), args.report_every)
+        
+        batches = [todo[i:i + args.batch_size] for i in range(0, len(todo), args.batch_size)]
+        try:
+            # Decode of the next batch overlaps scoring of the current one
+            pending = scorer.submit_decode(batches[0]) if batches else []
+            for index in range(len(batches)):
+                decoded = [await asyncio.wrap_future(future) for future in pending]
+                if index + 1 < len(batches):
+                    pending = scorer.submit_decode(batches[index + 1])
+                rows = await scorer.score_batch(decoded)
+                sink.write(rows)
+                progress.update(rows)
+        finally:
+            sink.close()
+            scorer.shutdown()
+    
+    progress.report(final=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a folder of images offline (resumable)")
+    parser.add_argument("input_dir", type=Path, help="Folder of images")
+    parser.add_argument("--output", type=Path, default=Path("scores.jsonl"),
+                        help="JSONL file, or directory of part files for --format parquet")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl", help="Output format")
+    parser.add_argument("--recursive", action="store_true", help="Include subfolders")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per inference batch")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Decode/heuristic worker threads")
+    parser.add_argument("--gemini", action="store_true", help="Also record Gemini's vision verdict")
+    parser.add_argument("--gemini-rate", type=float, default=1.0, help="Max Gemini requests per second")
+    parser.add_argument("--rows-per-part", type=int, default=1000, help="Rows per Parquet part file")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between throughput reports")
+    parser.add_argument("--overwrite", action="store_true", help="Discard existing output instead of resuming")
+    parser.add_argument("--verbose", action="store_true", help="Show per-image service logs")
+    args = parser.parse_args()
+    asyncio.run(score(args))
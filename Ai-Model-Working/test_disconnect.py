@@ -0,0 +1,101 @@
+"""
+Client Disconnect Test Script
+Sends an /analyze upload over a raw socket, closes the connection while the request
+is still running and checks that the service cancelled it (/health "disconnects")
+
+The analysis has to outlast --disconnect-after, e.g. run the service against a slow
+Gemini stand-in:
+    python fake_gemini_server.py --port 8090 --latency fixed:8000
+    GEMINI_API_KEY=test GEMINI_BASE_URL=http://127.0.0.1:8090/v1beta uvicorn app.main:app
+"""
+
+import argparse
+import os
+import socket
+import sys
+import time
+from urllib.parse import urlparse
+
+import requests
+
+TEST_IMAGES_DIR = "testing-images"
+BOUNDARY = "disconnect-test-boundary"
+
+
+def disconnect_stats(url: str):
+    """(cancelled requests, analysis slots in use) from /health"""
+    health = requests.get(f"{url}/health", timeout=5).json()
+    disconnects = health.get("disconnects")
+    if disconnects is None:
+        return None, None
+    admission = health.get("admission") or {}
+    return sum(disconnects["cancelled"].values()), admission.get("in_flight", 0)
+
+
+def send_and_abandon(url: str, image_path: str, disconnect_after: float):
+    """POST the image, then close the socket without reading the response"""
+    parsed = urlparse(url)
+    with open(image_path, "rb") as f:
+        image_bytes = f.read()
+    body = (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{os.path.basename(image_path)}"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + image_bytes + f"\r\n--{BOUNDARY}--\r\n".encode()
+    head = (
+        "POST /analyze HTTP/1.1\r\n"
+        f"Host: {parsed.netloc}\r\n"
+        f"Content-Type: multipart/form-data; boundary={BOUNDARY}\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n"
+    ).encode()
+    
+    connection = socket.create_connection((parsed.hostname, parsed.port or 80))
+    connection.sendall(head + body)
+    time.sleep(disconnect_after)
+    connection.close()
+
+
+def main(args):
+    print("=" * 60)
+    print(f"CLIENT DISCONNECT TEST → {args.url}")
+    print("=" * 60)
+    
+    try:
+        cancelled_before, in_flight_before = disconnect_stats(args.url)
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Service not reachable at {args.url}: {e}")
+        sys.exit(1)
+    if cancelled_before is None:
+        print("❌ Disconnect detection is disabled (DISCONNECT_POLL_SECONDS=0)")
+        sys.exit(1)
+    
+    print(f"\n📤 Uploading {args.image}, closing the connection after {args.disconnect_after:g}s")
+    send_and_abandon(args.url, args.image, args.disconnect_after)
+    
+    deadline = time.time() + args.wait
+    cancelled, in_flight = cancelled_before, None
+    while time.time() < deadline:
+        cancelled, in_flight = disconnect_stats(args.url)
+        if cancelled > cancelled_before and in_flight <= in_flight_before:
+            break
+        time.sleep(0.2)
+    
+    print(f"   Cancelled requests: {cancelled_before} → {cancelled}")
+    print(f"   Analysis slots in use: {in_flight_before} → {in_flight}")
+    if cancelled <= cancelled_before:
+        print(f"\n❌ The request was not cancelled within {args.wait:g}s (did it finish before the disconnect?)")
+        sys.exit(1)
+    if in_flight > in_flight_before:
+        print("\n❌ The request was cancelled but its analysis slot is still held")
+        sys.exit(1)
+    print("\n✅ Disconnect detected, request cancelled and its slot released")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that /analyze is cancelled when its client disconnects")
+    parser.add_argument("--url", default="http://localhost:8000", help="Service base URL")
+    parser.add_argument("--image", default=os.path.join(TEST_IMAGES_DIR, "eczema.jpg"), help="Image to upload")
+    parser.add_argument("--disconnect-after", type=float, default=2.0, help="Seconds before closing the connection")
+    parser.add_argument("--wait", type=float, default=5.0, help="Seconds to wait for the cancellation to show")
+    main(parser.parse_args())